@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+# Throughput and peak memory of the streaming convertTxtToJson on a synthetic export
+#   python bench_convert.py                  2 GB export made from clients_list.txt
+#   python bench_convert.py --size-mb 200 --keep
+import argparse
+import ast
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+CHILD = '''
+import resource, sys, time
+import convertTxtToJson
+start = time.perf_counter()
+count = convertTxtToJson.convert(sys.argv[1], sys.argv[2])
+print(count, time.perf_counter() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+'''
+
+
+def write_export(path, size_mb, source='clients_list.txt'):
+    # Same one-line format as the real export, the sample clients repeated with new row_ids
+    with open(source, 'r', encoding='utf-8') as f:
+        samples = ast.literal_eval(f.read())
+    target = size_mb * 1024 * 1024
+    written = 0
+    count = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('[')
+        while written < target:
+            client = dict(samples[count % len(samples)], row_id=count)
+            record = (', ' if count else '') + repr(client)
+            f.write(record)
+            written += len(record.encode('utf-8'))
+            count += 1
+        f.write(']')
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Streaming export conversion benchmark')
+    parser.add_argument('--size-mb', type=int, default=2048, help='size of the synthetic export')
+    parser.add_argument('--keep', action='store_true', help='keep the generated files')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='bench_convert_')
+    input_path = os.path.join(directory, 'clients_list.txt')
+    output_path = os.path.join(directory, 'output.jsonl')
+    try:
+        clients = write_export(input_path, args.size_mb)
+        here = os.path.dirname(os.path.abspath(__file__))
+        output = subprocess.run([sys.executable, '-c', CHILD, input_path, output_path], cwd=here,
+                                capture_output=True, text=True, check=True).stdout
+        count, seconds, max_rss_kb = output.split()
+        size = os.path.getsize(input_path)
+        report = {
+            'input_mb': round(size / 1024 / 1024, 1),
+            'clients': int(count),
+            'seconds': round(float(seconds), 2),
+            'mb_per_second': round(size / 1024 / 1024 / float(seconds), 1),
+            'clients_per_second': round(int(count) / float(seconds)),
+            'peak_rss_mb': round(int(max_rss_kb) / 1024, 1),
+            'ok': int(count) == clients,
+        }
+        print(json.dumps(report, indent=4))
+    finally:
+        if not args.keep:
+            for path in (input_path, output_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            os.rmdir(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+# Layout benchmark of text_layout on the sample results of output.json, the golden checks
+# also run with pytest (test_layout.py)
+#   python bench_layout.py            check against layout_golden.json and time the engine
+#   python bench_layout.py --update   rewrite layout_golden.json (needs slides.py importable)
+import configparser
+import json
+import sys
+import time
+
+import config as config_module
+import text_layout
+from settings import load_settings
+
+GOLDEN_PATH = 'layout_golden.json'
+
+# Sample SLIDES settings used for the golden file and the timings
+SAMPLE_SLIDES = {
+    'slides_paragraphs_fontsize': '12',
+    'slides_paragraphs_width': '600',
+    'slides_paragraphs_height': '300',
+    'slides_bloc_max_lines': '18',
+    'slides_lines_max_chars': '90',
+    'slides_title_max_chars': '60',
+    'slides_title_paragraph_min_space': '3',
+    'slides_paragraphs_min_space': '2',
+    'slides_paragraphs_translateX': '50',
+    'slides_paragraphs_translateY': '80',
+    'slides_first_title_page': '2',
+    'slides_template_id': 'template',
+    'slides_folder_to_check_id': 'to_check',
+    'slides_folder_sent_id': 'sent',
+}
+
+
+class SampleConfig(configparser.ConfigParser):
+    # Same shape as the config object given to results_to_slides
+    slides_titles = config_module.slides_titles
+    slides_subtitles = config_module.slides_subtitles
+    slides_introductions = config_module.slides_introductions
+    intel_results_enabled = config_module.intel_results_enabled
+
+
+def sample_config(version='holibotscriptdev'):
+    config = SampleConfig()
+    config.read_dict({'SLIDES': SAMPLE_SLIDES,
+                      'INTEL': {'intel_prompts_list': config_module.intel_prompts_list},
+                      'MIS': {'version': version}})
+    return config
+
+
+def sample_results(path='output.json'):
+    with open(path, 'r', encoding='utf-8') as f:
+        clients = json.load(f)
+    results = {}
+    for client in clients:
+        for key, value in client.items():
+            if key.startswith('Result ') and value not in ('', 'NULL'):
+                results[str(client['row_id']) + '/' + key[len('Result '):]] = value
+    return results
+
+
+def update_golden(results, settings):
+    from slides import split_to_blocs_chars
+
+    golden = {'settings': SAMPLE_SLIDES, 'results': {}}
+    for key, text in results.items():
+        golden['results'][key] = {
+            'chars': split_to_blocs_chars(text, settings),
+            'metrics': text_layout.layout_blocs(text, settings.layout),
+        }
+    with open(GOLDEN_PATH, 'w', encoding='utf-8') as f:
+        json.dump(golden, f, ensure_ascii=False, indent=1)
+    print('[INFO] ' + GOLDEN_PATH + ' updated')
+
+
+def bloc_lines(bloc, settings, metrics):
+    # Lines a bloc takes in the paragraph box, with a blank line between its paragraphs
+    paragraphs = [paragraph.split() for paragraph in bloc.split('\n\n') if paragraph.split()]
+    return sum(len(text_layout.wrap_words(words, metrics, settings.max_width)) for words in paragraphs) \
+        + len(paragraphs) - 1
+
+
+def same_text(chars_blocs, blocs, lines_max_chars):
+    # Same characters as the blocs of the character based splitter. When it cuts a line at a ','
+    # it turns the other ',' of that line into '.', at the start of its next bloc.
+    text = ''.join(''.join(blocs).split())
+    position = 0
+    for bloc in chars_blocs:
+        chunk = ''.join(bloc.split())
+        actual = text[position:position + len(chunk)]
+        if len(actual) != len(chunk) or any(a != c and not (i < lines_max_chars and (a, c) == (',', '.'))
+                                            for i, (a, c) in enumerate(zip(actual, chunk))):
+            return False
+        position += len(chunk)
+    return position == len(text)
+
+
+def check_golden(results, settings):
+    # Against the stored blocs of the character based splitter ('chars'): same text, and no
+    # bloc taller than the box. The engine's own previous output ('metrics') catches changes.
+    with open(GOLDEN_PATH, 'r', encoding='utf-8') as f:
+        golden = json.load(f)['results']
+    metrics = text_layout.get_metrics()
+    max_lines = settings.layout.max_lines
+    failures = []
+    report = {}
+    for key, text in results.items():
+        blocs = text_layout.layout_blocs(text, settings.layout)
+        chars_blocs = golden[key]['chars']
+        if not same_text(chars_blocs, blocs, settings.lines_max_chars):
+            failures.append(key + ': text differs from the character based splitter')
+        overflows = [i for i, bloc in enumerate(blocs) if bloc_lines(bloc, settings.layout, metrics) > max_lines]
+        if overflows:
+            failures.append(key + ': blocs ' + str(overflows) + ' overflow the box')
+        if blocs != golden[key]['metrics']:
+            failures.append(key + ': blocs differ from the previous layout')
+        report[key] = {
+            'slides_chars': len(chars_blocs),
+            'slides_metrics': len(blocs),
+            'overflowing_chars': sum(1 for bloc in chars_blocs if bloc_lines(bloc, settings.layout, metrics) > max_lines),
+        }
+    return failures, report
+
+
+def benchmark(results, settings, seconds=2.0):
+    texts = list(results.values())
+    laid_out = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        for text in texts:
+            text_layout.layout_blocs(text, settings.layout)
+        laid_out += len(texts)
+    return laid_out / (time.perf_counter() - start)
+
+
+def main(argv):
+    settings = load_settings(sample_config())
+    results = sample_results()
+    if '--update' in argv:
+        update_golden(results, settings)
+        return 0
+
+    failures, report = check_golden(results, settings)
+    output = {
+        'results': report,
+        'results_per_second': round(benchmark(results, settings)),
+        'failures': failures,
+    }
+    print(json.dumps(output, indent=4))
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
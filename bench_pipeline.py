@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+# End-to-end benchmark of results_to_slides against the fake Drive/Slides API
+#   python bench_pipeline.py                          1, 50 and 500 clients, both builders
+#   python bench_pipeline.py --sizes 1,50 --latency-ms 50 --output bench.json
+#   python bench_pipeline.py --real-quotas            keep the default per-minute quotas
+#   python bench_pipeline.py --real-quotas --identities 4   decks spread over 4 service accounts
+# Needs the packages of requirements.txt, no credentials and no network.
+import argparse
+import contextlib
+import copy
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import fake_google
+import googleapi
+import identities
+import rate_limiter
+import retry
+import slides
+from bench_layout import sample_config
+from settings import load_settings
+
+# Version of each builder, see make_client_slides
+BUILDERS = {'superpowers': 'freesuperpowersdev', 'holistic': 'holibotscriptdev'}
+
+
+def synthetic_clients(count, path='output.json'):
+    # Clients shaped like output.json, the paragraphs of each result are rotated
+    # so the decks are not all identical
+    with open(path, 'r', encoding='utf-8') as f:
+        base = [client for client in json.load(f) if client['Result Identity & Perso5'] not in ('', 'NULL')][0]
+    clients = []
+    for i in range(count):
+        client = copy.deepcopy(base)
+        client['row_id'] = 1000 + i
+        client['UID'] = 'bench' + str(i) + '@example.com'
+        client['Slides link'] = ''
+        for key, value in client.items():
+            if key.startswith('Result ') and value not in ('', 'NULL'):
+                paragraphs = value.split('\n\n')
+                shift = i % len(paragraphs)
+                client[key] = '\n\n'.join(paragraphs[shift:] + paragraphs[:shift])
+        clients.append(client)
+    return clients
+
+
+def bench_config(version, real_quotas, identities_dir=''):
+    config = sample_config(version)
+    # Decks spread over the service accounts of this directory, see identities
+    config.read_dict({'QUOTA': {'service_accounts_dir': identities_dir}})
+    # Every run builds all its decks, nothing is resumed or read from the cache of a previous run
+    config.read_dict({'SLIDES': {'slides_journal_path': '', 'slides_cache_dir': '', 'slides_template_index_dir': ''}})
+    # One fake template per layout, the index of one is never used for the other
+    config.read_dict({'SLIDES': {'slides_template_id': 'template_' + fake_google.template_layout(version)}})
+    if not real_quotas:
+        # Measure the pipeline itself, not the waits of the production quotas
+        config.read_dict({'QUOTA': {name + '_per_minute': '1000000' for name in rate_limiter.DEFAULT_QUOTAS}})
+    return config
+
+
+def fake_identities_dir(count):
+    # Placeholder keys, the fake API never reads them
+    directory = tempfile.mkdtemp(prefix='bench_identities_')
+    for i in range(count):
+        with open(os.path.join(directory, 'sa' + str(i) + '.json'), 'w') as f:
+            f.write('{}')
+    return directory
+
+
+def run_pipeline(builder, count, latency_ms, real_quotas, identities_count=1):
+    version = BUILDERS[builder]
+    identities_dir = fake_identities_dir(identities_count) if identities_count > 1 else ''
+    config = bench_config(version, real_quotas, identities_dir)
+    settings = load_settings(config)
+    backend = fake_google.FakeGoogleBackend(latency=latency_ms / 1000.0)
+    backend.add_template(settings.template_id, settings.first_title_page, settings.folder_to_check_id,
+                         fake_google.template_layout(version))
+    googleapi.use_fake_backend(backend)
+    clients = synthetic_clients(count)
+
+    retries_before = retry.retry_totals()
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    with contextlib.redirect_stdout(io.StringIO()):
+        slides.results_to_slides(clients, config, version)
+    wall = time.perf_counter() - start
+    if identities_dir:
+        shutil.rmtree(identities_dir)
+    cpu = time.process_time() - cpu_start
+    retries_after = retry.retry_totals()
+
+    stats = backend.stats()
+    decks = len(backend.presentations) - 1  # without the template
+    slides_count = sum(len(backend.slide_texts(presentation_id)) for presentation_id in backend.presentations
+                       if presentation_id != settings.template_id)
+    calls = sum(stats['calls'].values())
+    per_deck = max(decks, 1)
+    return {
+        'builder': builder,
+        'clients': count,
+        'decks': decks,
+        'wall_s': round(wall, 3),
+        'wall_per_deck_s': round(wall / per_deck, 4),
+        'slides_per_deck': round(slides_count / per_deck, 1),
+        'calls_per_deck': {endpoint: round(value / per_deck, 2) for endpoint, value in stats['calls'].items()},
+        'batch_requests_per_deck': round(sum(stats['batch_requests'].values()) / per_deck, 1),
+        'bytes_sent': sum(stats['bytes_in'].values()),
+        'bytes_sent_per_deck': round(sum(stats['bytes_in'].values()) / per_deck),
+        'time_s': {
+            'cpu': round(cpu, 3),
+            'api_latency': round(calls * latency_ms / 1000.0, 3),
+            'throttle_wait': round(sum(rate_limiter.waited_seconds().values()), 3),
+            'retry_sleep': round(retries_after.get('slept', 0) - retries_before.get('slept', 0), 3),
+        },
+        'errors': stats['errors'],
+        'decks_per_identity': {name: value['decks'] for name, value in identities.stats().items()},
+    }
+
+
+def time_function(func, seconds=1.0):
+    # Mean microseconds per call over a fixed time budget
+    calls = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        func()
+        calls += 1
+    return round((time.perf_counter() - start) / calls * 1e6, 1)
+
+
+def microbenchmarks():
+    config = sample_config(BUILDERS['superpowers'])
+    settings = load_settings(config)
+    client = synthetic_clients(1)[0]
+    text = client['Result Identity & Perso1']
+    results_list = slides.get_results_list(client, settings.results_enabled)
+    return {
+        'split_to_blocs_us': time_function(lambda: slides.split_to_blocs(text, settings)),
+        'add_paragraph_us': time_function(lambda: slides.add_paragraph(settings, 'page_id_00001', text)),
+        'build_slides_data_us': time_function(lambda: slides.build_slides_data(
+            settings, client, settings.slides_titles_list, settings.prompt_groups, results_list)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Deck generation throughput against the fake API')
+    parser.add_argument('--sizes', default='1,50,500', help='comma separated client counts')
+    parser.add_argument('--latency-ms', type=int, default=20, help='simulated latency of each API call')
+    parser.add_argument('--real-quotas', action='store_true', help='keep the default per-minute quotas')
+    parser.add_argument('--identities', type=int, default=1, help='service accounts to spread the decks over')
+    parser.add_argument('--output', help='also write the report to this JSON file')
+    args = parser.parse_args()
+
+    report = {
+        'latency_ms': args.latency_ms,
+        'identities': args.identities,
+        'runs': [run_pipeline(builder, int(size), args.latency_ms, args.real_quotas, args.identities)
+                 for builder in BUILDERS for size in args.sizes.split(',')],
+        'micro': microbenchmarks(),
+    }
+    output = json.dumps(report, indent=4)
+    print(output)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
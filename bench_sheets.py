@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+# Clients sheet round-trips of sheets.run_from_sheet against a fake worksheet and the fake
+# Drive/Slides API, compared with one write per row
+#   python bench_sheets.py                            50 and 200 clients
+#   python bench_sheets.py --sizes 200 --flush-clients 25 --sheet-latency-ms 200
+# Needs the packages of requirements.txt, no credentials and no network.
+import argparse
+import contextlib
+import io
+import json
+import time
+
+import fake_google
+import googleapi
+import sheets
+from bench_pipeline import BUILDERS, bench_config, synthetic_clients
+from settings import load_settings
+
+
+def sheet_rows(clients):
+    # Header and rows of the clients, like the clients sheet, the sheet row is the row_id
+    header = [key for key in clients[0] if key != 'row_id']
+    return [header] + [[str(client[key]) for key in header] for client in clients]
+
+
+def run_sheet(count, flush_clients, sheet_latency_ms, fail_writes=0):
+    version = BUILDERS['superpowers']
+    config = bench_config(version, real_quotas=False)
+    config.read_dict({'SHEET': {'sheet_flush_clients': str(flush_clients), 'sheet_flush_seconds': '3600'}})
+    settings = load_settings(config)
+    backend = fake_google.FakeGoogleBackend()
+    backend.add_template(settings.template_id, settings.first_title_page, settings.folder_to_check_id,
+                         fake_google.template_layout(version))
+    googleapi.use_fake_backend(backend)
+    clients = synthetic_clients(count)
+    worksheet = fake_google.FakeWorksheet(sheet_rows(clients), latency=sheet_latency_ms / 1000.0)
+    worksheet.fail_writes = fail_writes
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        sheets.run_from_sheet(config, version, worksheet=worksheet)
+    wall = time.perf_counter() - start
+
+    # Every deck of the fake API has its link on the row of its client
+    links = {row['Slides link'].split('/')[-2] for row in worksheet.records() if row['Slides link']}
+    decks = set(backend.presentations) - {settings.template_id}
+    statuses = {row['Status'] for row in worksheet.records()}
+    requests = worksheet.calls['get_values'] + worksheet.calls['batch_update']
+    return {
+        'clients': count,
+        'flush_clients': flush_clients,
+        'decks': len(decks),
+        'links_match_decks': links == decks,
+        'statuses': sorted(statuses),
+        'sheet_reads': worksheet.calls['get_values'],
+        'sheet_writes': worksheet.calls['batch_update'],
+        'sheet_requests': requests,
+        # One read per row and one write per row, like updating each client alone
+        'sheet_requests_per_row': 2 * count,
+        'sheet_seconds_saved': round((2 * count - requests) * sheet_latency_ms / 1000.0, 2),
+        'wall_s': round(wall, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Clients sheet read and write-back against a fake worksheet')
+    parser.add_argument('--sizes', default='50,200', help='comma separated client counts')
+    parser.add_argument('--flush-clients', type=int, default=50, help='clients per write-back')
+    parser.add_argument('--sheet-latency-ms', type=int, default=100, help='simulated latency of each sheet call')
+    parser.add_argument('--output', help='also write the report to this JSON file')
+    args = parser.parse_args()
+
+    report = {
+        'sheet_latency_ms': args.sheet_latency_ms,
+        'runs': [run_sheet(int(size), args.flush_clients, args.sheet_latency_ms)
+                 for size in args.sizes.split(',')],
+        # A write-back answered with a 429 is sent again, nothing is lost
+        'throttled_write': run_sheet(20, 10, 0, fail_writes=1),
+    }
+    output = json.dumps(report, indent=4)
+    print(output)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
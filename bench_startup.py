@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+# Startup benchmark: time from process start until googleapi.get_drive_srv and
+# get_slides_srv return, on the first (cold) call and the cached call of the same thread.
+# The services talk to the fake backend, so no credentials and no network are needed.
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+CHILD = '''
+import sys
+import time
+start = time.perf_counter()
+import googleapi
+imported = time.perf_counter()
+# Real runs never load fake_google
+loaded_fake = 'fake_google' in sys.modules
+import fake_google
+googleapi.use_fake_backend(fake_google.FakeGoogleBackend())
+fake = time.perf_counter()
+googleapi.get_drive_srv()
+googleapi.get_slides_srv()
+ready = time.perf_counter()
+googleapi.get_drive_srv()
+googleapi.get_slides_srv()
+cached = time.perf_counter()
+print(imported - start, ready - fake, cached - ready, int(loaded_fake))
+'''
+
+
+def run_once():
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, '-c', CHILD], capture_output=True, text=True, check=True).stdout
+    total = time.perf_counter() - start
+    import_time, cold_time, cached_time, loaded_fake = output.split()
+    return total, float(import_time), float(cold_time), float(cached_time), loaded_fake == '1'
+
+
+def main(runs=10):
+    samples = [run_once() for _ in range(runs)]
+    report = {
+        'runs': runs,
+        'process_to_ready_s': statistics.median(sample[0] for sample in samples),
+        'import_googleapi_s': statistics.median(sample[1] for sample in samples),
+        'first_get_services_s': statistics.median(sample[2] for sample in samples),
+        'cached_get_services_s': statistics.median(sample[3] for sample in samples),
+        'fake_google_loaded_by_import': any(sample[4] for sample in samples),
+    }
+    print(json.dumps(report, indent=4))
+    return report
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10)
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+# Content-addressed disk cache of laid-out blocs and compiled requests.
+# Keys are hashes of everything the value depends on, so an entry never needs
+# to be invalidated: changed inputs give a new key and old entries age out of
+# the LRU. Bump CACHE_VERSION when the layout or the requests code changes.
+import collections
+import hashlib
+import json
+import os
+import threading
+
+CACHE_VERSION = 2
+
+
+def content_key(kind, *parts):
+    data = json.dumps([CACHE_VERSION, kind, parts], ensure_ascii=False, sort_keys=True, default=list)
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+class DiskCache:
+    # One JSON file per entry, evicted least recently used first once max_bytes is reached.
+    # The order survives restarts through the file modification times.
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+        self.total = 0
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        found = []
+        for root, dirs, files in os.walk(directory):
+            for name in files:
+                if name.endswith('.json'):
+                    stat = os.stat(os.path.join(root, name))
+                    found.append((stat.st_mtime, name[:-5], stat.st_size))
+        for mtime, key, size in sorted(found):
+            self.entries[key] = size
+            self.total += size
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.json')
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+        try:
+            with open(self.path(key), 'r', encoding='utf-8') as f:
+                value = json.load(f)
+            os.utime(self.path(key))
+        except (OSError, ValueError):
+            # Removed or half written by another process, treated as a miss
+            with self.lock:
+                self.total -= self.entries.pop(key, 0)
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+        return value
+
+    def put(self, key, value):
+        data = json.dumps(value, ensure_ascii=False)
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + '.' + str(threading.get_ident()) + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        size = os.path.getsize(path)
+        with self.lock:
+            self.total += size - self.entries.pop(key, 0)
+            self.entries[key] = size
+            evicted = []
+            while self.total > self.max_bytes and len(self.entries) > 1:
+                old_key, old_size = self.entries.popitem(last=False)
+                self.total -= old_size
+                evicted.append(old_key)
+        for old_key in evicted:
+            try:
+                os.remove(self.path(old_key))
+            except OSError:
+                pass
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.entries),
+                    'bytes': self.total, 'hit_rate': self.hits / lookups if lookups else 0.0}
+
+
+_cache = None
+
+
+def open_cache(directory, max_mb):
+    global _cache
+    _cache = DiskCache(directory, max_mb * 1024 * 1024) if directory else None
+    return _cache
+
+
+def get_cache():
+    return _cache
+
+
+def close_cache():
+    global _cache
+    if _cache is not None:
+        stats = _cache.stats()
+        print('[INFO]🖼️ Content cache: ' + str(stats['hits']) + ' hit(s), ' + str(stats['misses']) + ' miss(es), '
+              + str(stats['entries']) + ' entries, ' + str(round(stats['bytes'] / 1024 / 1024, 1)) + ' MB')
+    _cache = None
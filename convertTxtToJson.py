@@ -1,26 +1,119 @@
 import json
 import ast
+import re
+import sys
 
-# Read the 'clients_list.txt' file
-with open('clients_list.txt', 'r') as file:
-    lines = file.readlines()
+# Converts the clients export (a Python list of dicts on one line, like clients_list.txt)
+# record by record, so memory stays at about one client whatever the file size.
+#   python convertTxtToJson.py [clients_list.txt] [output.jsonl]
+# The output is JSON Lines, or a JSON array like before when it ends with .json
 
-# Convert to a dictionary
-try:
-    # Use ast.literal_eval to safely evaluate the string as a Python object
-    dictionary_list = ast.literal_eval(lines[0])
-except (ValueError, SyntaxError) as e:
-    print("Error parsing string:", e)
+CHUNK_SIZE = 1 << 20
 
-# Convert the list of dictionaries to JSON format if needed
-json_output = json.dumps(dictionary_list, indent=4)
+# Characters that change the parser state outside and inside a string
+OUTSIDE_PATTERN = re.compile(r'[{}\'"]')
+INSIDE_PATTERNS = {"'": re.compile(r"['\\]"), '"': re.compile(r'["\\]')}
 
-# Output the resulting dictionary
-print(json_output)
 
+def iter_records(file, parse=ast.literal_eval, chunk_size=CHUNK_SIZE):
+    # Yields each top level {...} of the list, only the current record is kept in memory
+    buffer = ''
+    position = 0
+    depth = 0
+    quote = None
+    start = 0
+    while True:
+        chunk = file.read(chunk_size)
+        if not chunk:
+            break
+        buffer += chunk
+        while True:
+            if quote:
+                match = INSIDE_PATTERNS[quote].search(buffer, position)
+                if match is None:
+                    position = len(buffer)
+                    break
+                if match.group() == '\\':
+                    if match.end() == len(buffer):
+                        # The escaped character is in the next chunk
+                        position = match.start()
+                        break
+                    position = match.end() + 1
+                    continue
+                quote = None
+                position = match.end()
+                continue
 
-# Write the list of dictionaries as a JSON file
-with open('output.json', 'w') as json_file:
-    json.dump(json.loads(json_output), json_file, indent=4)
+            match = OUTSIDE_PATTERN.search(buffer, position)
+            if match is None:
+                position = len(buffer)
+                break
+            char = match.group()
+            position = match.end()
+            if char in '\'"':
+                quote = char
+            elif char == '{':
+                if depth == 0:
+                    start = match.start()
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    yield parse(buffer[start:position])
+                    buffer = buffer[position:]
+                    position = 0
+        if depth == 0 and not quote:
+            # Only separators between records are left
+            buffer = buffer[position:]
+            position = 0
+    if depth or quote:
+        raise ValueError('Unexpected end of file inside a record')
 
-print("JSON file with list of dictionaries has been generated successfully.")
+
+def iter_clients(path):
+    # Clients of a .txt export, a .jsonl file or a .json array, one dict at a time
+    with open(path, 'r', encoding='utf-8') as file:
+        if path.endswith('.jsonl'):
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from iter_records(file, json.loads if path.endswith('.json') else ast.literal_eval)
+
+
+def write_jsonl(records, output):
+    count = 0
+    for record in records:
+        output.write(json.dumps(record) + '\n')
+        count += 1
+    return count
+
+
+def write_json_array(records, output):
+    # Same layout as json.dump(clients, indent=4), written one record at a time
+    count = 0
+    output.write('[')
+    for record in records:
+        output.write((',\n' if count else '\n') + '\n'.join('    ' + line for line in
+                                                           json.dumps(record, indent=4).split('\n')))
+        count += 1
+    output.write('\n]' if count else ']')
+    return count
+
+
+def convert(input_path, output_path):
+    with open(output_path, 'w') as output:
+        if output_path.endswith('.json'):
+            return write_json_array(iter_clients(input_path), output)
+        return write_jsonl(iter_clients(input_path), output)
+
+
+if __name__ == '__main__':
+    input_path = sys.argv[1] if len(sys.argv) > 1 else 'clients_list.txt'
+    output_path = sys.argv[2] if len(sys.argv) > 2 else 'output.jsonl'
+    try:
+        count = convert(input_path, output_path)
+    except (ValueError, SyntaxError) as e:
+        print("Error parsing string:", e)
+        sys.exit(1)
+    print(str(count) + " clients written to " + output_path)
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+import rate_limiter
+
+
+# Only the IDs are needed to locate templates and detect slides made by a previous run
+DECK_FIELDS = 'slides(objectId,pageElements(objectId))'
+
+
+class DeckModel:
+    # In-memory view of a presentation (slide order and object IDs), kept in sync
+    # locally with the requests sent instead of downloading the deck again
+    def __init__(self, presentation_id, slides):
+        self.presentation_id = presentation_id
+        self.slide_ids = []
+        self.object_ids = set()
+        # Elements of each slide, dropped with their slide by deleteObject
+        self.slide_elements = {}
+        for slide in slides or []:
+            self.slide_ids.append(slide['objectId'])
+            self.object_ids.add(slide['objectId'])
+            self.slide_elements[slide['objectId']] = set()
+            for element in slide.get('pageElements', []):
+                self.object_ids.add(element['objectId'])
+                self.slide_elements[slide['objectId']].add(element['objectId'])
+
+    @classmethod
+    def from_server(cls, slides_service, presentation_id):
+        presentation = rate_limiter.execute(slides_service.presentations().get(presentationId=presentation_id,
+                                                                               fields=DECK_FIELDS), 'slides_read')
+        return cls(presentation_id, presentation.get('slides'))
+
+    def copy_for(self, presentation_id):
+        # Drive copies of a presentation keep the object IDs of the original
+        deck = DeckModel(presentation_id, [])
+        deck.slide_ids = list(self.slide_ids)
+        deck.object_ids = set(self.object_ids)
+        deck.slide_elements = {slide_id: set(elements) for slide_id, elements in self.slide_elements.items()}
+        return deck
+
+    def slide_id_at(self, page):
+        # page is 1-based like slides_first_title_page
+        return self.slide_ids[page - 1]
+
+    def __contains__(self, object_id):
+        return object_id in self.object_ids
+
+    def apply(self, requests):
+        for request in requests:
+            if 'duplicateObject' in request:
+                source_id = request['duplicateObject']['objectId']
+                new_id = request['duplicateObject']['objectIds'][source_id]
+                self.object_ids.add(new_id)
+                if source_id in self.slide_ids:
+                    self.slide_ids.insert(self.slide_ids.index(source_id) + 1, new_id)
+                    self.slide_elements[new_id] = set()
+            elif 'updateSlidesPosition' in request:
+                moved_ids = request['updateSlidesPosition']['slideObjectIds']
+                index = request['updateSlidesPosition']['insertionIndex']
+                # insertionIndex is based on the arrangement before the move
+                index -= len([i for i in moved_ids if self.slide_ids.index(i) < index])
+                self.slide_ids = [i for i in self.slide_ids if i not in moved_ids]
+                self.slide_ids[index:index] = moved_ids
+            elif 'createShape' in request:
+                object_id = request['createShape']['objectId']
+                self.object_ids.add(object_id)
+                self.slide_elements.setdefault(request['createShape']['elementProperties']['pageObjectId'],
+                                               set()).add(object_id)
+            elif 'deleteObject' in request:
+                object_id = request['deleteObject']['objectId']
+                self.object_ids.discard(object_id)
+                if object_id in self.slide_ids:
+                    self.slide_ids.remove(object_id)
+                    self.object_ids -= self.slide_elements.pop(object_id, set())
+                else:
+                    for elements in self.slide_elements.values():
+                        elements.discard(object_id)
+
+    def verify(self, slides_service):
+        server_deck = DeckModel.from_server(slides_service, self.presentation_id)
+        if server_deck.slide_ids != self.slide_ids:
+            print('[WARNING]⚠️ Local slides order differs from presentation ' + self.presentation_id)
+            self.slide_ids = server_deck.slide_ids
+            self.object_ids = server_deck.object_ids
+            self.slide_elements = server_deck.slide_elements
+            return False
+        return True
+
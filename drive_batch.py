@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+# Bulk Drive operations (move, rename, delete, share) sent as multipart batch requests,
+# up to BATCH_LIMIT calls per round-trip. Each call still counts against the quota, and
+# only the calls of a batch that failed with a retryable status are sent again.
+import threading
+import time
+
+import googleapi
+import identities
+import rate_limiter
+from retry import RETRYABLE_STATUSES, backoff_delay, error_status, retry_after, retry_function
+
+# Calls per batch request accepted by Drive
+BATCH_LIMIT = 100
+
+
+def send_chunk(drive_service, chunk, bucket_name, type_label, results):
+    # Sends up to BATCH_LIMIT (key, request) in one HTTP request, returns the ones to retry
+    replies = {}
+
+    def callback(request_id, response, exception):
+        replies[request_id] = (response, exception)
+
+    def execute():
+        batch = drive_service.new_batch_http_request(callback=callback)
+        for i, (key, request) in enumerate(chunk):
+            batch.add(request, request_id=str(i))
+        rate_limiter.execute(batch, bucket_name, tokens=len(chunk))
+
+    # A failure of the whole batch (429, 5xx on the batch endpoint) sends it again
+    retry_function(execute, type_label=type_label)
+    failed = []
+    for i, (key, request) in enumerate(chunk):
+        response, error = replies.get(str(i), (None, None))
+        if error is not None and error_status(error) in RETRYABLE_STATUSES:
+            failed.append((key, request, error))
+        else:
+            results[key] = (response, error)
+    return failed
+
+
+def execute_batch(drive_service, requests, bucket_name='drive_write', type_label='drive_batch', max_retries=5):
+    # requests is {key: googleapiclient request}, all counted against bucket_name.
+    # Returns {key: (response, error)}, error is None for the calls that succeeded.
+    results = {}
+    pending = list(requests.items())
+    attempt = 0
+    while pending:
+        failed = []
+        for start in range(0, len(pending), BATCH_LIMIT):
+            failed += send_chunk(drive_service, pending[start:start + BATCH_LIMIT], bucket_name, type_label,
+                                 results)
+        if not failed:
+            break
+        if attempt >= max_retries:
+            print('[WARNING]⚠️ Too many retries for ' + str(len(failed)) + ' call(s) of ' + type_label)
+            for key, request, error in failed:
+                results[key] = (None, error)
+            break
+        delay = max(retry_after(error) or backoff_delay(attempt, 1.0, 64.0) for key, request, error in failed)
+        print(f'[WARNING]⚠️ {len(failed)} call(s) of {type_label} failed - Retry in {delay:.1f}sec')
+        time.sleep(delay)
+        attempt += 1
+        pending = [(key, request) for key, request, error in failed]
+    return results
+
+
+def errors_of(results, ignore_statuses=()):
+    return {key: error for key, (response, error) in results.items()
+            if error is not None and error_status(error) not in ignore_statuses}
+
+
+def delete_files(drive_service, file_ids):
+    # {file_id: error} of the files that could not be deleted, already deleted ones are fine
+    results = execute_batch(drive_service, {file_id: drive_service.files().delete(fileId=file_id)
+                                            for file_id in file_ids}, 'drive_write', 'delete_files')
+    return errors_of(results, ignore_statuses=(404,))
+
+
+def file_names(drive_service, file_ids):
+    # ({file_id: name}, {file_id: error})
+    results = execute_batch(drive_service, {file_id: drive_service.files().get(fileId=file_id, fields='name')
+                                            for file_id in file_ids}, 'drive_read', 'get_names')
+    return ({file_id: response['name'] for file_id, (response, error) in results.items() if error is None},
+            errors_of(results))
+
+
+def rename_files(drive_service, names):
+    # names is {file_id: new name}
+    results = execute_batch(drive_service, {file_id: drive_service.files().update(
+        fileId=file_id, body={'name': name}, fields='id') for file_id, name in names.items()},
+        'drive_write', 'rename_files')
+    return errors_of(results)
+
+
+def move_files(drive_service, file_ids, folder_id, from_folder_id=None):
+    # Moves the files into folder_id. Without from_folder_id their parents are read first,
+    # in batches too, instead of one files().get per file.
+    if from_folder_id is None:
+        parents = execute_batch(drive_service, {file_id: drive_service.files().get(fileId=file_id, fields='parents')
+                                                for file_id in file_ids}, 'drive_read', 'get_parents')
+        errors = errors_of(parents)
+        removed = {file_id: ','.join(response.get('parents', [])) for file_id, (response, error)
+                   in parents.items() if error is None}
+    else:
+        errors = {}
+        removed = {file_id: from_folder_id for file_id in file_ids}
+    results = execute_batch(drive_service, {file_id: drive_service.files().update(
+        fileId=file_id, addParents=folder_id, removeParents=remove_parents, fields='id, parents')
+        for file_id, remove_parents in removed.items()}, 'drive_write', 'move_files')
+    errors.update(errors_of(results))
+    return errors
+
+
+def share_files(drive_service, permissions, send_notification_email=False):
+    # permissions is {file_id: Drive permission}, e.g. {'type': 'user', 'role': 'reader', 'emailAddress': ...}.
+    # Returns ({file_id: permission_id}, {file_id: error})
+    results = execute_batch(drive_service, {file_id: drive_service.permissions().create(
+        fileId=file_id, body=permission, sendNotificationEmail=send_notification_email, fields='id')
+        for file_id, permission in permissions.items()}, 'drive_write', 'share_files')
+    return ({file_id: response['id'] for file_id, (response, error) in results.items() if error is None},
+            errors_of(results))
+
+
+def find_permissions(drive_service, emails):
+    # emails is {file_id: email address}. Returns ({file_id: permission_id}, {file_id: error}),
+    # a file not shared with its address has no permission_id and no error
+    results = execute_batch(drive_service, {file_id: drive_service.permissions().list(
+        fileId=file_id, fields='permissions(id,emailAddress)') for file_id in emails}, 'drive_read',
+        'find_permissions')
+    permission_ids = {}
+    for file_id, (response, error) in results.items():
+        for permission in (response or {}).get('permissions', []):
+            if permission.get('emailAddress', '').lower() == emails[file_id].lower():
+                permission_ids[file_id] = permission['id']
+    return permission_ids, errors_of(results)
+
+
+def unshare_files(drive_service, permission_ids):
+    # permission_ids is {file_id: permission_id}, as returned by share_files or find_permissions
+    results = execute_batch(drive_service, {file_id: drive_service.permissions().delete(
+        fileId=file_id, permissionId=permission_id) for file_id, permission_id in permission_ids.items()},
+        'drive_write', 'unshare_files')
+    return errors_of(results, ignore_statuses=(404,))
+
+
+class DeleteQueue:
+    # Files to delete at the end of the run, in batches, each by the identity that made it
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.file_ids = {}
+
+    def add(self, file_id):
+        with self.lock:
+            self.file_ids.setdefault(identities.current(), []).append(file_id)
+
+    def flush(self):
+        with self.lock:
+            pending = self.file_ids
+            self.file_ids = {}
+        for identity, file_ids in pending.items():
+            with identities.acting_as(identity):
+                errors = delete_files(googleapi.get_drive_srv(), file_ids)
+            for file_id, error in errors.items():
+                print('[WARNING]⚠️ Could not delete ' + file_id + ': ' + repr(error))
+            print('[INFO]🖼️🗑️ ' + str(len(file_ids) - len(errors)) + ' presentation(s) deleted in '
+                  + str(-(-len(file_ids) // BATCH_LIMIT)) + ' batch request(s)')
+
+
+_delete_queue = None
+
+
+def open_delete_queue():
+    global _delete_queue
+    _delete_queue = DeleteQueue()
+    return _delete_queue
+
+
+def queue_delete(file_id):
+    # False outside of a run, the caller then deletes the file itself
+    if _delete_queue is None:
+        return False
+    _delete_queue.add(file_id)
+    return True
+
+
+def close_delete_queue():
+    global _delete_queue
+    if _delete_queue is not None:
+        _delete_queue.flush()
+        _delete_queue = None
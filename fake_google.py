@@ -0,0 +1,538 @@
+# -*- coding: utf-8 -*-
+# In-process stand-in for the Drive v3 and Slides v1 endpoints used by slides.py.
+# FakeHttp replaces httplib2.Http under googleapiclient, so requests are serialized
+# and errors raised exactly like with the real API, without any network.
+# FakeWorksheet stands in for the gspread worksheet of the clients sheet.
+import collections
+import copy
+import email.parser
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from urllib.parse import parse_qs, unquote, urlparse
+
+import httplib2
+
+WRITE_METHODS = ('POST', 'PATCH', 'PUT', 'DELETE')
+# Calls per multipart batch request accepted by Drive
+DRIVE_BATCH_LIMIT = 100
+# Default 16:9 page text box, in EMU
+TEMPLATE_BOX_SIZE = {'width': {'magnitude': 8520600, 'unit': 'EMU'}, 'height': {'magnitude': 1400000, 'unit': 'EMU'}}
+
+
+class FakeApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def text_utf16_len(text):
+    return len(text) + sum(1 for char in text if ord(char) > 0xFFFF)
+
+
+class FakeGoogleBackend:
+    # Shared state of the fake Drive and Slides APIs, safe to use from several threads
+    def __init__(self, latency=0.0, error_rate=0.0, quotas=None, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        # {'slides_write': 60, ...} per minute, None for no quota
+        self.quotas = quotas or {}
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.files = {}
+        self.presentations = {}
+        self.calls = collections.Counter()
+        self.bytes_in = collections.Counter()
+        self.batch_requests = collections.Counter()
+        self.errors = collections.Counter()
+        self.windows = collections.defaultdict(collections.deque)
+        # The presentations.batchUpdate call of this number (from 1) gets a 400, None for none
+        self.fail_batch_update = None
+
+    # Seeding
+
+    def add_template(self, template_id, first_title_page=2, folder_id='root', layout='holistic'):
+        # Intro slides, then the main title (holistic layout only) and content templates, then a last slide
+        slides = []
+        for i in range(first_title_page - 1):
+            slides.append(self.new_slide('intro_' + str(i), ['Intro ' + str(i)]))
+        if layout == 'holistic':
+            slides.append(self.new_slide('main_title_template', ['{title}', '{subtitle}']))
+        slides.append(self.new_slide('content_template', ['{title}']))
+        slides.append(self.new_slide('last_slide', ['Merci']))
+        self.files[template_id] = {'id': template_id, 'name': 'Template', 'parents': [folder_id],
+                                   'mimeType': 'application/vnd.google-apps.presentation', 'version': '1',
+                                   'appProperties': {}}
+        self.presentations[template_id] = {'presentationId': template_id, 'slides': slides}
+
+    def new_slide(self, slide_id, texts):
+        return {'objectId': slide_id,
+                'pageElements': [{'objectId': slide_id + '_e' + str(i), 'shapeType': 'TEXT_BOX', 'text': text,
+                                  'styles': 0, 'size': TEMPLATE_BOX_SIZE,
+                                  'transform': {'scaleX': 1, 'scaleY': 1, 'translateX': 311700,
+                                                'translateY': 744575 + i * 1500000, 'unit': 'EMU'}}
+                                 for i, text in enumerate(texts)]}
+
+    # Transport
+
+    def handle(self, uri, method, body, identity='default', sleep=True):
+        url = urlparse(uri)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        payload = json.loads(body) if body else {}
+        endpoint, handler, args = self.route(url.path, method)
+        kind = endpoint.split('.')[0] + ('_write' if method in WRITE_METHODS else '_read')
+
+        if self.latency and sleep:
+            time.sleep(self.latency)
+        with self.lock:
+            self.calls[endpoint] += 1
+            self.bytes_in[endpoint] += len(body or b'')
+            if endpoint.endswith('batchUpdate'):
+                self.batch_requests[endpoint] += len(payload.get('requests', []))
+            try:
+                self.check_quota(kind, identity)
+                if self.error_rate and self.random.random() < self.error_rate:
+                    raise FakeApiError(429, 'Injected rate limit error')
+                if endpoint == 'slides.presentations.batchUpdate' and self.calls[endpoint] == self.fail_batch_update:
+                    raise FakeApiError(400, 'Injected invalid request')
+                return 200, handler(*args, query=query, body=payload)
+            except FakeApiError as e:
+                self.errors[str(e.status)] += 1
+                return e.status, {'error': {'code': e.status, 'message': e.message}}
+
+    def handle_batch(self, body, content_type, identity='default'):
+        # Multipart batch of Drive calls: one round-trip, each call is run and counted on its own
+        if self.latency:
+            time.sleep(self.latency)
+        message = email.parser.BytesParser().parsebytes(b'Content-Type: ' + content_type.encode('utf-8')
+                                                        + b'\r\n\r\n' + body)
+        parts = message.get_payload()
+        with self.lock:
+            self.calls['drive.batch'] += 1
+            if len(parts) > DRIVE_BATCH_LIMIT:
+                return 400, 'application/json; charset=UTF-8', json.dumps(
+                    {'error': {'code': 400, 'message': 'Too many requests in batch.'}}).encode('utf-8')
+        boundary = 'batch_' + uuid.uuid4().hex
+        chunks = []
+        for part in parts:
+            payload = part.get_payload()
+            request_line, rest = payload.split('\n', 1)
+            method, path, protocol = request_line.strip().split(' ')
+            sub_body = rest.replace('\r\n', '\n').split('\n\n', 1)[1] if '\n\n' in rest.replace('\r\n', '\n') \
+                else ''
+            status, content = self.handle('https://www.googleapis.com' + path, method,
+                                          sub_body.encode('utf-8') if sub_body else None, identity, sleep=False)
+            text = json.dumps(content) if content is not None else ''
+            status = 204 if content is None and status == 200 else status
+            content_id = part['Content-ID'][1:-1]
+            chunks.append('--' + boundary + '\r\nContent-Type: application/http\r\nContent-ID: <response-'
+                          + content_id + '>\r\n\r\nHTTP/1.1 ' + str(status) + ' ' + ('OK' if status < 400 else 'Error')
+                          + '\r\nContent-Type: application/json; charset=UTF-8\r\n\r\n' + text + '\r\n')
+        content = ''.join(chunks) + '--' + boundary + '--\r\n'
+        return 200, 'multipart/mixed; boundary=' + boundary, content.encode('utf-8')
+
+    def check_quota(self, kind, identity='default'):
+        # Quotas are per user like the real API, each service account has its own
+        limit = self.quotas.get(kind)
+        if not limit:
+            return
+        now = time.monotonic()
+        window = self.windows[(identity, kind)]
+        while window and now - window[0] > 60:
+            window.popleft()
+        if len(window) >= limit:
+            raise FakeApiError(429, 'Quota exceeded for ' + kind)
+        window.append(now)
+
+    def route(self, path, method):
+        path = unquote(path)
+        match = re.match(r'^/v1/presentations/([^/:]+)(:batchUpdate)?$', path)
+        if match:
+            if match.group(2):
+                return 'slides.presentations.batchUpdate', self.batch_update, (match.group(1),)
+            return 'slides.presentations.get', self.get_presentation, (match.group(1),)
+        match = re.match(r'^/drive/v3/files/([^/]+)/permissions(?:/([^/]+))?$', path)
+        if match:
+            if method == 'POST':
+                return 'drive.permissions.create', self.create_permission, (match.group(1),)
+            if method == 'GET':
+                return 'drive.permissions.list', self.list_permissions, (match.group(1),)
+            return 'drive.permissions.delete', self.delete_permission, (match.group(1), match.group(2))
+        match = re.match(r'^/drive/v3/files(?:/([^/]+))?(/copy)?$', path)
+        if match:
+            file_id = match.group(1)
+            if match.group(2):
+                return 'drive.files.copy', self.copy_file, (file_id,)
+            if file_id is None:
+                return 'drive.files.list', self.list_files, ()
+            handlers = {'GET': ('drive.files.get', self.get_file), 'PATCH': ('drive.files.update', self.update_file),
+                        'DELETE': ('drive.files.delete', self.delete_file)}
+            endpoint, handler = handlers[method]
+            return endpoint, handler, (file_id,)
+        raise ValueError('Fake API has no route for ' + method + ' ' + path)
+
+    # Drive
+
+    def get_existing_file(self, file_id):
+        if file_id not in self.files:
+            raise FakeApiError(404, 'File not found: ' + file_id)
+        return self.files[file_id]
+
+    def copy_file(self, file_id, query, body):
+        source = self.get_existing_file(file_id)
+        new_id = 'file_' + uuid.uuid4().hex[:20]
+        new_file = copy.deepcopy(source)
+        new_file.update({'id': new_id, 'name': body.get('name', 'Copy of ' + source['name']), 'version': '1',
+                         'appProperties': dict(body.get('appProperties', {}))})
+        new_file['parents'] = list(body.get('parents', source['parents']))
+        self.files[new_id] = new_file
+        if file_id in self.presentations:
+            # Drive copies keep the object IDs of the presentation
+            presentation = copy.deepcopy(self.presentations[file_id])
+            presentation['presentationId'] = new_id
+            self.presentations[new_id] = presentation
+        return dict(new_file)
+
+    def get_file(self, file_id, query, body):
+        return dict(self.get_existing_file(file_id))
+
+    def update_file(self, file_id, query, body):
+        file = self.get_existing_file(file_id)
+        if 'name' in body:
+            file['name'] = body['name']
+        for key, value in body.get('appProperties', {}).items():
+            if value is None:
+                file['appProperties'].pop(key, None)
+            else:
+                file['appProperties'][key] = value
+        if query.get('removeParents'):
+            removed = query['removeParents'].split(',')
+            file['parents'] = [parent for parent in file['parents'] if parent not in removed]
+        if query.get('addParents'):
+            file['parents'] += [parent for parent in query['addParents'].split(',') if parent not in file['parents']]
+        file['version'] = str(int(file['version']) + 1)
+        return dict(file)
+
+    def create_permission(self, file_id, query, body):
+        file = self.get_existing_file(file_id)
+        permission = dict(body, id='perm_' + uuid.uuid4().hex[:12])
+        file.setdefault('permissions', []).append(permission)
+        return permission
+
+    def list_permissions(self, file_id, query, body):
+        file = self.get_existing_file(file_id)
+        return {'permissions': [dict(permission) for permission in file.get('permissions', [])]}
+
+    def delete_permission(self, file_id, permission_id, query, body):
+        file = self.get_existing_file(file_id)
+        permissions = file.get('permissions', [])
+        if not any(permission['id'] == permission_id for permission in permissions):
+            raise FakeApiError(404, 'Permission not found: ' + permission_id)
+        file['permissions'] = [permission for permission in permissions if permission['id'] != permission_id]
+
+    def delete_file(self, file_id, query, body):
+        self.get_existing_file(file_id)
+        del self.files[file_id]
+        self.presentations.pop(file_id, None)
+        return None
+
+    def list_files(self, query, body):
+        q = query.get('q', '')
+        files = list(self.files.values())
+        for parent in re.findall(r"'([^']+)' in parents", q):
+            files = [file for file in files if parent in file['parents']]
+        for key, value in re.findall(r"appProperties has \{ key='([^']+)' and value='([^']+)' \}", q):
+            files = [file for file in files if file['appProperties'].get(key) == value]
+        for name in re.findall(r"name = '([^']+)'", q):
+            files = [file for file in files if file['name'] == name]
+        return {'files': [{'id': file['id'], 'name': file['name'], 'appProperties': dict(file['appProperties'])}
+                          for file in files]}
+
+    # Slides
+
+    def get_presentation(self, presentation_id, query, body):
+        if presentation_id not in self.presentations:
+            raise FakeApiError(404, 'Presentation not found: ' + presentation_id)
+        presentation = self.presentations[presentation_id]
+        return {
+            'presentationId': presentation_id,
+            'slides': [{'objectId': slide['objectId'],
+                        'pageElements': [{'objectId': element['objectId'],
+                                          'size': element.get('size'), 'transform': element.get('transform'),
+                                          'shape': {'shapeType': element['shapeType'],
+                                                    'text': {'textElements': [
+                                                        {'textRun': {'content': element['text']}}]}}}
+                                         for element in slide['pageElements']]}
+                       for slide in presentation['slides']]
+        }
+
+    def batch_update(self, presentation_id, query, body):
+        if presentation_id not in self.presentations:
+            raise FakeApiError(404, 'Presentation not found: ' + presentation_id)
+        # Requests are applied to a copy, the batch is atomic like the real API
+        presentation = copy.deepcopy(self.presentations[presentation_id])
+        replies = []
+        for i, request in enumerate(body.get('requests', [])):
+            if len(request) != 1:
+                raise FakeApiError(400, 'requests[' + str(i) + '] must have exactly one kind')
+            (kind, params), = request.items()
+            handler = getattr(self, 'request_' + kind, None)
+            if handler is None:
+                raise FakeApiError(400, 'requests[' + str(i) + ']: unsupported request ' + kind)
+            reply = handler(presentation, params)
+            replies.append({kind: reply} if reply is not None else {})
+        self.presentations[presentation_id] = presentation
+        self.files[presentation_id]['version'] = str(int(self.files[presentation_id]['version']) + 1)
+        return {'presentationId': presentation_id, 'replies': replies}
+
+    def all_ids(self, presentation):
+        ids = set()
+        for slide in presentation['slides']:
+            ids.add(slide['objectId'])
+            ids.update(element['objectId'] for element in slide['pageElements'])
+        return ids
+
+    def find_element(self, presentation, object_id):
+        for slide in presentation['slides']:
+            for element in slide['pageElements']:
+                if element['objectId'] == object_id:
+                    return slide, element
+        raise FakeApiError(400, 'The object (' + object_id + ') could not be found.')
+
+    def slide_index(self, presentation, slide_id):
+        for i, slide in enumerate(presentation['slides']):
+            if slide['objectId'] == slide_id:
+                return i
+        raise FakeApiError(400, 'The object (' + slide_id + ') could not be found.')
+
+    def check_new_id(self, presentation, object_id):
+        if not re.match(r'^[a-zA-Z0-9_][a-zA-Z0-9_\-:]{4,49}$', object_id):
+            raise FakeApiError(400, 'Invalid object ID ' + object_id)
+        if object_id in self.all_ids(presentation):
+            raise FakeApiError(400, 'The object ID (' + object_id + ') should be unique.')
+
+    def request_duplicateObject(self, presentation, params):
+        source_id = params['objectId']
+        object_ids = params.get('objectIds', {})
+        index = self.slide_index(presentation, source_id)
+        source = presentation['slides'][index]
+        new_slide = copy.deepcopy(source)
+        new_slide['objectId'] = object_ids.get(source_id) or 'slide_' + uuid.uuid4().hex[:16]
+        self.check_new_id(presentation, new_slide['objectId'])
+        for element in new_slide['pageElements']:
+            element['objectId'] = object_ids.get(element['objectId']) or 'elt_' + uuid.uuid4().hex[:16]
+        presentation['slides'].insert(index + 1, new_slide)
+        return {'objectId': new_slide['objectId']}
+
+    def request_updateSlidesPosition(self, presentation, params):
+        moved_ids = params['slideObjectIds']
+        index = params['insertionIndex']
+        if not 0 <= index <= len(presentation['slides']):
+            raise FakeApiError(400, 'insertionIndex ' + str(index) + ' out of range')
+        moved = [presentation['slides'][self.slide_index(presentation, slide_id)] for slide_id in moved_ids]
+        index -= len([slide for slide in presentation['slides'][:index] if slide['objectId'] in moved_ids])
+        presentation['slides'] = [slide for slide in presentation['slides'] if slide['objectId'] not in moved_ids]
+        presentation['slides'][index:index] = moved
+
+    def request_replaceAllText(self, presentation, params):
+        search = params['containsText']['text']
+        replace = params.get('replaceText', '')
+        pages = params.get('pageObjectIds')
+        changed = 0
+        for slide in presentation['slides']:
+            if pages and slide['objectId'] not in pages:
+                continue
+            for element in slide['pageElements']:
+                changed += element['text'].count(search)
+                element['text'] = element['text'].replace(search, replace)
+        return {'occurrencesChanged': changed}
+
+    def request_createShape(self, presentation, params):
+        object_id = params.get('objectId') or 'shape_' + uuid.uuid4().hex[:16]
+        self.check_new_id(presentation, object_id)
+        slide = presentation['slides'][self.slide_index(presentation, params['elementProperties']['pageObjectId'])]
+        slide['pageElements'].append({'objectId': object_id, 'shapeType': params['shapeType'], 'text': '',
+                                      'styles': 0, 'size': params['elementProperties'].get('size'),
+                                      'transform': params['elementProperties'].get('transform')})
+        return {'objectId': object_id}
+
+    def request_insertText(self, presentation, params):
+        slide, element = self.find_element(presentation, params['objectId'])
+        index = params.get('insertionIndex', 0)
+        if not 0 <= index <= len(element['text']):
+            raise FakeApiError(400, 'insertionIndex ' + str(index) + ' out of range')
+        element['text'] = element['text'][:index] + params['text'] + element['text'][index:]
+
+    def request_deleteText(self, presentation, params):
+        slide, element = self.find_element(presentation, params['objectId'])
+        text_range = params.get('textRange', {'type': 'ALL'})
+        if text_range['type'] != 'ALL':
+            raise FakeApiError(400, 'Only ALL text ranges are supported by the fake API')
+        # The styled runs go with the text
+        element['text'] = ''
+        element['styles'] = 0
+
+    def request_updateTextStyle(self, presentation, params):
+        slide, element = self.find_element(presentation, params['objectId'])
+        text_range = params.get('textRange', {'type': 'ALL'})
+        if text_range['type'] == 'FIXED_RANGE':
+            if not 0 <= text_range['startIndex'] < text_range['endIndex'] <= text_utf16_len(element['text']):
+                raise FakeApiError(400, 'The end index (' + str(text_range['endIndex'])
+                                   + ') should not be greater than the existing text length.')
+        element['styles'] += 1
+
+    def request_updateParagraphStyle(self, presentation, params):
+        self.find_element(presentation, params['objectId'])
+
+    def request_deleteObject(self, presentation, params):
+        object_id = params['objectId']
+        for slide in presentation['slides']:
+            if slide['objectId'] == object_id:
+                presentation['slides'].remove(slide)
+                return
+            for element in slide['pageElements']:
+                if element['objectId'] == object_id:
+                    slide['pageElements'].remove(element)
+                    return
+        raise FakeApiError(400, 'The object (' + object_id + ') could not be found.')
+
+    # Reporting
+
+    def stats(self):
+        with self.lock:
+            return {
+                'calls': dict(self.calls),
+                'bytes_in': dict(self.bytes_in),
+                'batch_requests': dict(self.batch_requests),
+                'errors': dict(self.errors),
+            }
+
+    def slide_texts(self, presentation_id):
+        # Text of each slide, in order, to check a generated deck
+        return [[element['text'] for element in slide['pageElements']]
+                for slide in self.presentations[presentation_id]['slides']]
+
+
+class FakeHttp:
+    # httplib2.Http replacement given to googleapiclient
+    def __init__(self, backend, identity='default'):
+        self.backend = backend
+        self.identity = identity
+
+    def request(self, uri, method='GET', body=None, headers=None, redirections=None, connection_type=None):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        if urlparse(uri).path.startswith('/batch/'):
+            status, content_type, content = self.backend.handle_batch(body, (headers or {})['content-type'],
+                                                                      self.identity)
+            return httplib2.Response({'status': status, 'content-type': content_type}), content
+        status, content = self.backend.handle(uri, method, body, self.identity)
+        response = httplib2.Response({'status': status, 'content-type': 'application/json; charset=UTF-8'})
+        if status == 429:
+            response['retry-after'] = '1'
+        if content is None:
+            response.status = 204
+            return response, b''
+        return response, json.dumps(content).encode('utf-8')
+
+
+A1_PATTERN = re.compile(r'^(?:[^!]+!)?([A-Z]+)(\d+)(?::([A-Z]+)(\d+))?$')
+
+
+def a1_to_cells(a1):
+    # 'B3' or 'Sheet!A1:C9' -> (first row, first column, last row, last column), 1-based
+    match = A1_PATTERN.match(a1)
+    if match is None:
+        raise FakeSheetError(400, 'Unable to parse range: ' + a1)
+
+    def column(letters):
+        number = 0
+        for letter in letters:
+            number = number * 26 + ord(letter) - ord('A') + 1
+        return number
+
+    row, col = int(match.group(2)), column(match.group(1))
+    if match.group(3) is None:
+        return row, col, row, col
+    return row, col, int(match.group(4)), column(match.group(3))
+
+
+class FakeSheetResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.headers = {'retry-after': '1'} if status_code == 429 else {}
+
+
+class FakeSheetError(Exception):
+    # Raised like gspread.exceptions.APIError, with the status in response.status_code
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.response = FakeSheetResponse(status)
+
+
+class FakeWorksheet:
+    # Stand-in for the gspread Worksheet calls used by sheets.py, the grid is a list of rows
+    def __init__(self, rows, title='Clients', latency=0.0):
+        self.title = title
+        self.rows = [list(row) for row in rows]
+        self.latency = latency
+        # The next fail_writes batch_update calls get a 429
+        self.fail_writes = 0
+        self.calls = collections.Counter()
+        self.lock = threading.Lock()
+
+    def get_values(self, range_name=None, **kwargs):
+        with self.lock:
+            self.calls['get_values'] += 1
+            width = max((len(row) for row in self.rows), default=0)
+            values = [row + [''] * (width - len(row)) for row in self.rows]
+            if range_name is not None:
+                first_row, first_col, last_row, last_col = a1_to_cells(range_name)
+                values = [row[first_col - 1:last_col] for row in values[first_row - 1:last_row]]
+        time.sleep(self.latency)
+        return values
+
+    def batch_update(self, data, raw=True, **kwargs):
+        with self.lock:
+            self.calls['batch_update'] += 1
+            if self.fail_writes > 0:
+                self.fail_writes -= 1
+                raise FakeSheetError(429, 'Quota exceeded for quota metric Write requests')
+            cells = 0
+            for update in data:
+                first_row, first_col = a1_to_cells(update['range'])[:2]
+                for i, values in enumerate(update['values']):
+                    row = first_row + i
+                    while len(self.rows) < row:
+                        self.rows.append([])
+                    for j, value in enumerate(values):
+                        cells_row = self.rows[row - 1]
+                        cells_row.extend([''] * (first_col + j - len(cells_row)))
+                        cells_row[first_col + j - 1] = str(value)
+                        cells += 1
+        time.sleep(self.latency)
+        return {'totalUpdatedCells': cells, 'responses': [{} for update in data]}
+
+    def records(self):
+        # Rows as {header: value}, to check the write-backs
+        header = self.rows[0]
+        return [dict(zip(header, row + [''] * (len(header) - len(row)))) for row in self.rows[1:]]
+
+
+def template_layout(version):
+    # The superpowers decks have no main title slide, see make_client_slides
+    return 'superpowers' if 'freesuperpowers' in version or 'fullsuperpowers' in version else 'holistic'
+
+
+def backend_from_settings(settings):
+    backend = FakeGoogleBackend(latency=settings.fake_api_latency_ms / 1000.0,
+                                error_rate=settings.fake_api_error_rate,
+                                quotas={'slides_write': settings.fake_api_quota_per_minute,
+                                        'drive_write': settings.fake_api_quota_per_minute})
+    backend.add_template(settings.template_id, settings.first_title_page, settings.folder_to_check_id,
+                         template_layout(settings.version))
+    return backend
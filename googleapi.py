@@ -1,42 +1,46 @@
 # -*- coding: utf-8 -*-
-import contextlib
-import glob
+import copy
+import functools
 import json
 import os
-import sys
+import threading
 import time
-from collections import defaultdict
+from datetime import datetime, timedelta
 
 import google.auth.transport.requests
+import httplib2
+from google_auth_httplib2 import AuthorizedHttp
 
-from dateutil import parser
-import gspread
 from google.auth.exceptions import RefreshError
 
-from google.oauth2.credentials import Credentials
 from google.oauth2 import service_account
-from google.auth.transport.requests import Request
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
 
-from utils import log, get_version
+import identities
+from utils import log
+
+# Pinned discovery documents (e.g. discovery/slides.v1.json) take precedence
+# over the copies bundled with google-api-python-client
+DISCOVERY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'discovery')
 
 
 get_creds_cache = {}
 
 
 # Function to load service account credentials from a JSON file
-def get_cred():
-    # path = '../creds/service-creds.json'
-    creds_dir = os.path.join(os.getcwd(), 'creds')
-    creds_path = os.path.join(creds_dir, 'service-creds.json')
+def get_cred(creds_path=None):
+    # path = '../creds/service-creds.json', or the key of an identity (see identities)
+    if creds_path is None:
+        creds_dir = os.path.join(os.getcwd(), 'creds')
+        creds_path = os.path.join(creds_dir, 'service-creds.json')
     with open(creds_path, 'r') as f:
         dic = json.load(f)
     return dic
 
-def build_delegated_creds(scopes):
+def build_delegated_creds(scopes, creds_path=None):
     #email_service_delegation = ''
-    service_account_key = get_cred()
+    service_account_key = get_cred(creds_path)
     creds = service_account.Credentials.from_service_account_info(
         service_account_key,
         scopes=scopes
@@ -46,25 +50,93 @@ def build_delegated_creds(scopes):
 
 
 
-def get_drive_srv():
-    creds = build_delegated_creds(['https://www.googleapis.com/auth/drive'])
-    # Refresh the credentials to obtain an access token
-    request = google.auth.transport.requests.Request()
-    creds.refresh(request)
+# Refresh the tokens this long before they expire so no API call waits for it
+TOKEN_REFRESH_MARGIN = 300
+TOKEN_REFRESH_INTERVAL = 60
 
-    service = build('drive', 'v3', credentials=creds, cache_discovery=False)
+_creds_lock = threading.Lock()
+_refresher_started = False
+_thread_local = threading.local()
+# Set by use_fake_backend, services then talk to fake_google instead of Google
+_fake_backend = None
+_fake_http = None
 
-    return service
 
-
-def get_slides_srv():
-    creds = build_delegated_creds(['https://www.googleapis.com/auth/presentations'])
-
-    # Refresh the credentials to obtain an access token
+def refresh_expiring_creds():
     request = google.auth.transport.requests.Request()
-    creds.refresh(request)
+    with _creds_lock:
+        cached_creds = list(get_creds_cache.values())
+    for creds in cached_creds:
+        if creds.expiry is None or creds.expiry - datetime.utcnow() < timedelta(seconds=TOKEN_REFRESH_MARGIN):
+            try:
+                creds.refresh(request)
+            except RefreshError as e:
+                log('[WARNING] Token refresh failed: ' + repr(e))
+
+
+def creds_refresher():
+    while True:
+        time.sleep(TOKEN_REFRESH_INTERVAL)
+        refresh_expiring_creds()
+
+
+def get_cached_creds(scopes):
+    # One credentials object per identity and scope set for the whole process
+    global _refresher_started
+    key = (identities.current(), frozenset(scopes))
+    with _creds_lock:
+        if key not in get_creds_cache:
+            creds = build_delegated_creds(list(scopes), identities.current_key_path())
+            creds.refresh(google.auth.transport.requests.Request())
+            get_creds_cache[key] = creds
+        if not _refresher_started:
+            _refresher_started = True
+            threading.Thread(target=creds_refresher, name='creds-refresher', daemon=True).start()
+        return get_creds_cache[key]
+
+
+@functools.lru_cache(maxsize=None)
+def get_discovery_document(name, version):
+    # Parsed once per process, no discovery fetch when a service is built
+    path = os.path.join(DISCOVERY_DIR, name + '.' + version + '.json')
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    document = get_static_doc(name, version)
+    if document is None:
+        raise FileNotFoundError('No discovery document for ' + name + ' ' + version)
+    return json.loads(document)
+
+
+def get_service(name, version, scopes):
+    # Services and their HTTP connection pool are kept per thread, httplib2 is not thread-safe
+    services = getattr(_thread_local, 'services', None)
+    if services is None:
+        services = _thread_local.services = {}
+    key = (name, version, frozenset(scopes), id(_fake_backend), identities.current())
+    if key not in services:
+        if _fake_backend is not None:
+            http = _fake_http(_fake_backend, identities.current())
+        else:
+            http = AuthorizedHttp(get_cached_creds(scopes), http=httplib2.Http(timeout=60))
+        # build_from_document fills in the method descriptions, it gets its own copy
+        document = copy.deepcopy(get_discovery_document(name, version))
+        services[key] = build_from_document(document, http=http)
+    return services[key]
+
+
+def use_fake_backend(backend):
+    # Offline runs: no credentials are loaded and no request leaves the process
+    # fake_google is only imported here, real runs never load it
+    global _fake_backend, _fake_http
+    import fake_google
+    _fake_http = fake_google.FakeHttp
+    _fake_backend = backend
+
 
-    service = build('slides', 'v1', credentials=creds, cache_discovery=False)
+def get_drive_srv():
+    return get_service('drive', 'v3', ['https://www.googleapis.com/auth/drive'])
 
-    return service
 
+def get_slides_srv():
+    return get_service('slides', 'v1', ['https://www.googleapis.com/auth/presentations'])
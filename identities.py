@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+# Service account identities of a run. The Slides and Drive quotas are per user, so
+# with a directory of keys (QUOTA.service_accounts_dir) the decks are spread over
+# several identities. A deck is built by one identity from start to end, each identity
+# has its own quota buckets, and an identity that keeps getting 429 errors is drained:
+# it gets no new deck until the drain delay is over. A deck it already started waits for it.
+import collections
+import contextlib
+import os
+import threading
+import time
+
+DEFAULT_IDENTITY = 'default'
+DRAIN_429S = 5
+DRAIN_WINDOW_SECONDS = 60
+DRAIN_SECONDS = 300
+
+
+class Identity:
+    def __init__(self, name, key_path=None):
+        self.name = name
+        # None for the default creds/service-creds.json
+        self.key_path = key_path
+        self.active = 0
+        self.decks = 0
+        self.throttles = collections.deque()
+        self.throttled = 0
+        self.drained_until = 0.0
+
+
+_identities = [Identity(DEFAULT_IDENTITY)]
+_lock = threading.Lock()
+_local = threading.local()
+_drain_429s = DRAIN_429S
+_drain_seconds = DRAIN_SECONDS
+
+
+def configure(config):
+    # Reads the QUOTA section, called once at startup like rate_limiter.configure
+    global _drain_429s, _drain_seconds
+    directory = config.get('QUOTA', 'service_accounts_dir', fallback='').strip()
+    _drain_429s = int(config.get('QUOTA', 'identity_drain_429s', fallback=str(DRAIN_429S)))
+    _drain_seconds = int(config.get('QUOTA', 'identity_drain_seconds', fallback=str(DRAIN_SECONDS)))
+    if not directory:
+        set_identities([(DEFAULT_IDENTITY, None)])
+        return
+    keys = sorted(name for name in os.listdir(directory) if name.endswith('.json'))
+    if not keys:
+        raise ValueError('No service account key in ' + directory)
+    set_identities([(name[:-5], os.path.join(directory, name)) for name in keys])
+
+
+def set_identities(entries):
+    # [(name, key_path)], the first one is used outside of a deck (template pool, cleanup)
+    global _identities
+    with _lock:
+        _identities = [Identity(name, key_path) for name, key_path in entries]
+
+
+def names():
+    with _lock:
+        return [identity.name for identity in _identities]
+
+
+def find(name):
+    for identity in _identities:
+        if identity.name == name:
+            return identity
+    return None
+
+
+def current():
+    name = getattr(_local, 'identity', None)
+    return name if name is not None else _identities[0].name
+
+
+def current_key_path():
+    with _lock:
+        identity = find(current())
+        return identity.key_path if identity else None
+
+
+def bucket_name(kind):
+    # Quota bucket of the current identity, the default one keeps the plain names
+    name = current()
+    return kind if name == DEFAULT_IDENTITY else kind + '@' + name
+
+
+class UnknownIdentity(ValueError):
+    pass
+
+
+def wait_for(name):
+    # Sleeps until the identity is no longer drained
+    with _lock:
+        identity = find(name)
+        if identity is None:
+            raise UnknownIdentity('Service account ' + name + ' is not configured')
+        delay = identity.drained_until - time.monotonic()
+    if delay > 0:
+        print('[INFO]⏸️ Waiting ' + str(round(delay)) + ' s for the drained service account ' + name)
+        time.sleep(delay)
+
+
+def choose(preferred=None):
+    # Identity of a deck. preferred is the one that started it: its copy belongs to that
+    # identity, so the deck stays on it, waiting if it is drained (UnknownIdentity if it is
+    # not configured any more). A new deck gets the least busy identity that is not drained.
+    if preferred is not None:
+        wait_for(preferred)
+        return preferred
+    with _lock:
+        now = time.monotonic()
+        available = [identity for identity in _identities if identity.drained_until <= now]
+        if not available:
+            # All drained, the one back first is used
+            available = [min(_identities, key=lambda identity: identity.drained_until)]
+        return min(available, key=lambda identity: (identity.active, identity.decks)).name
+
+
+@contextlib.contextmanager
+def acting_as(name):
+    # Every API call of the thread is made as this identity inside the block
+    previous = getattr(_local, 'identity', None)
+    _local.identity = name
+    try:
+        yield
+    finally:
+        _local.identity = previous
+
+
+@contextlib.contextmanager
+def use(name):
+    # acting_as for the deck of a client, counted in the load of the identity
+    with _lock:
+        identity = find(name)
+        identity.active += 1
+        identity.decks += 1
+    try:
+        with acting_as(name):
+            yield
+    finally:
+        with _lock:
+            identity.active -= 1
+
+
+def record_throttle():
+    # A 429 error for the current identity, called by retry_function
+    with _lock:
+        identity = find(current())
+        if identity is None or len(_identities) == 1:
+            return
+        now = time.monotonic()
+        identity.throttled += 1
+        identity.throttles.append(now)
+        while identity.throttles and now - identity.throttles[0] > DRAIN_WINDOW_SECONDS:
+            identity.throttles.popleft()
+        if len(identity.throttles) >= _drain_429s and identity.drained_until <= now:
+            identity.drained_until = now + _drain_seconds
+            identity.throttles.clear()
+            print('[WARNING]⚠️ Service account ' + identity.name + ' drained for ' + str(_drain_seconds)
+                  + ' s after ' + str(_drain_429s) + ' errors 429 in ' + str(DRAIN_WINDOW_SECONDS) + ' s')
+
+
+def stats():
+    with _lock:
+        now = time.monotonic()
+        return {identity.name: {'decks': identity.decks, 'throttled': identity.throttled,
+                                'drained': identity.drained_until > now} for identity in _identities}
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+# Append-only JSON lines journal of the deck generation of each client.
+# A client is keyed by version, row_id and UID. Its lines are, in order:
+#   {"event": "copy", "presentation_id": ..., "identity": ...} the template was copied
+#   {"event": "update", "presentation_id": ..., "identity": ...} an existing deck is being updated
+#   {"event": "batch", "results": [...], "cursor": ...}         a batchUpdate was applied
+#   {"event": "done", "fingerprint": ..., "slides": {...}}      the deck is complete
+# A rerun skips done clients whose inputs did not change (same fingerprint),
+# updates the changed ones using the fingerprint of each slide and resumes the
+# others in their presentation.
+# Processes on one or several hosts can share the file: each entry is written with one
+# os.write on an O_APPEND descriptor, under an fcntl lock where there is one (not on Windows).
+import json
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+def client_key(client, vers):
+    return vers + ':' + str(client['row_id']) + ':' + client['UID']
+
+
+class Journal:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.states = {}
+        # Bytes of the file already replayed, see refresh
+        self.offset = 0
+        self.read_new_entries()
+        self.fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def read_new_entries(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            data = f.read()
+        # A line still being written by another process is read next time
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].decode('utf-8').splitlines():
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # Last line cut by a crash, the entry was never acknowledged
+                continue
+            self.replay(entry)
+        self.offset += end
+
+    def refresh(self):
+        # Entries appended since by other processes sharing this journal (work_queue workers).
+        # Entries of this process are replayed again, in order, which leaves the same states.
+        with self.lock:
+            self.read_new_entries()
+
+    def replay(self, entry):
+        key = entry['key']
+        if entry['event'] in ('copy', 'update'):
+            previous = self.states.get(key)
+            slides = None
+            template_version = None
+            if entry['event'] == 'update' and previous and previous['presentation_id'] == entry['presentation_id']:
+                # The slides fingerprints are kept until the update is done
+                slides = previous['slides']
+                template_version = previous['template_version']
+            self.states[key] = {'presentation_id': entry['presentation_id'], 'results': [], 'cursor': None,
+                                'done': False, 'fingerprint': None, 'template_version': template_version,
+                                'slides': slides, 'updating': entry['event'] == 'update',
+                                'identity': entry.get('identity')}
+        elif key in self.states:
+            state = self.states[key]
+            if entry['event'] == 'batch':
+                state['results'] += [result for result in entry['results'] if result not in state['results']]
+                state['cursor'] = entry['cursor']
+            elif entry['event'] == 'done':
+                state['done'] = True
+                state['fingerprint'] = entry.get('fingerprint')
+                state['template_version'] = entry.get('template_version')
+                state['slides'] = entry.get('slides')
+                state['updating'] = False
+            elif entry['event'] == 'discard':
+                del self.states[key]
+
+    def append(self, event, key, **fields):
+        entry = dict(fields, event=event, key=key, ts=round(time.time(), 3))
+        data = (json.dumps(entry, ensure_ascii=False) + '\n').encode('utf-8')
+        with self.lock:
+            self.replay(entry)
+            if fcntl:
+                # Lines of other processes never interleave with this one, even across hosts (NFS locks)
+                fcntl.lockf(self.fd, fcntl.LOCK_EX)
+            try:
+                written = 0
+                while written < len(data):
+                    written += os.write(self.fd, data[written:])
+                # The entry must survive a crash right after the API call it records
+                os.fsync(self.fd)
+            finally:
+                if fcntl:
+                    fcntl.lockf(self.fd, fcntl.LOCK_UN)
+
+    def state(self, key):
+        with self.lock:
+            state = self.states.get(key)
+            return dict(state, results=list(state['results'])) if state else None
+
+    def record_copy(self, key, presentation_id, identity=None):
+        # identity is the service account building the deck, a resume prefers it
+        self.append('copy', key, presentation_id=presentation_id, identity=identity)
+
+    def record_batch(self, key, results, cursor):
+        self.append('batch', key, results=results, cursor=cursor)
+
+    def record_update(self, key, presentation_id, identity=None):
+        self.append('update', key, presentation_id=presentation_id, identity=identity)
+
+    def record_done(self, key, fingerprint=None, template_version=None, slides=None):
+        self.append('done', key, fingerprint=fingerprint, template_version=template_version, slides=slides)
+
+    def discard(self, key):
+        # The presentation is gone or out of date, the client starts again from a new copy
+        self.append('discard', key)
+
+    def close(self):
+        with self.lock:
+            os.close(self.fd)
+
+
+_journal = None
+
+
+def open_journal(path):
+    global _journal
+    _journal = Journal(path) if path else None
+    return _journal
+
+
+def get_journal():
+    return _journal
+
+
+def close_journal():
+    global _journal
+    if _journal is not None:
+        _journal.close()
+        _journal = None
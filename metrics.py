@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+# Per-call API metrics and per-client phase spans.
+# Off by default, every hook then returns after one flag check. When on, each
+# event is appended to a JSON lines file and totals are written in the
+# Prometheus text format (for the node_exporter textfile collector).
+import contextlib
+import json
+import os
+import threading
+import time
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+HISTOGRAMS = ('slides_api_call_seconds', 'slides_phase_seconds')
+# Endpoint label of the multipart batch requests (drive_batch)
+BATCH_ENDPOINT = 'drive.batch'
+
+_enabled = False
+_jsonl_path = ''
+_prom_path = ''
+_lock = threading.Lock()
+_local = threading.local()
+_jsonl_file = None
+_totals = {}
+_no_span = contextlib.nullcontext()
+
+
+def configure(config):
+    # Reads the METRICS section, called once at startup like rate_limiter.configure
+    global _enabled, _jsonl_path, _prom_path
+    with _lock:
+        _enabled = config.get('METRICS', 'metrics_enabled', fallback='false').strip().lower() == 'true'
+        _jsonl_path = config.get('METRICS', 'metrics_jsonl_path', fallback='metrics.jsonl')
+        _prom_path = config.get('METRICS', 'metrics_prom_path', fallback='slides_metrics.prom')
+        _totals.clear()
+
+
+def enabled():
+    return _enabled
+
+
+def set_attempt(attempt):
+    # Set by retry_function, so each call knows how many retries came before it
+    if _enabled:
+        _local.attempt = attempt
+
+
+def write_event(event):
+    global _jsonl_file
+    event['ts'] = round(time.time(), 3)
+    line = json.dumps(event, ensure_ascii=False) + '\n'
+    with _lock:
+        if _jsonl_file is None:
+            _jsonl_file = open(_jsonl_path, 'a', encoding='utf-8')
+        _jsonl_file.write(line)
+
+
+def add_total(name, labels, value):
+    key = (name, tuple(sorted(labels.items())))
+    _totals[key] = _totals.get(key, 0) + value
+
+
+def observe(name, labels, seconds):
+    # Histogram with the cumulative buckets of the Prometheus format
+    for bound in LATENCY_BUCKETS:
+        # Every bucket is written, also the empty ones
+        add_total(name + '_bucket', dict(labels, le=str(bound)), 1 if seconds <= bound else 0)
+    add_total(name + '_bucket', dict(labels, le='+Inf'), 1)
+    add_total(name + '_sum', labels, seconds)
+    add_total(name + '_count', labels, 1)
+
+
+def payload_info(request, calls=1):
+    # Size of the request body and number of requests of a batchUpdate or of a multipart batch
+    if not hasattr(request, 'methodId'):
+        # BatchHttpRequest, its body is only built when it is sent
+        return 0, calls
+    body = getattr(request, 'body', None) or ''
+    batch_size = None
+    if request.methodId.endswith('batchUpdate') and body:
+        batch_size = len(json.loads(body).get('requests', []))
+    return len(body), batch_size
+
+
+def record_call(request, bucket_name, latency, throttle_wait, error=None, calls=1):
+    endpoint = getattr(request, 'methodId', BATCH_ENDPOINT)
+    status = 200
+    if error is not None:
+        status = getattr(getattr(error, 'resp', None), 'status', None) or 'error'
+    size, batch_size = payload_info(request, calls)
+    attempt = getattr(_local, 'attempt', 0)
+    event = {
+        'event': 'api_call',
+        'endpoint': endpoint,
+        'row_id': getattr(_local, 'row_id', None),
+        'status': status,
+        'latency_s': round(latency, 4),
+        'throttle_wait_s': round(throttle_wait, 4),
+        'bytes': size,
+        'batch_size': batch_size,
+        'retry': attempt,
+    }
+    write_event(event)
+    labels = {'endpoint': endpoint}
+    with _lock:
+        add_total('slides_api_calls_total', dict(labels, status=str(status)), 1)
+        observe('slides_api_call_seconds', labels, latency)
+        add_total('slides_api_request_bytes_total', labels, size)
+        add_total('slides_api_batch_requests_total', labels, batch_size or 0)
+        add_total('slides_api_throttle_wait_seconds_total', {'bucket': bucket_name}, throttle_wait)
+        if attempt:
+            add_total('slides_api_retries_total', labels, 1)
+
+
+@contextlib.contextmanager
+def _span(phase, row_id):
+    previous = getattr(_local, 'row_id', None)
+    _local.row_id = row_id
+    start = time.perf_counter()
+    error = None
+    try:
+        yield
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        _local.row_id = previous
+        write_event({'event': 'span', 'phase': phase, 'row_id': row_id, 'duration_s': round(seconds, 4),
+                     'ok': error is None})
+        with _lock:
+            observe('slides_phase_seconds', {'phase': phase}, seconds)
+
+
+def span(phase, row_id):
+    # Times one phase of a client (copy, layout, fill), API calls inside are tagged with row_id
+    if not _enabled:
+        return _no_span
+    return _span(phase, row_id)
+
+
+def format_labels(labels):
+    return '{' + ','.join(key + '="' + str(value).replace('"', '\\"') + '"' for key, value in labels) + '}'
+
+
+HISTOGRAM_SUFFIXES = ('_bucket', '_sum', '_count')
+
+
+def series_order(item):
+    # A histogram series is its buckets by increasing le (+Inf last), then _sum and _count
+    (name, labels), value = item
+    base, suffix = name, ''
+    for histogram_suffix in HISTOGRAM_SUFFIXES:
+        if name.endswith(histogram_suffix) and name[:-len(histogram_suffix)] in HISTOGRAMS:
+            base, suffix = name[:-len(histogram_suffix)], histogram_suffix
+    le = dict(labels).get('le')
+    return (base, tuple(label for label in labels if label[0] != 'le'),
+            HISTOGRAM_SUFFIXES.index(suffix) if suffix else 0, float(le) if le is not None else 0.0)
+
+
+def write_prometheus(path=None):
+    path = path or _prom_path
+    lines = []
+    typed = set()
+    with _lock:
+        for (name, labels), value in sorted(_totals.items(), key=series_order):
+            base = name.rsplit('_', 1)[0] if name.rsplit('_', 1)[0] in HISTOGRAMS else name
+            if base not in typed:
+                typed.add(base)
+                lines.append('# TYPE ' + base + (' histogram' if base in HISTOGRAMS else ' counter'))
+            lines.append(name + format_labels(labels) + ' ' + repr(float(value)))
+    # Written next to the target and renamed, the collector never reads a partial file
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+    os.replace(path + '.tmp', path)
+
+
+def flush():
+    # Writes the Prometheus file and closes the JSON lines file, end of a run
+    global _jsonl_file
+    if not _enabled:
+        return
+    write_prometheus()
+    with _lock:
+        if _jsonl_file is not None:
+            _jsonl_file.close()
+            _jsonl_file = None
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import threading
+import time
+
+import identities
+import metrics
+
+# Default per-minute quotas per user, override them in the QUOTA section of the config
+DEFAULT_QUOTAS = {
+    'slides_write': 60,
+    'slides_read': 60,
+    'drive_write': 600,
+    'drive_read': 600,
+    'sheets_write': 60,
+    'sheets_read': 60,
+}
+
+
+class TokenBucket:
+    # Thread-safe token bucket refilled continuously at rate_per_minute.
+    # A caller reserves its tokens at once (the level can go negative) and sleeps
+    # only for its own deficit, so waiting callers are served in arrival order.
+    def __init__(self, name, rate_per_minute, capacity=None):
+        self.name = name
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.waited = 0.0
+        self.lock = threading.Lock()
+
+    def _reserve(self, tokens):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= tokens
+        return max(0.0, -self.tokens / self.rate)
+
+    def acquire(self, tokens=1):
+        with self.lock:
+            wait = self._reserve(tokens)
+            self.waited += wait
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+class FileTokenBucket(TokenBucket):
+    # Same bucket with its state in a file guarded by an exclusive lock,
+    # so several worker processes on one host share one budget
+    def __init__(self, name, rate_per_minute, lock_dir, capacity=None):
+        super().__init__(name, rate_per_minute, capacity)
+        os.makedirs(lock_dir, exist_ok=True)
+        self.path = os.path.join(lock_dir, name + '.bucket')
+
+    def _reserve(self, tokens):
+        import fcntl
+
+        with open(self.path, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                content = f.read()
+                state = json.loads(content) if content else {'tokens': self.capacity, 'updated': time.time()}
+                now = time.time()
+                level = min(self.capacity, state['tokens'] + (now - state['updated']) * self.rate) - tokens
+                f.seek(0)
+                f.truncate()
+                json.dump({'tokens': level, 'updated': now}, f)
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        return max(0.0, -level / self.rate)
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+_quotas = dict(DEFAULT_QUOTAS)
+_lock_dir = ''
+
+
+def configure(config):
+    # Called once at startup, buckets already created are rebuilt with the new settings
+    global _lock_dir
+    with _buckets_lock:
+        for name, default in DEFAULT_QUOTAS.items():
+            _quotas[name] = int(config.get('QUOTA', name + '_per_minute', fallback=str(default)))
+        _lock_dir = config.get('QUOTA', 'quota_lock_dir', fallback='')
+        _buckets.clear()
+
+
+def get_bucket(name):
+    # name is a quota of DEFAULT_QUOTAS, or 'quota@identity' with the same rate for each identity
+    with _buckets_lock:
+        if name not in _buckets:
+            rate = _quotas[name.split('@')[0]]
+            if _lock_dir:
+                _buckets[name] = FileTokenBucket(name, rate, _lock_dir)
+            else:
+                _buckets[name] = TokenBucket(name, rate)
+        return _buckets[name]
+
+
+def execute(request, bucket_name, tokens=1):
+    # Wait for the tokens of the quota of the current identity then run the googleapiclient request.
+    # A BatchHttpRequest takes one token per call it carries.
+    bucket_name = identities.bucket_name(bucket_name)
+    waited = get_bucket(bucket_name).acquire(tokens)
+    if not metrics.enabled():
+        return request.execute()
+    start = time.perf_counter()
+    error = None
+    try:
+        return request.execute()
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        metrics.record_call(request, bucket_name, time.perf_counter() - start, waited, error, tokens)
+
+
+def waited_seconds():
+    with _buckets_lock:
+        return {name: bucket.waited for name, bucket in _buckets.items()}
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+import random
+import threading
+import time
+
+from googleapiclient.errors import HttpError
+
+import identities
+import metrics
+
+# 408 and 429 are the only client errors worth retrying, 5xx are always retried
+RETRYABLE_STATUSES = {408, 429, 500, 502, 503, 504}
+
+_totals = {'calls': 0, 'retries': 0, 'slept': 0.0}
+_totals_lock = threading.Lock()
+
+
+class MaxRetriesReached(Exception):
+    pass
+
+
+def error_status(error):
+    if isinstance(error, HttpError):
+        return int(error.resp.status)
+    # gspread.exceptions.APIError keeps the requests response
+    status = getattr(getattr(error, 'response', None), 'status_code', None)
+    return int(status) if status is not None else None
+
+
+def retry_after(error):
+    # Retry-After is given in seconds by the Google APIs
+    if isinstance(error, HttpError):
+        value = error.resp.get('retry-after')
+    else:
+        value = getattr(getattr(error, 'response', None), 'headers', {}).get('retry-after')
+    if value and value.isdigit():
+        return float(value)
+    return None
+
+
+def backoff_delay(attempt, base_delay, max_delay):
+    # Capped exponential backoff with full jitter
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+
+def retry_function(func_to_test, max_retries=5, type_label="Task", base_delay=1.0, max_delay=64.0, stats=None):
+    # stats, if given, is filled with the retries and the seconds slept for this call
+    if stats is None:
+        stats = {}
+    stats['retries'] = 0
+    stats['slept'] = 0.0
+    attempt = 0
+    try:
+        while True:
+            try:
+                metrics.set_attempt(attempt)
+                return func_to_test()
+            except Exception as e:
+                status = error_status(e)
+                if status is not None and status not in RETRYABLE_STATUSES:
+                    print(f'[ERROR]🔴 {type_label} failed with status {status}, not retried: {e}')
+                    raise
+
+                if attempt >= max_retries:
+                    print(f'[WARNING]⚠️ Too many retries for {type_label}')
+                    raise MaxRetriesReached(f"Max retries reached for {type_label}") from e
+
+                delay = retry_after(e)
+                if delay is None:
+                    delay = backoff_delay(attempt, base_delay, max_delay)
+                label = 'Too many requests' if status == 429 else 'Exception'
+                if status == 429:
+                    identities.record_throttle()
+                print(f'[WARNING]⚠️ {label} in {type_label} - Retry in {delay:.1f}sec: {e!r}')
+                time.sleep(delay)
+                attempt += 1
+                stats['retries'] += 1
+                stats['slept'] += delay
+    finally:
+        metrics.set_attempt(0)
+        with _totals_lock:
+            _totals['calls'] += 1
+            _totals['retries'] += stats['retries']
+            _totals['slept'] += stats['slept']
+
+
+def retry_totals():
+    with _totals_lock:
+        return dict(_totals)
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+import configparser
+from types import MappingProxyType
+
+import config as config_module
+import text_layout
+
+
+class SettingsError(ValueError):
+    pass
+
+
+def prompt_splitter(lst):
+    # This function take the list of prompts and split them by prefix to build the slides
+    prefix_dict = {}
+    for i in lst:
+        prefix = i[:3]  # Get the first three characters after "Result" for slides building
+        if prefix in prefix_dict:
+            prefix_dict[prefix].append(i)
+        else:
+            prefix_dict[prefix] = [i]
+    return list(prefix_dict.values())
+
+
+def build_starter_slides(slides_titles_list, slides_subtitles_list, slides_introductions):
+    ''' starter_slide = { main_title:
+                            subtitle:
+                            intro:
+                        }'''
+    starter_slides = {}
+    for i, (titles, subtitle, intro) in enumerate(zip(slides_titles_list, slides_subtitles_list, slides_introductions)):
+        starter_slides[titles.split(',')[0]] = {
+            'subtitle': subtitle,
+            'intro': intro
+        }
+    return starter_slides
+
+
+# (attribute, section, option, type, default) - default None means the option is required
+OPTIONS = (
+    ('template_id', 'SLIDES', 'slides_template_id', str, None),
+    ('folder_to_check_id', 'SLIDES', 'slides_folder_to_check_id', str, None),
+    ('folder_sent_id', 'SLIDES', 'slides_folder_sent_id', str, None),
+    ('first_title_page', 'SLIDES', 'slides_first_title_page', int, None),
+    ('paragraphs_height', 'SLIDES', 'slides_paragraphs_height', int, None),
+    ('paragraphs_width', 'SLIDES', 'slides_paragraphs_width', int, None),
+    ('paragraphs_translateX', 'SLIDES', 'slides_paragraphs_translateX', int, None),
+    ('paragraphs_translateY', 'SLIDES', 'slides_paragraphs_translateY', int, None),
+    ('paragraphs_fontsize', 'SLIDES', 'slides_paragraphs_fontsize', int, None),
+    ('bloc_max_lines', 'SLIDES', 'slides_bloc_max_lines', int, None),
+    ('lines_max_chars', 'SLIDES', 'slides_lines_max_chars', int, None),
+    ('title_max_chars', 'SLIDES', 'slides_title_max_chars', int, None),
+    ('title_paragraph_min_space', 'SLIDES', 'slides_title_paragraph_min_space', int, None),
+    ('paragraphs_min_space', 'SLIDES', 'slides_paragraphs_min_space', int, None),
+    ('line_spacing', 'SLIDES', 'slides_line_spacing', float, '1.0'),
+    # metrics measures the blocs with fonts/montserrat_widths.json, which stays approximate until
+    # it is rebuilt from the font file (text_layout.build_widths_table)
+    ('layout_engine', 'SLIDES', 'slides_layout_engine', str, 'chars'),
+    ('batch_max_requests', 'SLIDES', 'slides_batch_max_requests', int, '500'),
+    ('batch_max_bytes', 'SLIDES', 'slides_batch_max_bytes', int, '1000000'),
+    ('verify_deck', 'SLIDES', 'slides_verify_deck', bool, 'false'),
+    ('workers', 'SLIDES', 'slides_workers', int, '1'),
+    ('template_pool_size', 'SLIDES', 'slides_template_pool_size', int, '0'),
+    # Empty disables the journal, failed presentations are then deleted
+    ('journal_path', 'SLIDES', 'slides_journal_path', str, 'slides_journal.jsonl'),
+    # Empty disables the cache of laid-out blocs and compiled requests
+    ('cache_dir', 'SLIDES', 'slides_cache_dir', str, 'slides_cache'),
+    ('cache_max_mb', 'SLIDES', 'slides_cache_max_mb', int, '256'),
+    # Empty keeps the template index in memory only, it is then made once per run
+    ('template_index_dir', 'SLIDES', 'slides_template_index_dir', str, 'template_index'),
+    # Clients sheet, see sheets.py. Write-backs are flushed every N clients or T seconds
+    ('sheet_id', 'SHEET', 'sheet_id', str, ''),
+    ('sheet_worksheet', 'SHEET', 'sheet_worksheet', str, 'Clients'),
+    ('sheet_flush_clients', 'SHEET', 'sheet_flush_clients', int, '50'),
+    ('sheet_flush_seconds', 'SHEET', 'sheet_flush_seconds', int, '30'),
+    ('sheet_status_done', 'SHEET', 'sheet_status_done', str, '[BOT] Slides OK'),
+    ('sheet_status_error', 'SHEET', 'sheet_status_error', str, '[BOT] Slides error'),
+    # sheets.py --send: checked decks are sent to their client, decks to recall come back to check
+    ('sheet_status_checked', 'SHEET', 'sheet_status_checked', str, '[STAFF] Slides checked'),
+    ('sheet_status_sent', 'SHEET', 'sheet_status_sent', str, '[BOT] Slides sent'),
+    ('sheet_status_recall', 'SHEET', 'sheet_status_recall', str, '[STAFF] Slides recall'),
+    ('sheet_status_recalled', 'SHEET', 'sheet_status_recalled', str, '[BOT] Slides recalled'),
+    ('fake_api', 'MIS', 'fake_api', bool, 'false'),
+    ('fake_api_latency_ms', 'MIS', 'fake_api_latency_ms', int, '0'),
+    ('fake_api_error_rate', 'MIS', 'fake_api_error_rate', float, '0'),
+    ('fake_api_quota_per_minute', 'MIS', 'fake_api_quota_per_minute', int, '0'),
+    ('version', 'MIS', 'version', str, None),
+)
+
+POSITIVE_OPTIONS = ('first_title_page', 'paragraphs_height', 'paragraphs_width', 'paragraphs_fontsize',
+                    'bloc_max_lines', 'lines_max_chars', 'title_max_chars', 'batch_max_requests',
+                    'batch_max_bytes', 'workers', 'line_spacing', 'cache_max_mb', 'sheet_flush_clients',
+                    'sheet_flush_seconds')
+
+
+class Settings:
+    # Every SLIDES/INTEL/MIS/SHEET value parsed once, read-only after load_settings
+    __slots__ = tuple(option[0] for option in OPTIONS) + (
+        'prompts_list', 'prompt_groups', 'slides_titles_list', 'slides_subtitles_list',
+        'slides_introductions', 'results_enabled', 'starter_slide', 'layout', '_frozen')
+
+    def __setattr__(self, name, value):
+        if getattr(self, '_frozen', False):
+            raise AttributeError('Settings are read-only')
+        object.__setattr__(self, name, value)
+
+
+class FileConfig(configparser.ConfigParser):
+    # INI file with the SLIDES, INTEL, MIS, QUOTA and METRICS sections, the long texts come from config.py
+    slides_titles = config_module.slides_titles
+    slides_subtitles = config_module.slides_subtitles
+    slides_introductions = config_module.slides_introductions
+    intel_results_enabled = config_module.intel_results_enabled
+
+
+def parse_option(config, section, option, kind, default):
+    value = config.get(section, option, fallback=default)
+    if value is None:
+        raise SettingsError('Missing ' + section + '.' + option)
+    value = str(value).strip()
+    if kind is bool:
+        if value.lower() not in ('true', 'false'):
+            raise SettingsError(section + '.' + option + ' must be true or false, not ' + repr(value))
+        return value.lower() == 'true'
+    try:
+        return kind(value)
+    except ValueError:
+        raise SettingsError(section + '.' + option + ' must be ' + kind.__name__ + ', not ' + repr(value))
+
+
+def load_settings(config):
+    # Raises SettingsError on a bad config, before any Drive call is made
+    if not hasattr(config, 'get'):
+        # e.g. the config module alone, its texts go with the INI values in a FileConfig
+        raise SettingsError('config must be a FileConfig with the SLIDES, INTEL and MIS sections, not '
+                            + type(config).__name__)
+    settings = Settings()
+    for name, section, option, kind, default in OPTIONS:
+        setattr(settings, name, parse_option(config, section, option, kind, default))
+    for name in POSITIVE_OPTIONS:
+        if getattr(settings, name) <= 0:
+            raise SettingsError(name + ' must be positive')
+    if settings.layout_engine not in ('metrics', 'chars'):
+        raise SettingsError('slides_layout_engine must be metrics or chars')
+    if not 0 <= settings.fake_api_error_rate < 1:
+        raise SettingsError('fake_api_error_rate must be between 0 and 1')
+    if settings.fake_api_latency_ms < 0 or settings.fake_api_quota_per_minute < 0:
+        raise SettingsError('fake_api_latency_ms and fake_api_quota_per_minute must not be negative')
+
+    # Names are listed as 'A, B, C', the spaces are not part of them
+    settings.prompts_list = tuple(name.strip() for name in
+                                  parse_option(config, 'INTEL', 'intel_prompts_list', str, None).split(','))
+    settings.prompt_groups = tuple(tuple(group) for group in prompt_splitter(settings.prompts_list))
+
+    # Put config titles in a list of X lists with the X category
+    settings.slides_titles_list = tuple(config.slides_titles.split('\n'))
+    settings.slides_subtitles_list = tuple(config.slides_subtitles.split('\n'))
+    settings.slides_introductions = tuple(config.slides_introductions.replace('\n\n', '\n').split('\n'))
+    settings.results_enabled = tuple(name.strip() for name in config.intel_results_enabled.split(','))
+    if not config.slides_titles.strip():
+        raise SettingsError('slides_titles is empty')
+    starter_slide = build_starter_slides(settings.slides_titles_list, settings.slides_subtitles_list,
+                                         settings.slides_introductions)
+    settings.starter_slide = MappingProxyType({title: MappingProxyType(starter)
+                                               for title, starter in starter_slide.items()})
+
+    settings.layout = text_layout.LayoutSettings(
+        font_size=settings.paragraphs_fontsize,
+        box_width=settings.paragraphs_width,
+        box_height=settings.paragraphs_height,
+        line_spacing=settings.line_spacing,
+        title_paragraph_min_space=settings.title_paragraph_min_space,
+        paragraphs_min_space=settings.paragraphs_min_space,
+    )
+    settings._frozen = True
+    return settings
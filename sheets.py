@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+# Clients sheet: all the client rows are read with one range read, and the Slides link
+# and Status of each client are written back in one batch_update every
+# sheet_flush_clients clients or sheet_flush_seconds seconds, instead of one write per row.
+# With --send the decks of the checked rows are sent to their client and the ones to recall
+# come back to the folder to check, in Drive batch requests.
+#   python sheets.py --config slides.ini [--update] [--workers 4]
+#   python sheets.py --config slides.ini --send
+import argparse
+import threading
+
+import googleapi
+import identities
+import rate_limiter
+import slides
+from retry import retry_function
+from settings import FileConfig, load_settings
+
+LINK_COLUMN = 'Slides link'
+STATUS_COLUMN = 'Status'
+PRESENTATION_URL = 'https://docs.google.com/presentation/d/{}/edit'
+
+
+def column_letters(col):
+    # 1 -> A, 27 -> AA
+    letters = ''
+    while col > 0:
+        col, remainder = divmod(col - 1, 26)
+        letters = chr(ord('A') + remainder) + letters
+    return letters
+
+
+def cell_a1(row, col):
+    return column_letters(col) + str(row)
+
+
+def open_worksheet(settings):
+    # gspread worksheet of the clients, opened with the key of the first identity
+    import gspread
+
+    key_path = identities.current_key_path() or 'creds/service-creds.json'
+    client = gspread.service_account(filename=key_path)
+    return client.open_by_key(settings.sheet_id).worksheet(settings.sheet_worksheet)
+
+
+class ClientSheet:
+    def __init__(self, worksheet, flush_clients=50, flush_seconds=30, status_done='[BOT] Slides OK',
+                 status_error='[BOT] Slides error'):
+        self.worksheet = worksheet
+        self.flush_clients = flush_clients
+        self.flush_seconds = flush_seconds
+        self.status_done = status_done
+        self.status_error = status_error
+        self.columns = {}
+        # row_id -> sheet row number
+        self.rows = {}
+        self.lock = threading.Lock()
+        # Flushes are sent one at a time so a newer value is never overwritten by an older one
+        self.flush_lock = threading.Lock()
+        # (row, col) -> value, the last value of a cell wins
+        self.pending = {}
+        self.pending_rows = set()
+        self.writes = 0
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def read_clients(self):
+        # Every client row as a dict of the header, row_id is the sheet row unless a row_id column exists
+        rate_limiter.get_bucket('sheets_read').acquire()
+        values = retry_function(self.worksheet.get_values, type_label='read_clients')
+        if not values:
+            return []
+        header = values[0]
+        self.columns = {name: col for col, name in enumerate(header, start=1) if name}
+        for name in (LINK_COLUMN, STATUS_COLUMN):
+            if name not in self.columns:
+                raise ValueError('No "' + name + '" column in the sheet ' + self.worksheet.title)
+        clients = []
+        for row, cells in enumerate(values[1:], start=2):
+            if not any(cells):
+                continue
+            client = dict(zip(header, list(cells) + [''] * (len(header) - len(cells))))
+            client.pop('', None)
+            client['row_id'] = client['row_id'] if client.get('row_id') else row
+            self.rows[str(client['row_id'])] = row
+            clients.append(client)
+        print('[INFO]🖼️📄 ' + str(len(clients)) + ' client(s) read from the sheet ' + self.worksheet.title)
+        return clients
+
+    def start(self):
+        # Flushes the queued updates every flush_seconds, in the background
+        self.thread = threading.Thread(target=self.run, name='sheet-flusher', daemon=True)
+        self.thread.start()
+        return self
+
+    def run(self):
+        while not self.stopped.wait(self.flush_seconds):
+            self.flush()
+
+    def queue_update(self, row_id, values):
+        # values is {column name: value}, sent with the next flush
+        row = self.rows[str(row_id)]
+        with self.lock:
+            for name, value in values.items():
+                self.pending[(row, self.columns[name])] = value
+            self.pending_rows.add(row)
+            due = len(self.pending_rows) >= self.flush_clients
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                pending = self.pending
+                rows = len(self.pending_rows)
+                self.pending = {}
+                self.pending_rows = set()
+            if not pending:
+                return True
+            data = [{'range': cell_a1(row, col), 'values': [[value]]} for (row, col), value in sorted(pending.items())]
+
+            def execute():
+                rate_limiter.get_bucket('sheets_write').acquire()
+                return self.worksheet.batch_update(data, raw=True)
+
+            try:
+                retry_function(execute, type_label='sheet_write_back')
+            except Exception as e:
+                # Kept for the next flush, values queued meanwhile are newer
+                with self.lock:
+                    for cell, value in pending.items():
+                        self.pending.setdefault(cell, value)
+                        self.pending_rows.add(cell[0])
+                print('[ERROR]🖼️🔴 Could not write ' + str(len(pending)) + ' cell(s) to the sheet: ' + repr(e))
+                return False
+            self.writes += 1
+            print('[INFO]🖼️📝 ' + str(rows) + ' row(s) written back to the sheet in one request')
+            return True
+
+    def record_outcome(self, client, outcome):
+        # on_outcome of slides.results_to_slides
+        if outcome['status'] in ('done', 'up_to_date'):
+            self.queue_update(client['row_id'], {
+                LINK_COLUMN: PRESENTATION_URL.format(outcome['presentation_id']),
+                STATUS_COLUMN: self.status_done})
+        elif outcome['status'] == 'error':
+            self.queue_update(client['row_id'], {STATUS_COLUMN: self.status_error})
+
+    def close(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        if not self.flush():
+            with self.lock:
+                print('[WARNING]⚠️ ' + str(len(self.pending_rows)) + ' row(s) not written back to the sheet')
+
+
+def run_from_sheet(config, vers, workers=None, update=False, worksheet=None):
+    # results_to_slides on the rows of the clients sheet, the outcomes are written back to it.
+    # worksheet is opened from SHEET.sheet_id when not given (e.g. a fake_google.FakeWorksheet).
+    settings = load_settings(config)
+    identities.configure(config)
+    rate_limiter.configure(config)
+    if worksheet is None:
+        if not settings.sheet_id:
+            raise ValueError('sheet_id is not set in the SHEET section')
+        worksheet = open_worksheet(settings)
+    sheet = ClientSheet(worksheet, settings.sheet_flush_clients, settings.sheet_flush_seconds,
+                        settings.sheet_status_done, settings.sheet_status_error)
+    clients = sheet.read_clients()
+    sheet.start()
+    try:
+        slides.results_to_slides(clients, config, vers, workers, update, on_outcome=sheet.record_outcome)
+    finally:
+        sheet.close()
+    return sheet
+
+
+def send_from_sheet(config, worksheet=None):
+    # send_decks on the rows with sheet_status_checked, recall_decks on the ones with
+    # sheet_status_recall, each for all the rows at once. Their Status is written back.
+    settings = slides.configure_run(config)
+    if worksheet is None:
+        if not settings.sheet_id:
+            raise ValueError('sheet_id is not set in the SHEET section')
+        worksheet = open_worksheet(settings)
+    sheet = ClientSheet(worksheet, settings.sheet_flush_clients, settings.sheet_flush_seconds)
+    clients = sheet.read_clients()
+    drive_service = googleapi.get_drive_srv()
+    steps = ((settings.sheet_status_checked, slides.send_decks, settings.sheet_status_sent),
+             (settings.sheet_status_recall, slides.recall_decks, settings.sheet_status_recalled))
+    try:
+        for status, step, new_status in steps:
+            rows = {}
+            for client in clients:
+                presentation_id = slides.presentation_id_from_link(client.get(LINK_COLUMN, ''))
+                if client.get(STATUS_COLUMN) == status and presentation_id:
+                    rows[presentation_id] = client
+            if not rows:
+                continue
+            errors = step(drive_service, settings, {presentation_id: client.get('Email', '').strip()
+                                                    for presentation_id, client in rows.items()})
+            for presentation_id, client in rows.items():
+                if presentation_id not in errors:
+                    sheet.queue_update(client['row_id'], {STATUS_COLUMN: new_status})
+    finally:
+        sheet.close()
+    return sheet
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Slides decks of the clients sheet')
+    parser.add_argument('--config', required=True, help='INI file of the settings')
+    parser.add_argument('--update', action='store_true', help='also update the decks that have a Slides link')
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--send', action='store_true', help='send the checked decks and recall the ones to recall')
+    args = parser.parse_args()
+    config = FileConfig()
+    if not config.read(args.config, encoding='utf-8'):
+        parser.error('cannot read ' + args.config)
+    if args.send:
+        send_from_sheet(config)
+    else:
+        run_from_sheet(config, load_settings(config).version, args.workers, args.update)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,41 +1,31 @@
 # -*- coding: utf-8 -*-
-import copy
-import os
+import contextlib
+import hashlib
+import itertools
+import threading
 import json
 import re
 import sys
 import time
 import textwrap
-import traceback
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime
-import locale
 
 from googleapiclient.errors import HttpError
 import googleapi
-from urllib.parse import quote_plus
-import config
-
-
-def retry_function(func_to_test, max_retries=5, type_label="Task"):
-    count = 0
-    while True:
-        count += 1
-        if count > max_retries:
-            print(f'[WARNING]⚠️ Too many retries for {type_label}')
-            raise MaxRetriesReached(f"Max retries reached for {type_label}")
-
-        try:
-            result = func_to_test()
-            return result
-        except Exception as e:
-            if '429' in repr(e):
-                print(f'[WARNING]⚠️ Too many requests - {type_label} - Retry in 60sec:')
-                time.sleep(60)
-            else:
-                e = "Error API : " + repr(e).split('<title>')[1].split('</title>')[0] if '<title>' in repr(e) else e
-                max_retries = 3
-                print(f'[WARNING]⚠️ Exception in {type_label} - Retry in 20sec: {repr(e)}')
-                time.sleep(20)
+import identities
+import content_cache
+import drive_batch
+import journal
+import metrics
+import rate_limiter
+import template_index
+import template_pool
+import text_layout
+import text_markup
+from retry import error_status, retry_function
+from deck_model import DeckModel
+from settings import FileConfig, SettingsError, load_settings
 
 
 def search_text_in_json(json_obj, search_text):
@@ -52,148 +42,238 @@ def search_text_in_json(json_obj, search_text):
 
     return False
 
-def add_paragraph(config, page_id, text):
-    slides_paragraphs_height = int(config.get('SLIDES', 'slides_paragraphs_height'))
-    slides_paragraphs_width = int(config.get('SLIDES', 'slides_paragraphs_width'))
-    slides_paragraphs_translateX = int(config.get('SLIDES', 'slides_paragraphs_translateX'))
-    slides_paragraphs_translateY = int(config.get('SLIDES', 'slides_paragraphs_translateY'))
-    slides_paragraphs_fontsize = int(config.get('SLIDES', 'slides_paragraphs_fontsize'))
-
-    try:
-        element_id = 'MyParagraphBox_' + str(time.time()).replace('.', '')[3:]
-        height = {'magnitude': slides_paragraphs_height, 'unit': 'PT'}
-        width = {'magnitude': slides_paragraphs_width, 'unit': 'PT'}
-        requests = [
-            {
-                'createShape': {
-                    'objectId': element_id,
-                    'shapeType': 'TEXT_BOX',
-                    'elementProperties': {
-                        'pageObjectId': page_id,
-                        'size': {'height': height, 'width': width},
-                        'transform': {
-                            'scaleX': 1, 'scaleY': 1,
-                            'translateX': slides_paragraphs_translateX,
-                            'translateY': slides_paragraphs_translateY,
-                            'unit': 'PT'
-                        }
+def add_paragraph(settings, page_id, text):
+    slides_paragraphs_height = settings.paragraphs_height
+    slides_paragraphs_width = settings.paragraphs_width
+    slides_paragraphs_translateX = settings.paragraphs_translateX
+    slides_paragraphs_translateY = settings.paragraphs_translateY
+    slides_paragraphs_fontsize = settings.paragraphs_fontsize
+
+    # The text box ID derives from its slide so a rerun finds the box already created
+    element_id = object_id('MyParagraphBox', page_id)
+    plain_text, style_ranges = text_markup.parse_markup(text)
+    height = {'magnitude': slides_paragraphs_height, 'unit': 'PT'}
+    width = {'magnitude': slides_paragraphs_width, 'unit': 'PT'}
+    requests = [
+        {
+            'createShape': {
+                'objectId': element_id,
+                'shapeType': 'TEXT_BOX',
+                'elementProperties': {
+                    'pageObjectId': page_id,
+                    'size': {'height': height, 'width': width},
+                    'transform': {
+                        'scaleX': 1, 'scaleY': 1,
+                        'translateX': slides_paragraphs_translateX,
+                        'translateY': slides_paragraphs_translateY,
+                        'unit': 'PT'
                     }
                 }
-            },
-            {
-                'insertText': {
-                    'objectId': element_id,
-                    'insertionIndex': 0,
-                    'text': text.replace("**", "")
-                }
-            },
-            {
-                'updateTextStyle': {
-                    'objectId': element_id,
-                    'style': {
-                        'fontFamily': 'Montserrat',
-                        'foregroundColor': {
-                            'opaqueColor': {
-                                'rgbColor': {'red': 0.0, 'green': 0.0, 'blue': 0.0}
-                            }
-                        },
-                        'fontSize': {
-                            'magnitude': slides_paragraphs_fontsize,
-                            'unit': 'PT'
+            }
+        },
+        {
+            'insertText': {
+                'objectId': element_id,
+                'insertionIndex': 0,
+                'text': plain_text
+            }
+        },
+        {
+            'updateTextStyle': {
+                'objectId': element_id,
+                'style': {
+                    'fontFamily': 'Montserrat',
+                    'foregroundColor': {
+                        'opaqueColor': {
+                            'rgbColor': {'red': 0.0, 'green': 0.0, 'blue': 0.0}
                         }
                     },
-                    'fields': 'fontFamily,foregroundColor,fontSize',
-                    'textRange': {'type': 'ALL'}
-                }
-            },
-            {
-                'updateParagraphStyle': {
-                    'objectId': element_id,
-                    'style': {'alignment': 'JUSTIFIED'},
-                    'fields': 'alignment'
+                    'fontSize': {
+                        'magnitude': slides_paragraphs_fontsize,
+                        'unit': 'PT'
+                    }
+                },
+                'fields': 'fontFamily,foregroundColor,fontSize',
+                'textRange': {'type': 'ALL'}
+            }
+        },
+        {
+            'updateParagraphStyle': {
+                'objectId': element_id,
+                'style': {'alignment': 'JUSTIFIED'},
+                'fields': 'alignment'
+            }
+        }
+    ]
+
+    # One request per merged range of '**', '*' and '✮' markup
+    for start_index, end_index, styles in style_ranges:
+        requests.append({
+            'updateTextStyle': {
+                'objectId': element_id,
+                'style': {style: True for style in styles},
+                'fields': ','.join(sorted(styles)),
+                'textRange': {
+                    'type': 'FIXED_RANGE',
+                    'startIndex': start_index,
+                    'endIndex': end_index
                 }
             }
-        ]
-
-        # Remove if more than two *** in text
-        text = re.sub(r'\*{3,}', '', text)
-
-        # Handle bold text wrapped with '**'
-        bold_parts = re.finditer(r'\*\*(.*?)\*\*', text)
-        for match in bold_parts:
-            start_index = match.start() - 2 * text[:match.start()].count("**")
-            end_index = start_index + len(match.group(1))
-            if len(match.group(1)) < 90:
-                requests.append({
-                    'updateTextStyle': {
-                        'objectId': element_id,
-                        'style': {
-                            'bold': True
-                        },
-                        'fields': 'bold',
-                        'textRange': {
-                            'type': 'FIXED_RANGE',
-                            'startIndex': start_index,
-                            'endIndex': end_index
-                        }
-                    }
-                })
+        })
 
-        # Handle bold text wrapped with '✮'
-        try:
-            pattern = r'\u272E(.*?)\u272E'
-            bold_parts = re.finditer(pattern, text)
-            for match in bold_parts:
-                start_index = match.start() - 2 * text[:match.start()].count("**")
-                end_index = start_index + len(match.group(1)) + 3
-                requests.append({
-                    'updateTextStyle': {
-                        'objectId': element_id,
-                        'style': {
-                            'bold': True
-                        },
-                        'fields': 'bold',
-                        'textRange': {
-                            'type': 'FIXED_RANGE',
-                            'startIndex': start_index,
-                            'endIndex': end_index
-                        }
-                    }
-                })
-        except Exception as e:
-            print(repr(e))
+    return requests
 
-        return requests
-    except HttpError as error:
-        print('[ERROR]['+']🖼️🔴 HttpError with add paragraph: ' + repr(error))
+# Slides made by slides_filler and the holistic title slides, see object_id
+GENERATED_SLIDE_PATTERN = re.compile(r'^(slide|title)_[0-9a-f]{32}$')
+PRESENTATION_LINK_PATTERN = re.compile(r'/presentation/d/([a-zA-Z0-9_-]+)')
 
-def duplicate_move_slide_id(service, presentation_id, slide_object_id, index):
-    # print('[INFO] duplicate_slide('+presentation_id+', '+slide_object_id+')', 0)
-    # Make the request to duplicate the slide.
 
-    requests = [{'duplicateObject': {'objectId': slide_object_id}}]
-    response = retry_function(lambda: service.presentations().batchUpdate(presentationId=presentation_id, body={
-                    'requests': requests}).execute(), type_label='duplicate_slide_id')
+def object_id(prefix, *parts):
+    # Deterministic Slides object ID (5 to 50 chars) built from a hash of its parts
+    digest = hashlib.sha1('|'.join(str(part) for part in parts).encode('utf-8')).hexdigest()[:32]
+    return prefix + '_' + digest
 
-    # The new slide's object ID is in the response.
-    new_slide_id = response.get('replies')[0].get('duplicateObject').get('objectId')
 
-    #print(f"Duplicated slide with object ID: {duplicate_slide_object_id}")
-    move_slide_request = {
+def duplicate_move_slide_id(requests, slide_object_id, new_slide_id, index):
+    # Duplicate the slide with a client-assigned ID so the move and the fill
+    # can be queued in the same batch, without waiting for the duplicate reply
+    requests.append({
+        'duplicateObject': {
+            'objectId': slide_object_id,
+            'objectIds': {slide_object_id: new_slide_id}
+        }
+    })
+    requests.append({
         'updateSlidesPosition': {
             'slideObjectIds': [new_slide_id],
             'insertionIndex': index
         }
-    }
-
-    requests = [move_slide_request]
-    retry_function(lambda: service.presentations().batchUpdate(presentationId=presentation_id, body={
-        'requests': requests}).execute(), type_label='move_slide_id')
+    })
 
     return new_slide_id
 
+
+def request_slide(request):
+    # Slide a request starts or moves to, None for the text requests that follow their box
+    (kind, params), = request.items()
+    if kind == 'duplicateObject':
+        return list(params['objectIds'].values())[0]
+    if kind == 'updateSlidesPosition':
+        return params['slideObjectIds'][0]
+    if kind == 'replaceAllText':
+        return params['pageObjectIds'][0]
+    if kind == 'createShape':
+        return params['elementProperties']['pageObjectId']
+    if kind == 'deleteObject':
+        return params['objectId']
+    return None
+
+
+def slide_units(requests):
+    # Consecutive requests of one slide: its duplicate, move, title and text box
+    units = []
+    slide = None
+    for request in requests:
+        request_slide_id = request_slide(request)
+        if not units or (request_slide_id is not None and request_slide_id != slide):
+            units.append([])
+            slide = request_slide_id
+        units[-1].append(request)
+    return units
+
+
+def split_requests_in_batches(requests, max_requests, max_bytes):
+    # Requests are applied in order by the API, so consecutive chunks keep the deck consistent.
+    # The requests of a slide always go in the same chunk: a rerun skips the slides that exist,
+    # a slide made by a chunk is then moved and filled too. A slide bigger than a chunk goes alone.
+    batches = []
+    current_batch = []
+    current_size = 0
+    for unit in slide_units(requests):
+        unit_size = sum(len(json.dumps(request)) for request in unit)
+        if current_batch and (len(current_batch) + len(unit) > max_requests or current_size + unit_size > max_bytes):
+            batches.append(current_batch)
+            current_batch = []
+            current_size = 0
+        current_batch.extend(unit)
+        current_size += unit_size
+    if current_batch:
+        batches.append(current_batch)
+    return batches
+
+
+def split_groups_in_batches(groups, max_requests, max_bytes):
+    # groups are (result, requests, cursor) from the compile functions. A result is never
+    # split between two batches unless it is bigger than one batch, so after each batch
+    # the results it completed can be journaled. Returns (batch, results, cursor) tuples.
+    batches = []
+    current_batch = []
+    current_results = []
+    current_size = 0
+    cursor = None
+    for result, requests, result_cursor in groups:
+        size = sum(len(json.dumps(request)) for request in requests)
+        if current_batch and (len(current_batch) + len(requests) > max_requests or current_size + size > max_bytes):
+            batches.append((current_batch, current_results, cursor))
+            current_batch, current_results, current_size = [], [], 0
+        if len(requests) > max_requests or size > max_bytes:
+            chunks = split_requests_in_batches(requests, max_requests, max_bytes)
+            batches += [(chunk, [], cursor) for chunk in chunks[:-1]]
+            requests = chunks[-1]
+            size = len(json.dumps(requests))
+        current_batch = current_batch + requests
+        current_results.append(result)
+        current_size += size
+        cursor = result_cursor
+    if current_batch:
+        batches.append((current_batch, current_results, cursor))
+    return batches
+
+
+def send_requests(settings, slides_service, deck, groups, type_label='batchUpdate_deck', journal_key=None):
+    batches = split_groups_in_batches(groups, settings.batch_max_requests, settings.batch_max_bytes)
+    run_journal = journal.get_journal()
+    for batch, results, cursor in batches:
+        retry_function(lambda batch=batch: rate_limiter.execute(slides_service.presentations().batchUpdate(
+            presentationId=deck.presentation_id, body={'requests': batch}), 'slides_write'), type_label=type_label)
+        # Keep the local model in sync with what the server has applied
+        deck.apply(batch)
+        if run_journal and journal_key and results:
+            run_journal.record_batch(journal_key, results, cursor)
+
+    return {'requests': sum(len(batch) for batch, results, cursor in batches), 'batches': len(batches)}
+
 ### MOST IMPORTANT FUNCTION FOR THE ASSESSMENT
-def split_to_blocs(text, config):
+def layout_key(settings):
+    # Every setting the blocs of a text depend on
+    return (settings.layout_engine, settings.layout.key(), settings.bloc_max_lines, settings.lines_max_chars,
+            settings.title_max_chars)
+
+
+def fill_key(settings):
+    # Every setting the requests of a result depend on
+    return (layout_key(settings), settings.paragraphs_height, settings.paragraphs_width,
+            settings.paragraphs_translateX, settings.paragraphs_translateY, settings.paragraphs_fontsize)
+
+
+def split_to_blocs(text, settings):
+    # Character count splitting by default, slides_layout_engine = metrics measures the
+    # blocs with the Montserrat widths against the paragraph box
+    cache = content_cache.get_cache()
+    if cache is not None:
+        key = content_cache.content_key('blocs', text, layout_key(settings))
+        blocs = cache.get(key)
+        if blocs is not None:
+            return blocs
+    if settings.layout_engine == 'chars':
+        blocs = split_to_blocs_chars(text, settings)
+    else:
+        blocs = text_layout.layout_blocs(text, settings.layout)
+    if cache is not None:
+        cache.put(key, blocs)
+    return blocs
+
+def split_to_blocs_chars(text, settings):
     # Clean text
     text = text.strip('"')
     text = text.replace(' - ',', ')
@@ -202,11 +282,11 @@ def split_to_blocs(text, config):
     text = text.replace('{','').replace('}','').strip()
     text = re.sub(r'\n\s*\n[\s\n]*', '\n\n', text)
     # print('text=',repr(text))
-    BLOC_MAX_LINES = int(config.get('SLIDES', 'slides_bloc_max_lines'))
-    LINES_MAX_CHARS = int(config.get('SLIDES', 'slides_lines_max_chars'))
-    TITLE_MAX_CHARS = int(config.get('SLIDES', 'slides_title_max_chars'))
-    TITLE_PARAGRAPH_MIN_SPACE = int(config.get('SLIDES', 'slides_title_paragraph_min_space'))
-    PARAGRAPHS_MIN_SPACE = int(config.get('SLIDES', 'slides_paragraphs_min_space'))
+    BLOC_MAX_LINES = settings.bloc_max_lines
+    LINES_MAX_CHARS = settings.lines_max_chars
+    TITLE_MAX_CHARS = settings.title_max_chars
+    TITLE_PARAGRAPH_MIN_SPACE = settings.title_paragraph_min_space
+    PARAGRAPHS_MIN_SPACE = settings.paragraphs_min_space
 
     def is_title(s):
         return len(s) < TITLE_MAX_CHARS
@@ -290,13 +370,54 @@ def split_to_blocs(text, config):
 
     return main_blocs_list
 
-def move_file(drive_service, file_id, folder_id):
-    file = drive_service.files().get(fileId=file_id, fields='parents').execute()
-    prev_parents = ','.join(file.get('parents'))
-    drive_service.files().update(fileId=file_id,
-                                 addParents=folder_id,
-                                 removeParents=prev_parents,
-                                 fields='id, parents').execute()
+def sent_name(name):
+    # 'HRReport tocheck ...' -> 'HRReport sent ...'
+    return name.replace(' tocheck ', ' sent ', 1)
+
+
+def to_check_name(name):
+    return name.replace(' sent ', ' tocheck ', 1)
+
+
+def send_decks(drive_service, settings, decks):
+    # decks is {presentation_id: client email} of checked decks. They go from the "slides to check"
+    # folder to the "sent" one, are renamed and shared with their client, every step in batch
+    # requests of 100 decks instead of one call per deck. Returns {presentation_id: error} of the ones not sent.
+    names, errors = drive_batch.file_names(drive_service, decks)
+    errors.update(drive_batch.move_files(drive_service, names, settings.folder_sent_id,
+                                         from_folder_id=settings.folder_to_check_id))
+    errors.update(drive_batch.rename_files(drive_service, {
+        presentation_id: sent_name(name) for presentation_id, name in names.items() if presentation_id not in errors}))
+    permission_ids, share_errors = drive_batch.share_files(drive_service, {
+        presentation_id: {'type': 'user', 'role': 'reader', 'emailAddress': decks[presentation_id]}
+        for presentation_id in names if presentation_id not in errors and decks[presentation_id]})
+    errors.update(share_errors)
+    for presentation_id, error in errors.items():
+        print('[ERROR]🖼️🔴 Could not send ' + presentation_id + ': ' + repr(error))
+    print('[INFO]🖼️📤 ' + str(len(decks) - len(errors)) + ' deck(s) sent, '
+          + str(len(permission_ids)) + ' shared with their client')
+    return errors
+
+
+def recall_decks(drive_service, settings, decks):
+    # Undoes send_decks: the client loses access and the deck goes back to the "slides to check" folder
+    names, errors = drive_batch.file_names(drive_service, decks)
+    permission_ids, find_errors = drive_batch.find_permissions(drive_service, {
+        presentation_id: decks[presentation_id] for presentation_id in names if decks[presentation_id]})
+    errors.update(find_errors)
+    errors.update(drive_batch.unshare_files(drive_service, {
+        presentation_id: permission_id for presentation_id, permission_id in permission_ids.items()
+        if presentation_id not in errors}))
+    moved = [presentation_id for presentation_id in names if presentation_id not in errors]
+    errors.update(drive_batch.move_files(drive_service, moved, settings.folder_to_check_id,
+                                         from_folder_id=settings.folder_sent_id))
+    errors.update(drive_batch.rename_files(drive_service, {
+        presentation_id: to_check_name(name) for presentation_id, name in names.items()
+        if presentation_id not in errors}))
+    for presentation_id, error in errors.items():
+        print('[ERROR]🖼️🔴 Could not recall ' + presentation_id + ': ' + repr(error))
+    print('[INFO]🖼️📥 ' + str(len(decks) - len(errors)) + ' deck(s) back in the folder to check')
+    return errors
 
 def get_results_list(client, results_enabled):
     slides_results_list = []
@@ -305,7 +426,7 @@ def get_results_list(client, results_enabled):
             slides_results_list.append(result)
     return slides_results_list
 
-def replace_text(slides_service, presentation_id, slide_id, search, replace):
+def replace_text(slide_id, search, replace):
     requests = [{
         'replaceAllText': {
             'containsText': {
@@ -320,43 +441,18 @@ def replace_text(slides_service, presentation_id, slide_id, search, replace):
     return requests
 
 def refresh_slides(slides_service, presentation_id):
-    presentation = slides_service.presentations().get(presentationId=presentation_id).execute()
+    presentation = rate_limiter.execute(slides_service.presentations().get(presentationId=presentation_id), 'slides_read')
     return presentation.get('slides')
 
 
-def prompt_splitter(lst):
-    # This function take the list of prompts and split them by prefix to build the slides
-    prefix_dict = {}
-    for i in lst:
-        prefix = i[:3]  # Get the first three characters after "Result" for slides building
-        if prefix in prefix_dict:
-            prefix_dict[prefix].append(i)
-        else:
-            prefix_dict[prefix] = [i]
-    return list(prefix_dict.values())
-
-def build_starter_slides(slides_titles_list, slides_subtitles_list, slides_introductions):
-    ''' starter_slide = { main_title:
-                            subtitle:
-                            intro:
-                        }'''
-    starter_slides = {}
-    for i, (titles, subtitle, intro) in enumerate(zip(slides_titles_list, slides_subtitles_list, slides_introductions)):
-        starter_slides[titles.split(',')[0]] = {
-            'subtitle': subtitle,
-            'intro': intro
-        }
-    return starter_slides
-
-
-def build_slides_data(config, client, slides_titles_list, results_names_lists_list, slides_results_list):
+def build_slides_data(settings, client, slides_titles_list, results_names_lists_list, slides_results_list):
     '''output is slides_data = { main_title:
                                 result:{
                                     title:
                                     content:
                           }'''
     slides_data = {}
-    vers = config.get('MIS', 'version')
+    vers = settings.version
     for titles_list_str, results_names_list in zip(slides_titles_list, results_names_lists_list):
         titles_list = titles_list_str.strip(',').split(',')
         main_title = titles_list[0]
@@ -379,12 +475,9 @@ def build_slides_data(config, client, slides_titles_list, results_names_lists_li
     return slides_data
 
 
-def create_new_presentation(clients, client, slides_service, drive_service, config, vers):
-    cli_id = str(client['row_id'])
-    cli_uid = client['UID']
-    template_presentation_id = config.get('SLIDES', 'slides_template_id')
-    slides_folder_to_check_id = config.get('SLIDES', 'slides_folder_to_check_id')
-    slides_folder_sent_id = config.get('SLIDES', 'slides_folder_sent_id')
+def create_new_presentation(clients, client, slides_service, drive_service, settings, vers, template):
+    template_presentation_id = settings.template_id
+    slides_folder_to_check_id = settings.folder_to_check_id
 
     first_name, last_name = 'test', 'test'
 
@@ -399,17 +492,23 @@ def create_new_presentation(clients, client, slides_service, drive_service, conf
     elif 'holibotscript' in vers:
         new_presentation_title += f"HRReport tocheck {client_code}${date_now}"
 
-    # Duplicate the template with new title (with client data)
-    new_presentation = retry_function(lambda: drive_service.files().copy(fileId=template_presentation_id, body={"name": new_presentation_title}).execute(), type_label='duplicate_template')
+    # Take a ready copy from the template pool if there is one, of the version the index was made from
+    pool = template_pool.get_pool()
+    new_presentation_id = pool.take(drive_service, new_presentation_title, template.version) if pool else None
 
-    new_presentation_id = new_presentation.get('id')
+    if new_presentation_id is None:
+        # Duplicate the template with new title (with client data) directly in the "slides to check" folder
+        new_presentation = retry_function(lambda: rate_limiter.execute(drive_service.files().copy(
+            fileId=template_presentation_id,
+            body={"name": new_presentation_title, "parents": [slides_folder_to_check_id]},
+            fields='id'), 'drive_write'), type_label='duplicate_template')
 
-    # Move new file to specified folder ("slides to check" folder)
-    move_file(drive_service, new_presentation_id, slides_folder_to_check_id)
+        new_presentation_id = new_presentation.get('id')
 
-    slides = refresh_slides(slides_service, new_presentation_id)
+    # The copy has the same slides as the template, no need to read it back
+    deck = template.deck.copy_for(new_presentation_id)
 
-    return new_presentation_id, slides
+    return new_presentation_id, deck
 
 def results_count(slides_data):
     results_count = 0
@@ -418,197 +517,455 @@ def results_count(slides_data):
     return results_count
 
 
-def slides_filler(config, slides_service, new_presentation_id, slide_id, cursor, title, text_blocs_list):
-    slide_ids = [slide_id]  # Start with the original slide id
+def refill_slide(settings, slide_id, old_title, title, text):
+    # Update mode: new title and text in the slide and text box made by a previous run
+    requests = []
+    if old_title != title:
+        requests.extend(replace_text(slide_id, old_title, title))
+    requests.append({'deleteText': {'objectId': object_id('MyParagraphBox', slide_id), 'textRange': {'type': 'ALL'}}})
+    # The box is already there, only its text and styles are sent again
+    requests.extend(add_paragraph(settings, slide_id, text)[1:])
+    return requests
+
+def slides_filler(settings, requests, deck, slide_id_content_template, cursor, row_id, result, title, text_blocs_list,
+                  records, previous=None):
+    # records gets the fingerprint of each slide. previous has the ones stored when the deck
+    # was made, given in update mode only: changed slides are then filled again in place.
     for j, text in enumerate(text_blocs_list):
         text = text.replace('\n\n\n', '\n\n')
         text = text.replace('\n \n', '\n\n')
         # if there is text remaining to add in slide
         if len(text) > 2:
-            # if more than one slide and not last
-            if len(text_blocs_list) > 1 and j != len(text_blocs_list) - 1:
-                # print('  DEBUG - fill the slides ? Duplicate content template to index ' + str(cursor))
-                # input('DEBUG - fill the slides ? Duplicate content template to index ' + str(cursor))
-                new_slide_id = duplicate_move_slide_id(slides_service, new_presentation_id, slide_ids[-1], cursor)
-                slide_ids.append(new_slide_id)  # Add the new id to the list
-                global_updates_list = []
+            slide_id = object_id('slide', row_id, result, j)
+            records[slide_id] = {'fingerprint': content_cache.content_key('slide', title, text, fill_key(settings)),
+                                 'title': title}
+            old = previous.get(slide_id) if previous is not None else None
+            # In update mode a slide without a stored fingerprint is deleted first and made again
+            exists = slide_id in deck and (previous is None or old is not None)
+            # Each bloc gets a fresh copy of the empty content template, skipped if a previous run created it
+            if not exists:
+                duplicate_move_slide_id(requests, slide_id_content_template, slide_id, cursor)
+            if not exists or object_id('MyParagraphBox', slide_id) not in deck:
                 # Update sub result title
-                global_updates_list = replace_text(slides_service, new_presentation_id, slide_ids[-2], '{title}', title)
+                requests.extend(replace_text(slide_id, '{title}', title))
                 # And add paragraph of text to slide
-                global_updates_list.extend(add_paragraph(config, slide_ids[-2], text))
-                retry_function(lambda: slides_service.presentations().batchUpdate(presentationId=new_presentation_id, body={
-                        'requests': global_updates_list}).execute(), type_label='batchUpdate_slidefiller_1')
-            else:
-                # print('  DEBUG - fill the last slide, index ' + str(cursor))
-                # input('DEBUG - fill the only/last slide ?')
-                global_updates_list = []
-                global_updates_list = replace_text(slides_service, new_presentation_id, slide_ids[-1], '{title}', title)
-                global_updates_list.extend(add_paragraph(config, slide_ids[-1], text))
-                retry_function(lambda: slides_service.presentations().batchUpdate(presentationId=new_presentation_id, body={
-                        'requests': global_updates_list}).execute(), type_label='batchUpdate_slidefiller_2')
+                requests.extend(add_paragraph(settings, slide_id, text))
+            elif old is not None and old['fingerprint'] != records[slide_id]['fingerprint']:
+                requests.extend(refill_slide(settings, slide_id, old['title'], title, text))
             cursor += 1
-            # Prevent error 429 requests per minute per user
-            time.sleep(3)
     return cursor
 
-def build_slides_superpowers(config, client, titles_list, results_list, service, presentation):
-    prompts_list = config.get('INTEL', 'intel_prompts_list').split(',')
-    prompts_lists_list = prompt_splitter(prompts_list)
-
-    slides_data = build_slides_data(config, client, titles_list, prompts_lists_list, results_list)
-    # print(json.dumps(slides_data, indent=4))
-    last_title = list(slides_data.keys())[-1]
-    last_result = list(slides_data[last_title].keys())[-1]
-
-    cursor_begin = int(config.get('SLIDES', 'slides_first_title_page'))
+def fill_result(settings, deck, slide_id_content_template, cursor, row_id, result, title, content, records,
+                previous=None):
+    # Requests of the content slides of one result and the cursor after them.
+    # They come from the content cache when none of these slides exists yet.
+    cache = content_cache.get_cache()
+    if cache is not None:
+        key = content_cache.content_key('fill', row_id, result, title, content, slide_id_content_template, cursor,
+                                        fill_key(settings))
+        cached = cache.get(key)
+        if cached is not None and not any(slide_id in deck for slide_id in cached['slide_ids']):
+            records.update(cached['records'])
+            return cached['requests'], cached['cursor']
+
+    requests = []
+    result_records = {}
+    text_blocs_list = split_to_blocs(content, settings)
+    new_cursor = slides_filler(settings, requests, deck, slide_id_content_template, cursor,
+                               row_id, result, title, text_blocs_list, result_records, previous)
+    records.update(result_records)
+    if cache is not None:
+        slide_ids = [request['duplicateObject']['objectIds'][slide_id_content_template]
+                     for request in requests if 'duplicateObject' in request]
+        # Only complete results are cached, not the remainder of a resumed one
+        if len(slide_ids) == new_cursor - cursor == len(result_records):
+            cache.put(key, {'requests': requests, 'cursor': new_cursor, 'slide_ids': slide_ids,
+                            'records': result_records})
+    return requests, new_cursor
+
+def compile_slides_superpowers(settings, client, titles_list, results_list, deck, template, records, previous=None):
+    slides_data = build_slides_data(settings, client, titles_list, settings.prompt_groups, results_list)
+
+    cursor_begin = settings.first_title_page
     index_content_template = cursor_begin
     cursor = cursor_begin + 1
-    slides_done = ''
+    slide_id_content_template = template.slide_id_at(index_content_template)
+    groups = []
 
     first_key = list(slides_data.keys())[0]
     superpowers_dict = slides_data[first_key]
 
     # For each result, add in text in slides
     for i, (result, slide) in enumerate(superpowers_dict.items()):
-        # print('  [DEBUG] result='+result+' - title=' + slide['title']+ ' - cur='+ str(cursor))
-        slides = refresh_slides(service, presentation)
-        slide_id_content_template = slides[index_content_template - 1]['objectId']
         title = slide['title'].strip()
-        text_blocs_list = split_to_blocs(slide['content'], config)
-
-        # Duplicate content + move to cursor
-        # print('  DEBUG - Duplicate content template '+str(slide_id_content_template)+' + Move to index '+str(cursor))
-        slide_id = duplicate_move_slide_id(service, presentation, slide_id_content_template, cursor)
 
-        # print('  DEBUG - fill the slides...')
-        # Duplicate and/or fill title+content slide(s)
-        cursor = slides_filler(config, service, presentation, slide_id, cursor,
-                               title, text_blocs_list)
+        # Duplicate content template to cursor and fill title+content slide(s)
+        requests, cursor = fill_result(settings, deck, slide_id_content_template, cursor,
+                                       client['row_id'], result, title, slide['content'], records, previous)
+        groups.append((result, requests, cursor))
 
-        slides_done = 'OK'
-        # break here to debug slides
+    return groups
 
-    return slides_done
+def compile_slides_holistic(settings, client, titles_list, results_list, starter_slide, deck, template, records,
+                            previous=None):
+    slides_data = build_slides_data(settings, client, titles_list, settings.prompt_groups, results_list)
 
-def build_slides_holistic(config, client, titles_list, results_list, starter_slide, service, presentation):
-    prompts_list = config.get('INTEL', 'intel_prompts_list').split(',')
-    prompts_lists_list = prompt_splitter(prompts_list)
-
-    slides_data = build_slides_data(config, client, titles_list, prompts_lists_list, results_list)
-    # print(json.dumps(slides_data, indent=4))
-    last_title = list(slides_data.keys())[-1]
-    last_result = list(slides_data[last_title].keys())[-1]
-
-    cursor_begin = int(config.get('SLIDES', 'slides_first_title_page'))
+    cursor_begin = settings.first_title_page
     index_main_title_template = cursor_begin
     index_content_template = cursor_begin + 1
     cursor = cursor_begin + 2
-    slides_done = ''
+    # Template slides are duplicated, never moved, their IDs come from the template index
+    slide_id_main_title_template = template.slide_id_at(index_main_title_template)
+    slide_id_content_template = template.slide_id_at(index_content_template)
+    main_title_placeholders = template.placeholders(slide_id_main_title_template)
+    groups = []
     # For each main title we fetch the result
     for main_title, results in slides_data.items():
-        # print('[DEBUG]['+str(client['row_id'])+'] Creating slides of '+main_title)
         first_enabled_found = False
-        # print('results='+repr(results))
         # For each result, add in text in slides
         for result, slide in results.items():
-            # print('  [DEBUG] result='+result+' - title=' + slide['title']+ ' - cur='+ str(cursor))
-            slides = refresh_slides(service, presentation)
-            slide_id_main_title_template = slides[index_main_title_template - 1]['objectId']
-            slide_id_content_template = slides[index_content_template - 1]['objectId']
             title = slide['title'].strip()
-            text_blocs_list = split_to_blocs(slide['content'], config)
+            requests = []
 
             # If first result of bloc OR only 1 result => duplicate 2 templates, move to cursor, fill
             if not first_enabled_found or len(results_list) == 1:
                 first_enabled_found = True
-                subtitle = starter_slide[main_title]['subtitle']
-                intro = starter_slide[main_title]['intro'].replace('{first_name}', client['First name']).replace('&&&',
-                                                                                                                 '\n\n')
-                intro_blocs = split_to_blocs(intro, config)
-                # print(' DEBUG - first bloc of ', main_title,' => ', title, 'cur='+str(cursor)+'&'+str(cursor+1))
-                slide_id = duplicate_move_slide_id(service, presentation, slide_id_main_title_template,
-                                                   cursor)
-                global_updates_list = []
-                global_updates_list = replace_text(service, presentation, slide_id, '{title}',
-                                                   main_title.strip())
-                global_updates_list.extend(replace_text(service, presentation, slide_id, '{subtitle}',
-                                                   subtitle.strip()))
-                retry_function(lambda: service.presentations().batchUpdate(
-                    presentationId=presentation, body={
-                        'requests': global_updates_list}).execute(),
-                               type_label='batchUpdate_replace_title_subtitle')
+                subtitle = starter_slide[main_title]['subtitle'].strip()
+                slide_id = object_id('title', client['row_id'], main_title, result)
+                record = {'fingerprint': content_cache.content_key('title', main_title.strip(), subtitle),
+                          'main_title': main_title.strip(), 'subtitle': subtitle}
+                records[slide_id] = record
+                old = previous.get(slide_id) if previous is not None else None
+                if slide_id not in deck or (previous is not None and old is None):
+                    duplicate_move_slide_id(requests, slide_id_main_title_template, slide_id, cursor)
+                    # Only the placeholders the template slide has are replaced
+                    if '{title}' in main_title_placeholders:
+                        requests.extend(replace_text(slide_id, '{title}', record['main_title']))
+                    if '{subtitle}' in main_title_placeholders:
+                        requests.extend(replace_text(slide_id, '{subtitle}', subtitle))
+                elif old is not None and old['fingerprint'] != record['fingerprint']:
+                    # Update mode: the texts of the previous run are replaced in place
+                    if old['main_title'] != record['main_title']:
+                        requests.extend(replace_text(slide_id, old['main_title'], record['main_title']))
+                    if old['subtitle'] != subtitle:
+                        requests.extend(replace_text(slide_id, old['subtitle'], subtitle))
                 cursor += 1
 
-            # Duplicate content + move to cursor
-            # print('DEBUG - Duplicate content + Move to index '+str(cursor))
-            slide_id = duplicate_move_slide_id(service, presentation, slide_id_content_template, cursor)
+            # Duplicate content template to cursor and fill title+content slide(s)
+            fill_requests, cursor = fill_result(settings, deck, slide_id_content_template, cursor,
+                                                client['row_id'], result, title, slide['content'], records,
+                                                previous)
+            groups.append((result, requests + fill_requests, cursor))
+
+    return groups
+
+def stale_slides_requests(deck, records, previous):
+    # Update mode: slides made by this script (deterministic IDs) for blocs or results
+    # that are gone, or without a stored fingerprint, are deleted before the fill
+    if previous is None:
+        return []
+    return [{'deleteObject': {'objectId': slide_id}} for slide_id in deck.slide_ids
+            if GENERATED_SLIDE_PATTERN.match(slide_id) and (slide_id not in records or slide_id not in previous)]
+
+def send_deck(settings, client, service, deck, groups, records, previous, type_label):
+    journal_key = journal.client_key(client, settings.version)
+    with metrics.span('fill', client['row_id']):
+        deletes = stale_slides_requests(deck, records, previous)
+        report = {'requests': 0, 'batches': 0}
+        if deletes:
+            # Sent on their own so the IDs of the deleted slides are free again for the fill
+            report = send_requests(settings, service, deck, [(None, deletes, None)], type_label=type_label)
+        fill_report = send_requests(settings, service, deck, groups, type_label=type_label, journal_key=journal_key)
+        if settings.verify_deck:
+            deck.verify(service)
+    print('[INFO][' + str(client['row_id']) + ']🖼️📦 ' + str(report['requests'] + fill_report['requests'])
+          + ' requests sent in ' + str(report['batches'] + fill_report['batches']) + ' batchUpdate call(s)')
+    return 'OK'
+
+def build_slides_superpowers(settings, client, titles_list, results_list, service, deck, template, records,
+                             previous=None):
+    with metrics.span('layout', client['row_id']):
+        groups = compile_slides_superpowers(settings, client, titles_list, results_list, deck, template, records,
+                                            previous)
+    return send_deck(settings, client, service, deck, groups, records, previous, 'batchUpdate_superpowers')
+
+def build_slides_holistic(settings, client, titles_list, results_list, starter_slide, service, deck, template,
+                          records, previous=None):
+    with metrics.span('layout', client['row_id']):
+        groups = compile_slides_holistic(settings, client, titles_list, results_list, starter_slide, deck, template,
+                                         records, previous)
+    return send_deck(settings, client, service, deck, groups, records, previous, 'batchUpdate_holistic')
+
+def get_services():
+    # googleapi keeps one Drive and one Slides service per worker thread
+    return googleapi.get_drive_srv(), googleapi.get_slides_srv()
+
+
+# An edit of the template during a run is seen after at most this delay
+TEMPLATE_CHECK_SECONDS = 60
+_template_versions = {}
+_template_versions_lock = threading.Lock()
+
+
+def get_template_revision(drive_service, template_id):
+    # Part of the fingerprint of every deck and the key of the template index
+    with _template_versions_lock:
+        version, checked = _template_versions.get(template_id, (None, 0))
+        if time.monotonic() - checked > TEMPLATE_CHECK_SECONDS:
+            version = template_pool.get_template_version(drive_service, template_id)
+            _template_versions[template_id] = (version, time.monotonic())
+        return version
+
+
+def deck_fingerprint(settings, client, vers, slides_results_list, template_version):
+    # Hash of every input of a deck, a client with the same fingerprint gets the same deck
+    results = {name: client.get('Result ' + name, '') for name in settings.prompts_list}
+    return content_cache.content_key('deck', vers, settings.template_id, template_version, fill_key(settings),
+                                     settings.first_title_page, settings.slides_titles_list,
+                                     settings.slides_subtitles_list, results, slides_results_list)
+
+
+def resume_presentation(slides_service, presentation_id):
+    # Deck of an interrupted run or to update as the server has it, None if it was deleted since
+    try:
+        return DeckModel.from_server(slides_service, presentation_id)
+    except HttpError as e:
+        if error_status(e) == 404:
+            return None
+        raise
+
 
-            # print('DEBUG - fill the slides...')
-            # Duplicate and/or fill title+content slide(s)
-            cursor = slides_filler(config, service, presentation, slide_id, cursor,
-                                   title, text_blocs_list)
+def presentation_id_from_link(link):
+    match = PRESENTATION_LINK_PATTERN.search(link)
+    return match.group(1) if match else None
 
-            slides_done = 'OK'
-            # break here to debug slides
 
-    return slides_done
+def make_client_slides(clients, client, settings, vers, slides_titles_list, slides_results_list, starter_slide,
+                       presentation_id=None):
+    # presentation_id is an existing deck of the client to update instead of making a new one.
+    # Returns the outcome: {'status': 'done', 'up_to_date' or 'error', 'presentation_id': ...}
+    # Every call of the deck is made by one service account, the one that started it
+    run_journal = journal.get_journal()
+    state = run_journal.state(journal.client_key(client, settings.version)) if run_journal else None
+    try:
+        identity = identities.choose(state['identity'] if state else None)
+    except identities.UnknownIdentity as e:
+        print('[ERROR][' + str(client['row_id']) + '][' + client['UID'] + ']🖼️🔴 Deck '
+              + state['presentation_id'] + ' cannot be resumed: ' + str(e))
+        return {'status': 'error', 'presentation_id': state['presentation_id'], 'error': repr(e)}
+    with identities.use(identity):
+        outcome = build_client_deck(clients, client, settings, vers, slides_titles_list, slides_results_list,
+                                    starter_slide, presentation_id)
+    if outcome is not None:
+        outcome['identity'] = identity
+    return outcome
+
+
+def build_client_deck(clients, client, settings, vers, slides_titles_list, slides_results_list, starter_slide,
+                      presentation_id=None):
+    run_journal = journal.get_journal()
+    journal_key = journal.client_key(client, settings.version)
+    state = run_journal.state(journal_key) if run_journal else None
+    if state and presentation_id and state['presentation_id'] != presentation_id:
+        # The journal is about another deck of this client
+        state = None
+    drive_service, slides_service = get_services()
 
-def results_to_slides(clients, config, vers):
-    print('[INFO]🖼️▶️ Slides maker')
-    presentation_done = False
+    try:
+        template_version = get_template_revision(drive_service, settings.template_id)
+        template = template_index.get_template_index(slides_service, settings.template_id, template_version,
+                                                     settings.template_index_dir)
+    except Exception as e:
+        print('[ERROR][' + str(client['row_id']) + '][' + client['UID'] + ']🖼️🔴 Could not read the template: ' + repr(e))
+        return {'status': 'error', 'presentation_id': presentation_id, 'error': repr(e)}
+    fingerprint = deck_fingerprint(settings, client, vers, slides_results_list, template_version)
+    if state and state['done']:
+        if state['fingerprint'] in (None, fingerprint):
+            # Same results, settings and template as the deck already made, no copy and no fill
+            print('[INFO][' + str(client['row_id']) + '][' + client['UID'] + ']🖼️⏭️ Slidesdeck up to date: '
+                  + state['presentation_id'])
+            return {'status': 'up_to_date', 'presentation_id': state['presentation_id']}
+        if state['slides'] is not None and state['template_version'] == template_version:
+            # Only the slides whose content changed are sent again, in the same presentation
+            presentation_id = state['presentation_id']
+            print('[INFO][' + str(client['row_id']) + ']🖼️🔄 Results or settings changed, updating '
+                  + presentation_id)
+        elif presentation_id:
+            # Template changed, every generated slide is made again in the same presentation
+            state = None
+        else:
+            print('[INFO][' + str(client['row_id']) + ']🖼️🔄 Template changed since '
+                  + state['presentation_id'] + ', making a new deck')
+            run_journal.discard(journal_key)
+            state = None
+    resuming = state is not None and not state['done']
+    if resuming:
+        presentation_id = state['presentation_id']
+    # Fingerprints of the slides already in the deck, None to trust them all (resumed first build)
+    previous = None
+    if presentation_id and not (resuming and not state['updating']):
+        previous = state['slides'] if state and state['slides'] is not None else {}
+
+    print('[INFO][' + str(client['row_id']) + '][' + client['UID'] + ']🖼️⏳ '
+          + ('Updating' if previous is not None else 'Creating') + ' slides... ')
+
+    created = False
+    try:
+        with metrics.span('copy', client['row_id']):
+            deck = resume_presentation(slides_service, presentation_id) if presentation_id else None
+            if deck is not None:
+                new_presentation_id = deck.presentation_id
+                if resuming:
+                    # Slides already in the deck are skipped, the fill restarts at the first incomplete result
+                    print('[INFO][' + str(client['row_id']) + ']🖼️🔁 Resuming ' + new_presentation_id + ' after '
+                          + str(len(state['results'])) + ' result(s), cursor ' + str(state['cursor']))
+                elif run_journal:
+                    run_journal.record_update(journal_key, new_presentation_id, identities.current())
+            else:
+                if state:
+                    run_journal.discard(journal_key)
+                previous = None
+                # Create a new presentation
+                new_presentation_id, deck = create_new_presentation(clients, client, slides_service, drive_service,
+                                                                    settings, vers, template)
+                created = True
+                if run_journal:
+                    run_journal.record_copy(journal_key, new_presentation_id, identities.current())
 
-    drive_service = googleapi.get_drive_srv()
-    slides_service = googleapi.get_slides_srv()
+        try:
+            records = {}
+            if 'freesuperpowers' in vers or 'fullsuperpowers' in vers:
+                slides_done = build_slides_superpowers(settings, client, slides_titles_list, slides_results_list,
+                                                       slides_service, deck, template, records, previous)
+            else:
+                slides_done = build_slides_holistic(settings, client, slides_titles_list, slides_results_list,
+                                                    starter_slide, slides_service, deck, template, records,
+                                                    previous)
+            if slides_done == 'OK':
+                if run_journal:
+                    run_journal.record_done(journal_key, fingerprint, template_version, records)
+                print('[INFO][' + str(client['row_id']) + '][' + client['UID'] + ']🖼️✅ Slidesdeck done')
+            return {'status': 'done', 'presentation_id': new_presentation_id}
+        except Exception as e:
+            exc_type, exc_obj, exc_tb = sys.exc_info()
+            line_number = exc_tb.tb_lineno
+            if run_journal or not created:
+                # An existing deck is never deleted
+                print('[ERROR][' + str(client['row_id']) + '][' + client['UID'] + ']🖼️🔴 Error line '+str(line_number)+', presentation kept to resume on the next run: '+repr(e))
+            else:
+                print('[ERROR][' + str(client['row_id']) + '][' + client['UID'] + ']🖼️🔴 Deleting presentation because of error line '+str(line_number)+': '+repr(e))
+                # Deleted with the others at the end of the run, in batch requests
+                if not drive_batch.queue_delete(new_presentation_id):
+                    rate_limiter.execute(drive_service.files().delete(fileId=new_presentation_id), 'drive_write')
+                new_presentation_id = None
+            return {'status': 'error', 'presentation_id': new_presentation_id, 'error': repr(e)}
+    except Exception as e:
+        exc_type, exc_obj, exc_tb = sys.exc_info()
+        line_number = exc_tb.tb_lineno
+        print('[ERROR][' + str(client['row_id']) + '][' + client['UID'] + ']🖼️🔴 Error line '+str(line_number)+' creating slides: ' + repr(e))
+        return {'status': 'error', 'presentation_id': presentation_id, 'error': repr(e)}
+
+
+def iter_client_jobs(clients, settings, vers, update=False):
+    # Format must be {Result name:Result content}
+    for client in clients:
+        slides_results_list = get_results_list(client, settings.results_enabled)
+
+        results_filled = True  # Assume all results are filled
+        for title in settings.results_enabled:
+            if client.get('Result ' + title.strip(), '') == '':
+                results_filled = False
+                break
+
+        if not results_filled or len(slides_results_list) == 0:
+            continue
+        link = client['Slides link'].strip()
+        if link == '':
+            yield (clients, client, settings, vers, settings.slides_titles_list, slides_results_list,
+                   settings.starter_slide)
+        elif update and presentation_id_from_link(link):
+            # The deck of the link is updated in place, only the changed slides are sent
+            yield (clients, client, settings, vers, settings.slides_titles_list, slides_results_list,
+                   settings.starter_slide, presentation_id_from_link(link))
+
+
+def run_job(job, on_outcome=None):
+    outcome = make_client_slides(*job)
+    # e.g. the write-back of the Slides link and Status to the clients sheet, see sheets
+    if on_outcome is not None and outcome is not None:
+        on_outcome(job[1], outcome)
+    return outcome
+
+
+def run_jobs(jobs, workers, on_outcome=None):
+    if workers <= 1:
+        for job in jobs:
+            run_job(job, on_outcome)
+        return
+    # Each deck is built by one worker so its requests stay in order, decks run in parallel.
+    # At most 2 jobs per worker are queued, the clients are not all loaded at once
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        for job in jobs:
+            if len(pending) >= workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    future.result()
+            pending.add(executor.submit(run_job, job, on_outcome))
+        for future in pending:
+            future.result()
+
+
+def configure_run(config):
+    # Parse and check the whole config before any Drive call
+    settings = load_settings(config)
+    rate_limiter.configure(config)
+    identities.configure(config)
+    metrics.configure(config)
+    if settings.fake_api:
+        # Offline run against an in-memory Drive/Slides with a seeded template
+        import fake_google
+        googleapi.use_fake_backend(fake_google.backend_from_settings(settings))
+    return settings
+
+
+@contextlib.contextmanager
+def open_run(settings):
+    # Template pool, journal and content cache shared by the decks of a run
+    template_pool.start_pool(settings)
+    journal.open_journal(settings.journal_path)
+    content_cache.open_cache(settings.cache_dir, settings.cache_max_mb)
+    drive_batch.open_delete_queue()
+    _template_versions.clear()
+    try:
+        yield
+    finally:
+        template_pool.stop_pool()
+        drive_batch.close_delete_queue()
+        journal.close_journal()
+        content_cache.close_cache()
+        metrics.flush()
+
+
+def results_to_slides(clients, config, vers, workers=None, update=False, on_outcome=None):
+    # update=True also updates the clients that already have a Slides link, in their deck.
+    # on_outcome(client, outcome) is called after each deck, from the worker threads.
+    print('[INFO]🖼️▶️ Slides maker')
 
-    # Put config titles in a list of X lists with the X category
-    # For each title, built the dataset of categories
-    slides_titles_list = config.slides_titles.split('\n')
-    slides_subtitles_list = config.slides_subtitles.split('\n')
-    slides_introductions = config.slides_introductions.replace('\n\n','\n').split('\n')
-    results_enabled_str = config.intel_results_enabled
-    results_enabled = results_enabled_str.split(',')
+    settings = configure_run(config)
+    if workers is None:
+        workers = settings.workers
 
-    starter_slide = build_starter_slides(slides_titles_list, slides_subtitles_list, slides_introductions)
-    # print(json.dumps(starter_slide, indent=4))
+    results_enabled = settings.results_enabled
 
     if len(results_enabled) >= 1:
-        # Format must be {Result name:Result content}
-        for client in clients:
-            slides_results_list = get_results_list(client, results_enabled)
-
-            results_filled = True  # Assume all results are filled
-            for title in results_enabled:
-                if client['Result ' + title.strip()] == '':
-                    results_filled = False
-                    break
-
-            if results_filled and len(slides_results_list) > 0 and client['Slides link'].strip() == '':
-                presentation_done = True
-                print('[INFO][' + str(client['row_id']) + '][' + client['UID'] + ']🖼️⏳ Creating slides... ')
-
-                try:
-                    # Create a new presentation
-                    new_presentation_id, slides = create_new_presentation(clients, client, slides_service, drive_service, config, vers)
-
-                    try:
-                        if 'freesuperpowers' in vers or 'fullsuperpowers' in vers:
-                            slides_done = build_slides_superpowers(config, client, slides_titles_list, slides_results_list,
-                                                                   slides_service, new_presentation_id)
-                        else:
-                            slides_done = build_slides_holistic(config, client, slides_titles_list, slides_results_list,
-                                                                starter_slide, slides_service, new_presentation_id)
-                        if slides_done == 'OK':
-                            print('[INFO][' + str(client['row_id']) + '][' + client['UID'] + ']🖼️✅ Slidesdeck done')
-                    except Exception as e:
-                        exc_type, exc_obj, exc_tb = sys.exc_info()
-                        line_number = exc_tb.tb_lineno
-                        print('[ERROR][' + str(client['row_id']) + '][' + client['UID'] + ']🖼️🔴 Deleting presentation because of error line '+str(line_number)+': '+repr(e))
-                        drive_service.files().delete(fileId=new_presentation_id).execute()
-                except Exception as e:
-                    exc_type, exc_obj, exc_tb = sys.exc_info()
-                    line_number = exc_tb.tb_lineno
-                    print('[ERROR][' + str(client['row_id']) + '][' + client['UID'] + ']🖼️🔴 Error line '+str(line_number)+' creating slides: ' + repr(e))
-        if not presentation_done:
+        # clients can be a list or an iterator (see convertTxtToJson.iter_clients), jobs are made on the fly
+        jobs = iter_client_jobs(clients, settings, vers, update)
+        first_job = next(jobs, None)
+        if first_job is not None:
+            with open_run(settings):
+                run_jobs(itertools.chain([first_job], jobs), workers, on_outcome)
+        else:
             print('[INFO]🖼️ No slidesdeck to make')
     else:
         print('[INFO]🖼️ No result enabled')
@@ -618,7 +975,8 @@ def results_to_slides(clients, config, vers):
 """
 HERE IS THE MAIN FUNCTION TO RUN TO BE ABLE TO PRODUCE REPORTS
 "clients" variable can be loaded from the txt file I sent you clients_list.txt
-"config" variable can be skipped and you can replace the values by what I sent in the email
+"config" is read from slides.ini (python slides.py [slides.ini]) with the values I sent in the email,
+the long texts come from config.py
 "vers" variable can be equals to "freesuperpowersdev" or "holibotscriptdev"
 """
 
@@ -751,6 +1109,14 @@ clients = [
 ]
 vers = "freesuperpowersdev"
 
-print('script start')
-results_to_slides(clients, config, vers)
-print('script end')
+if __name__ == '__main__':
+    print('script start')
+    file_config = FileConfig()
+    config_path = sys.argv[1] if len(sys.argv) > 1 else 'slides.ini'
+    if not file_config.read(config_path, encoding='utf-8'):
+        print('[WARNING]⚠️ Cannot read ' + config_path)
+    try:
+        results_to_slides(clients, file_config, vers)
+    except SettingsError as e:
+        print('[ERROR]🔴 Bad config: ' + str(e))
+    print('script end')
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+# On-disk index of the template presentation, one file per Drive version of the template.
+# It has the slide IDs in order, the role of each slide (main title, content or static),
+# the elements holding the {title}/{subtitle} placeholders and the geometry of the text
+# boxes. Decks are built from it without reading the template again. An edit of the
+# template gives a new version, so a new index, and the old file is removed.
+import json
+import os
+import re
+import threading
+
+import rate_limiter
+from deck_model import DeckModel
+
+INDEX_VERSION = 1
+INDEX_FIELDS = ('slides(objectId,pageElements(objectId,size,transform,'
+                'shape(shapeType,text(textElements(textRun(content))))))')
+PLACEHOLDER_PATTERN = re.compile(r'\{[a-z_]+\}')
+
+
+def element_text(element):
+    text_elements = element.get('shape', {}).get('text', {}).get('textElements', [])
+    return ''.join(text_element.get('textRun', {}).get('content', '') for text_element in text_elements)
+
+
+def slide_role(placeholders):
+    if '{subtitle}' in placeholders:
+        return 'main_title'
+    if '{title}' in placeholders:
+        return 'content'
+    return 'static'
+
+
+def build_index(presentation, template_id, version):
+    slides = []
+    for slide in presentation.get('slides', []):
+        elements = []
+        placeholders = {}
+        for element in slide.get('pageElements', []):
+            for placeholder in PLACEHOLDER_PATTERN.findall(element_text(element)):
+                placeholders.setdefault(placeholder, element['objectId'])
+            elements.append({'objectId': element['objectId'],
+                             'shapeType': element.get('shape', {}).get('shapeType'),
+                             'size': element.get('size'), 'transform': element.get('transform')})
+        slides.append({'objectId': slide['objectId'], 'role': slide_role(placeholders),
+                       'placeholders': placeholders, 'pageElements': elements})
+    return {'index_version': INDEX_VERSION, 'template_id': template_id, 'version': version, 'slides': slides}
+
+
+class TemplateIndex:
+    def __init__(self, data):
+        self.template_id = data['template_id']
+        self.version = data['version']
+        self.slides = data['slides']
+        self.slide_ids = [slide['objectId'] for slide in self.slides]
+        self.by_id = {slide['objectId']: slide for slide in self.slides}
+        # Every copy starts from this layout, see DeckModel.copy_for
+        self.deck = DeckModel(self.template_id, self.slides)
+
+    def slide_id_at(self, page):
+        # page is 1-based like slides_first_title_page
+        return self.slide_ids[page - 1]
+
+    def placeholders(self, slide_id):
+        # {placeholder: element ID} of a template slide
+        return self.by_id[slide_id]['placeholders']
+
+
+def index_path(directory, template_id, version):
+    return os.path.join(directory, template_id + '.' + str(version) + '.json')
+
+
+def read_index_file(path, template_id, version):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if data.get('index_version') != INDEX_VERSION or data.get('template_id') != template_id \
+            or data.get('version') != version:
+        return None
+    return data
+
+
+def write_index_file(directory, data):
+    os.makedirs(directory, exist_ok=True)
+    path = index_path(directory, data['template_id'], data['version'])
+    tmp_path = path + '.' + str(threading.get_ident()) + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    # The index of the previous versions of this template will not be read again
+    for name in os.listdir(directory):
+        if name.startswith(data['template_id'] + '.') and name.endswith('.json') \
+                and os.path.join(directory, name) != path:
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_template_index(slides_service, template_id, version, directory=''):
+    # Index of this version of the template, from memory, then from disk, then from the API.
+    # directory = '' keeps it in memory only. The file and the API are read without the lock,
+    # two threads missing it at once may both build it and the first one published is kept.
+    key = (template_id, version)
+    with _indexes_lock:
+        if key in _indexes:
+            return _indexes[key]
+    data = read_index_file(index_path(directory, template_id, version), template_id, version) \
+        if directory else None
+    if data is None:
+        presentation = rate_limiter.execute(slides_service.presentations().get(
+            presentationId=template_id, fields=INDEX_FIELDS), 'slides_read')
+        data = build_index(presentation, template_id, version)
+        if directory:
+            write_index_file(directory, data)
+        print('[INFO]🖼️🗂️ Template ' + template_id + ' version ' + str(version) + ' indexed: '
+              + ', '.join(slide['role'] for slide in data['slides']))
+    index = TemplateIndex(data)
+    with _indexes_lock:
+        if key not in _indexes:
+            # Only the current version is kept in memory
+            for old_key in [old_key for old_key in _indexes if old_key[0] == template_id]:
+                del _indexes[old_key]
+            _indexes[key] = index
+        return _indexes[key]
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+import collections
+import threading
+import time
+
+import drive_batch
+import googleapi
+import identities
+import rate_limiter
+from retry import retry_function
+
+# Pooled copies are tagged 'template_id:version:identity' so a new run can adopt the ones
+# left by the previous one, each by the identity that made it
+POOL_PROPERTY = 'template_pool'
+POOL_COPY_NAME = 'template pool copy'
+
+
+def get_template_version(drive_service, template_id):
+    # Drive 'version' changes on every edit of the file, also for native Google files
+    template = rate_limiter.execute(drive_service.files().get(fileId=template_id, fields='version'), 'drive_read')
+    return template['version']
+
+
+def pool_tag(template_id, version, identity):
+    return template_id + ':' + str(version) + ':' + identity
+
+
+class TemplatePool:
+    # Keeps `size` unnamed copies of the template ready in the to-check folder for each identity,
+    # made by that identity so the deck owner pays the copy. A background thread refills the pool
+    # and drops copies made from an old template version. Ready copies are kept for the next run.
+    def __init__(self, template_id, folder_id, size, check_interval=60):
+        self.template_id = template_id
+        self.folder_id = folder_id
+        self.size = size
+        self.check_interval = check_interval
+        self.version = None
+        # Version of the template seen by the last take, a newer one triggers a version check
+        self.seen_version = None
+        # (file_id, version, identity)
+        self.copies = collections.deque()
+        self.lock = threading.Lock()
+        self.wanted = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.hits = 0
+        self.misses = 0
+        self.copy_seconds = 0.0
+        self.copies_made = 0
+        self.saved_seconds = 0.0
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='template-pool', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        # Copies of the current version stay in the folder for the next run to adopt
+        self.stopped.set()
+        self.wanted.set()
+        if self.thread:
+            self.thread.join()
+        with self.lock:
+            stale = [copy for copy in self.copies if copy[1] != self.version]
+            self.copies = collections.deque(copy for copy in self.copies if copy[1] == self.version)
+        self.delete_copies(stale)
+
+    def average_copy_seconds(self):
+        return self.copy_seconds / self.copies_made if self.copies_made else 0.0
+
+    def ready(self, identity):
+        with self.lock:
+            return sum(1 for copy in self.copies if copy[2] == identity and copy[1] == self.version)
+
+    def take(self, drive_service, name, version):
+        # Returns the ID of a ready copy of this template version made by the current identity,
+        # renamed to `name`, or None if there is none. version is the one the deck is filled from.
+        identity = identities.current()
+        with self.lock:
+            self.seen_version = version
+            file_id = None
+            for copy in self.copies:
+                if copy[1] == version and copy[2] == identity:
+                    file_id = copy[0]
+                    self.copies.remove(copy)
+                    break
+            if file_id is None:
+                self.misses += 1
+        self.wanted.set()
+        if file_id is None:
+            return None
+
+        start = time.perf_counter()
+        retry_function(lambda: rate_limiter.execute(drive_service.files().update(
+            fileId=file_id,
+            body={'name': name, 'appProperties': {POOL_PROPERTY: None}},
+            fields='id'), 'drive_write'), type_label='rename_pool_copy')
+        with self.lock:
+            self.hits += 1
+            self.saved_seconds += max(0.0, self.average_copy_seconds() - (time.perf_counter() - start))
+        return file_id
+
+    def stats(self):
+        taken = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / taken if taken else 0.0,
+            'saved_seconds': self.saved_seconds,
+            'ready': len(self.copies),
+        }
+
+    def run(self):
+        drive_service = googleapi.get_drive_srv()
+        try:
+            self.version = get_template_version(drive_service, self.template_id)
+            self.adopt_copies(drive_service)
+        except Exception as e:
+            print('[WARNING]⚠️ Template pool could not start: ' + repr(e))
+            return
+        last_check = time.monotonic()
+        while not self.stopped.is_set():
+            try:
+                if time.monotonic() - last_check > self.check_interval \
+                        or self.seen_version not in (None, self.version):
+                    last_check = time.monotonic()
+                    self.check_version(drive_service)
+                # The identity with the fewest ready copies is refilled first
+                identity = min(identities.names(), key=self.ready)
+                if self.ready(identity) < self.size:
+                    self.add_copy(identity)
+                    continue
+            except Exception as e:
+                print('[WARNING]⚠️ Template pool refill failed: ' + repr(e))
+            self.wanted.wait(self.check_interval)
+            self.wanted.clear()
+
+    def check_version(self, drive_service):
+        version = get_template_version(drive_service, self.template_id)
+        if version != self.version:
+            print('[INFO]🖼️ Template changed, dropping ' + str(len(self.copies)) + ' pooled copies')
+            with self.lock:
+                self.version = version
+                stale = list(self.copies)
+                self.copies.clear()
+            self.delete_copies(stale)
+
+    def adopt_copies(self, drive_service):
+        # Copies left by a previous run: the ones of this version and of a known identity are
+        # used again, the ones of an old version of this template are deleted
+        query = ("'" + self.folder_id + "' in parents and trashed = false and name = '" + POOL_COPY_NAME + "'")
+        response = rate_limiter.execute(drive_service.files().list(q=query, fields='files(id,appProperties)'),
+                                        'drive_read')
+        names = identities.names()
+        stale = []
+        with self.lock:
+            for file in response.get('files', []):
+                template_id, version, identity = (file.get('appProperties', {}).get(POOL_PROPERTY, '')
+                                                  .split(':') + ['', '', ''])[:3]
+                if template_id != self.template_id:
+                    continue
+                if version == str(self.version) and identity in names:
+                    self.copies.append((file['id'], self.version, identity))
+                else:
+                    stale.append((file['id'], version, identity if identity in names else names[0]))
+        self.delete_copies(stale)
+
+    def add_copy(self, identity):
+        version = self.version
+        start = time.perf_counter()
+        with identities.acting_as(identity):
+            drive_service = googleapi.get_drive_srv()
+            new_copy = retry_function(lambda: rate_limiter.execute(drive_service.files().copy(
+                fileId=self.template_id,
+                body={'name': POOL_COPY_NAME, 'parents': [self.folder_id],
+                      'appProperties': {POOL_PROPERTY: pool_tag(self.template_id, version, identity)}},
+                fields='id'), 'drive_write'), type_label='pool_template_copy')
+        self.copy_seconds += time.perf_counter() - start
+        self.copies_made += 1
+        with self.lock:
+            self.copies.append((new_copy['id'], version, identity))
+
+    def delete_copies(self, copies):
+        # Each copy is deleted by the identity that made it, one batch request per 100 copies
+        file_ids = collections.defaultdict(list)
+        for file_id, version, identity in copies:
+            file_ids[identity].append(file_id)
+        for identity, identity_file_ids in file_ids.items():
+            try:
+                with identities.acting_as(identity):
+                    errors = drive_batch.delete_files(googleapi.get_drive_srv(), identity_file_ids)
+            except Exception as e:
+                errors = {file_id: e for file_id in identity_file_ids}
+            for file_id, error in errors.items():
+                print('[WARNING]⚠️ Could not delete pooled copy ' + file_id + ': ' + repr(error))
+
+
+_pool = None
+
+
+def start_pool(settings):
+    global _pool
+    if settings.template_pool_size > 0:
+        _pool = TemplatePool(settings.template_id, settings.folder_to_check_id, settings.template_pool_size)
+        _pool.start()
+    return _pool
+
+
+def get_pool():
+    return _pool
+
+
+def stop_pool():
+    global _pool
+    pool, _pool = _pool, None
+    if pool:
+        pool.stop()
+        stats = pool.stats()
+        print('[INFO]🖼️ Template pool hit rate ' + str(round(stats['hit_rate'] * 100)) + '% ('
+              + str(stats['hits']) + ' hits, ' + str(stats['misses']) + ' misses), '
+              + str(round(stats['saved_seconds'], 1)) + 's saved')
+    return pool
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+# text_layout against layout_golden.json, on the sample results of output.json
+#   python -m pytest -q test_layout.py
+import json
+
+import pytest
+
+import text_layout
+from bench_layout import GOLDEN_PATH, bloc_lines, same_text, sample_config, sample_results
+from settings import load_settings
+
+SETTINGS = load_settings(sample_config())
+RESULTS = sample_results()
+
+with open(GOLDEN_PATH, 'r', encoding='utf-8') as f:
+    GOLDEN = json.load(f)['results']
+
+
+def test_metrics_is_not_the_default_with_approximate_widths():
+    with open(text_layout.WIDTHS_PATH, 'r', encoding='utf-8') as f:
+        approximate = json.load(f).get('approximate', False)
+    assert SETTINGS.layout_engine == 'chars' or not approximate
+
+
+def test_golden_covers_the_sample_results():
+    assert sorted(GOLDEN) == sorted(RESULTS)
+
+
+@pytest.mark.parametrize('key', sorted(RESULTS))
+def test_chars_blocs_are_unchanged(key):
+    from slides import split_to_blocs_chars
+
+    assert split_to_blocs_chars(RESULTS[key], SETTINGS) == GOLDEN[key]['chars']
+
+
+@pytest.mark.parametrize('key', sorted(RESULTS))
+def test_metrics_blocs_are_unchanged(key):
+    assert text_layout.layout_blocs(RESULTS[key], SETTINGS.layout) == GOLDEN[key]['metrics']
+
+
+@pytest.mark.parametrize('key', sorted(RESULTS))
+def test_metrics_keeps_the_text_of_the_chars_splitter(key):
+    blocs = text_layout.layout_blocs(RESULTS[key], SETTINGS.layout)
+    assert same_text(GOLDEN[key]['chars'], blocs, SETTINGS.lines_max_chars)
+
+
+@pytest.mark.parametrize('key', sorted(RESULTS))
+def test_metrics_blocs_fit_the_box(key):
+    # Measured with the same widths table as the engine, see test_metrics_is_not_the_default_with_approximate_widths
+    metrics = text_layout.get_metrics()
+    blocs = text_layout.layout_blocs(RESULTS[key], SETTINGS.layout)
+    assert all(bloc_lines(bloc, SETTINGS.layout, metrics) <= SETTINGS.layout.max_lines for bloc in blocs)
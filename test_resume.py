@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+# A deck whose batchUpdate fails halfway is resumed from the journal into the same deck as a clean build
+#   python -m pytest -q test_resume.py
+import contextlib
+import io
+
+import pytest
+
+import fake_google
+import googleapi
+import slides
+from bench_pipeline import BUILDERS, bench_config, synthetic_clients
+from settings import load_settings
+
+
+def deck_slides(backend, settings):
+    # Slide order, then texts and styles of each element, the IDs of the template boxes vary per copy
+    decks = [presentation for presentation_id, presentation in backend.presentations.items()
+             if presentation_id != settings.template_id]
+    assert len(decks) == 1
+    return [(slide['objectId'], [(element['text'], element['styles']) for element in slide['pageElements']])
+            for slide in decks[0]['slides']]
+
+
+def build(version, max_requests, journal_path='', fail_batch_update=None):
+    config = bench_config(version, real_quotas=False)
+    config.read_dict({'SLIDES': {'slides_batch_max_requests': str(max_requests),
+                                 'slides_journal_path': journal_path}})
+    settings = load_settings(config)
+    backend = fake_google.FakeGoogleBackend()
+    backend.add_template(settings.template_id, settings.first_title_page, settings.folder_to_check_id,
+                         fake_google.template_layout(version))
+    googleapi.use_fake_backend(backend)
+    clients = synthetic_clients(1)
+    backend.fail_batch_update = fail_batch_update
+    with contextlib.redirect_stdout(io.StringIO()):
+        slides.results_to_slides(clients, config, version, workers=1)
+    return backend, settings, clients, config
+
+
+@pytest.mark.parametrize('builder', sorted(BUILDERS))
+@pytest.mark.parametrize('max_requests,failing_batch', [(12, 2), (12, 4), (12, 6), (9, 2), (9, 3), (7, 5)])
+def test_resumed_deck_matches_a_clean_build(tmp_path, builder, max_requests, failing_batch):
+    version = BUILDERS[builder]
+    clean_backend, clean_settings, clients, config = build(version, max_requests)
+    clean = deck_slides(clean_backend, clean_settings)
+
+    backend, settings, clients, config = build(version, max_requests, str(tmp_path / 'journal.jsonl'),
+                                               failing_batch)
+    assert backend.errors['400'] == 1
+    assert len(deck_slides(backend, settings)) < len(clean)
+    backend.fail_batch_update = None
+    with contextlib.redirect_stdout(io.StringIO()):
+        slides.results_to_slides(clients, config, version, workers=1)
+    assert deck_slides(backend, settings) == clean
+
+
+def test_split_keeps_the_requests_of_a_slide_together():
+    requests = []
+    for i in range(3):
+        slide_id = slides.object_id('slide', i)
+        slides.duplicate_move_slide_id(requests, 'content_template', slide_id, i)
+        requests.extend(slides.replace_text(slide_id, '{title}', 'Title'))
+        requests.extend(slides.add_paragraph(load_settings(bench_config(BUILDERS['holistic'], False)), slide_id,
+                                             '**Bold** and *italic* text'))
+    per_slide = len(requests) // 3
+    for max_requests in range(1, len(requests) + 1):
+        batches = slides.split_requests_in_batches(requests, max_requests, 1000000)
+        assert [request for batch in batches for request in batch] == requests
+        assert all(len(batch) % per_slide == 0 for batch in batches)
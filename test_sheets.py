@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+# sheets.ClientSheet against the fake worksheet of fake_google
+#   python -m pytest -q test_sheets.py
+import contextlib
+import io
+import time
+
+import pytest
+
+import fake_google
+import googleapi
+import retry
+import sheets
+
+HEADER = ['Name', 'Status', 'Slides link', 'Result A']
+
+
+def make_sheet(rows, **kwargs):
+    worksheet = fake_google.FakeWorksheet([HEADER] + rows)
+    return worksheet, sheets.ClientSheet(worksheet, **kwargs)
+
+
+def client_rows(count):
+    return [['client' + str(i), '', '', 'text'] for i in range(count)]
+
+
+def test_read_clients_is_one_range_read():
+    worksheet, sheet = make_sheet([['a', '', '', 'x'], ['', '', '', ''], ['b', 'old', '', 'y']])
+    clients = sheet.read_clients()
+    assert worksheet.calls['get_values'] == 1
+    assert [client['Name'] for client in clients] == ['a', 'b']
+    # Without a row_id column the sheet row is the row_id, the blank row is skipped
+    assert [client['row_id'] for client in clients] == [2, 4]
+    assert clients[1]['Status'] == 'old'
+
+
+def test_read_clients_uses_the_row_id_column():
+    worksheet = fake_google.FakeWorksheet([HEADER + ['row_id'], ['a', '', '', 'x', '13']])
+    sheet = sheets.ClientSheet(worksheet)
+    assert sheet.read_clients()[0]['row_id'] == '13'
+    sheet.queue_update('13', {'Status': 'done'})
+    sheet.flush()
+    assert worksheet.records()[0]['Status'] == 'done'
+
+
+def test_read_clients_needs_the_write_back_columns():
+    worksheet = fake_google.FakeWorksheet([['Name', 'Status'], ['a', '']])
+    with pytest.raises(ValueError):
+        sheets.ClientSheet(worksheet).read_clients()
+
+
+def test_flush_every_n_clients():
+    worksheet, sheet = make_sheet(client_rows(7), flush_clients=3, flush_seconds=3600)
+    clients = sheet.read_clients()
+    for client in clients:
+        sheet.record_outcome(client, {'status': 'done', 'presentation_id': 'deck' + client['Name']})
+    # 2 full batches of 3 clients, the last client waits for the next flush
+    assert worksheet.calls['batch_update'] == 2
+    assert worksheet.records()[6]['Slides link'] == ''
+    sheet.close()
+    assert worksheet.calls['batch_update'] == 3
+    for row in worksheet.records():
+        assert row['Slides link'] == 'https://docs.google.com/presentation/d/deck' + row['Name'] + '/edit'
+        assert row['Status'] == '[BOT] Slides OK'
+
+
+def test_flush_after_t_seconds():
+    worksheet, sheet = make_sheet(client_rows(2), flush_clients=50, flush_seconds=0.2)
+    clients = sheet.read_clients()
+    sheet.start()
+    try:
+        sheet.record_outcome(clients[0], {'status': 'error', 'error': 'boom'})
+        deadline = time.monotonic() + 5
+        while worksheet.calls['batch_update'] == 0 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert worksheet.calls['batch_update'] == 1
+        assert worksheet.records()[0]['Status'] == '[BOT] Slides error'
+    finally:
+        sheet.close()
+    # Nothing left for the final flush
+    assert worksheet.calls['batch_update'] == 1
+
+
+def test_last_value_of_a_cell_wins():
+    worksheet, sheet = make_sheet(client_rows(1), flush_clients=50)
+    client = sheet.read_clients()[0]
+    sheet.queue_update(client['row_id'], {'Status': 'first'})
+    sheet.queue_update(client['row_id'], {'Status': 'second'})
+    sheet.flush()
+    assert worksheet.calls['batch_update'] == 1
+    assert worksheet.records()[0]['Status'] == 'second'
+
+
+def test_429_is_retried(monkeypatch):
+    monkeypatch.setattr(retry.time, 'sleep', lambda seconds: None)
+    worksheet, sheet = make_sheet(client_rows(1), flush_clients=50)
+    client = sheet.read_clients()[0]
+    worksheet.fail_writes = 1
+    sheet.queue_update(client['row_id'], {'Status': 'done'})
+    assert sheet.flush()
+    assert worksheet.calls['batch_update'] == 2
+    assert worksheet.records()[0]['Status'] == 'done'
+
+
+def test_updates_are_requeued_after_429s(monkeypatch):
+    monkeypatch.setattr(retry.time, 'sleep', lambda seconds: None)
+    worksheet, sheet = make_sheet(client_rows(2), flush_clients=50)
+    clients = sheet.read_clients()
+    worksheet.fail_writes = 100
+    sheet.queue_update(clients[0]['row_id'], {'Status': 'old', 'Slides link': 'link0'})
+    assert not sheet.flush()
+    assert worksheet.records()[0]['Status'] == ''
+    # Kept for the next flush, a value queued meanwhile is newer and wins
+    sheet.queue_update(clients[0]['row_id'], {'Status': 'new'})
+    sheet.queue_update(clients[1]['row_id'], {'Status': 'other'})
+    worksheet.fail_writes = 0
+    writes = worksheet.calls['batch_update']
+    assert sheet.flush()
+    assert worksheet.calls['batch_update'] == writes + 1
+    assert [(row['Status'], row['Slides link']) for row in worksheet.records()] == [('new', 'link0'), ('other', '')]
+
+
+def test_send_and_recall_in_batches():
+    from bench_pipeline import BUILDERS, bench_config, synthetic_clients
+    from bench_sheets import sheet_rows
+    from settings import load_settings
+
+    version = BUILDERS['superpowers']
+    config = bench_config(version, real_quotas=False)
+    settings = load_settings(config)
+    backend = fake_google.FakeGoogleBackend()
+    backend.add_template(settings.template_id, settings.first_title_page, settings.folder_to_check_id,
+                         fake_google.template_layout(version))
+    googleapi.use_fake_backend(backend)
+    worksheet = fake_google.FakeWorksheet(sheet_rows(synthetic_clients(5)))
+    with contextlib.redirect_stdout(io.StringIO()):
+        sheets.run_from_sheet(config, version, worksheet=worksheet)
+    assert len({row['Slides link'] for row in worksheet.records()}) == 5
+
+    # 3 decks checked, the others are left as they are
+    for row in range(2, 5):
+        worksheet.rows[row - 1][worksheet.rows[0].index('Status')] = settings.sheet_status_checked
+    batches = backend.calls['drive.batch']
+    with contextlib.redirect_stdout(io.StringIO()):
+        sheets.send_from_sheet(config, worksheet=worksheet)
+    # Names, moves, renames and shares: one batch request each for the 3 decks
+    assert backend.calls['drive.batch'] - batches == 4
+    for row in worksheet.records():
+        file = backend.files[row['Slides link'].split('/')[-2]]
+        sent = row['Status'] == settings.sheet_status_sent
+        assert file['parents'] == [settings.folder_sent_id if sent else settings.folder_to_check_id]
+        assert (' sent ' in file['name']) == sent
+        assert [permission['emailAddress'] for permission in file.get('permissions', [])] == \
+            ([row['Email']] if sent else [])
+    assert sum(row['Status'] == settings.sheet_status_sent for row in worksheet.records()) == 3
+
+    worksheet.rows[1][worksheet.rows[0].index('Status')] = settings.sheet_status_recall
+    with contextlib.redirect_stdout(io.StringIO()):
+        sheets.send_from_sheet(config, worksheet=worksheet)
+    presentation_id = worksheet.records()[0]['Slides link'].split('/')[-2]
+    assert worksheet.records()[0]['Status'] == settings.sheet_status_recalled
+    assert backend.files[presentation_id]['parents'] == [settings.folder_to_check_id]
+    assert ' tocheck ' in backend.files[presentation_id]['name']
+    assert backend.files[presentation_id].get('permissions') == []
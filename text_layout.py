@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import re
+import unicodedata
+
+# Advance widths of Montserrat Regular in font units (1000 per em). The bundled table is
+# approximate ("approximate": true), build_widths_table makes the exact one from the TTF.
+# Characters missing from the table use their base letter (é -> e) or DEFAULT_WIDTH.
+WIDTHS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fonts', 'montserrat_widths.json')
+DEFAULT_WIDTH = 620
+WIDE_WIDTH = 1000  # emoji and other symbols outside the table
+# Montserrat ascent + descent, the height of one line at 100% line spacing
+LINE_HEIGHT_EM = 1.219
+# Bold glyphs are wider, bold words are measured with this factor
+BOLD_FACTOR = 1.06
+# Default inner padding of a Slides text box, left+right and top+bottom
+BOX_INSET_PT = 14.4
+
+SENTENCE_ENDS = ('.', '!', '?', '…')
+
+
+def load_widths(path=WIDTHS_PATH):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)['widths']
+
+
+def build_widths_table(font_path, path=WIDTHS_PATH):
+    # Regenerates the bundled table from the font file (needs fontTools)
+    from fontTools.ttLib import TTFont
+
+    font = TTFont(font_path)
+    scale = 1000.0 / font['head'].unitsPerEm
+    glyph_widths = font['hmtx'].metrics
+    widths = {}
+    for code, glyph in font.getBestCmap().items():
+        char = chr(code)
+        if code < 0x250 or char in '‘’“”–—…•✮€':
+            widths[char] = round(glyph_widths[glyph][0] * scale)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'font': os.path.basename(font_path), 'approximate': False, 'units_per_em': 1000,
+                   'widths': widths}, f, ensure_ascii=False, indent=1, sort_keys=True)
+
+
+class LayoutSettings:
+    __slots__ = ('font_size', 'box_width', 'box_height', 'line_spacing', 'title_paragraph_min_space',
+                 'paragraphs_min_space', 'max_width', 'max_lines')
+
+    def __init__(self, font_size, box_width, box_height, line_spacing=1.0, title_paragraph_min_space=3,
+                 paragraphs_min_space=2):
+        self.font_size = font_size
+        self.box_width = box_width
+        self.box_height = box_height
+        self.line_spacing = line_spacing
+        self.title_paragraph_min_space = title_paragraph_min_space
+        self.paragraphs_min_space = paragraphs_min_space
+        # Widths are kept in font units so measuring a word is a sum of integers
+        self.max_width = (box_width - BOX_INSET_PT) * 1000.0 / font_size
+        self.max_lines = max(1, int((box_height - BOX_INSET_PT) // (font_size * LINE_HEIGHT_EM * line_spacing)))
+
+    def key(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+
+class FontMetrics:
+    def __init__(self, widths=None):
+        self.widths = widths if widths is not None else load_widths()
+        self.space = self.widths[' ']
+        self.word_cache = {}
+
+    def char_width(self, char):
+        width = self.widths.get(char)
+        if width is None:
+            base = unicodedata.normalize('NFD', char)[0]
+            width = self.widths.get(base)
+            if width is None:
+                width = WIDE_WIDTH if ord(char) > 0x2000 else DEFAULT_WIDTH
+            self.widths[char] = width
+        return width
+
+    def word_width(self, word):
+        # Words repeat a lot across results, the width of each one is computed once
+        width = self.word_cache.get(word)
+        if width is None:
+            plain = word.replace('*', '')
+            width = sum(self.char_width(char) for char in plain)
+            if '**' in word:
+                width *= BOLD_FACTOR
+            self.word_cache[word] = width
+        return width
+
+
+_metrics = None
+
+
+def get_metrics():
+    global _metrics
+    if _metrics is None:
+        _metrics = FontMetrics()
+    return _metrics
+
+
+def clean_text(text):
+    # Same cleaning as the character based splitter
+    text = text.strip('"')
+    text = text.replace(' - ', ', ')
+    text = re.sub(r'\b(\w+)\s+-\s+(\w+)\b', r'\1-\2', text)
+    text = re.sub(r'\[.*?\]', '', text)
+    text = text.replace('{', '').replace('}', '').strip()
+    text = re.sub(r'\n\s*\n[\s\n]*', '\n\n', text)
+    return text
+
+
+def wrap_words(words, metrics, max_width):
+    # Greedy wrap, returns the number of words of each line
+    lines = []
+    line_width = 0.0
+    count = 0
+    for word in words:
+        width = metrics.word_width(word)
+        if count and line_width + metrics.space + width > max_width:
+            lines.append(count)
+            line_width = width
+            count = 1
+        else:
+            line_width += (metrics.space + width) if count else width
+            count += 1
+    if count:
+        lines.append(count)
+    return lines
+
+
+def is_title(words, lines):
+    # A title is a single line that does not end like a sentence
+    return len(lines) == 1 and not words[-1].rstrip('*').endswith(SENTENCE_ENDS + (',', ';', ':'))
+
+
+def split_point(words, lines, free_lines):
+    # Number of words that fit in free_lines, moved back to the last sentence end
+    # if that keeps at least half of the free lines filled
+    fit = sum(lines[:free_lines])
+    for i in range(fit - 1, sum(lines[:(free_lines + 1) // 2]) - 1, -1):
+        if words[i].rstrip('*').endswith(SENTENCE_ENDS):
+            return i + 1
+    return fit
+
+
+def layout_blocs(text, settings, metrics=None):
+    # Packs the paragraphs of text into blocs that fit the paragraph box of a slide
+    metrics = metrics or get_metrics()
+    blocs = []
+    bloc = []
+    used = 0
+
+    def close_bloc():
+        nonlocal bloc, used
+        if bloc:
+            blocs.append('\n\n'.join(bloc))
+        bloc = []
+        used = 0
+
+    for element in clean_text(text).split('\n\n'):
+        words = element.split()
+        if not words:
+            continue
+        lines = wrap_words(words, metrics, settings.max_width)
+        # A blank line separates the element from the previous one
+        gap = 1 if bloc else 0
+
+        if is_title(words, lines):
+            # Keep the title with the start of the next paragraph
+            if used + gap + 1 + settings.title_paragraph_min_space > settings.max_lines:
+                close_bloc()
+                gap = 0
+            bloc.append(' '.join(words))
+            used += gap + 1
+            continue
+
+        while words:
+            free_lines = settings.max_lines - used - gap
+            if len(lines) <= free_lines:
+                bloc.append(' '.join(words))
+                used += gap + len(lines)
+                break
+            if bloc and free_lines < settings.paragraphs_min_space:
+                close_bloc()
+                gap = 0
+                continue
+            cut = split_point(words, lines, free_lines)
+            bloc.append(' '.join(words[:cut]))
+            close_bloc()
+            words = words[cut:]
+            lines = wrap_words(words, metrics, settings.max_width)
+            gap = 0
+
+    close_bloc()
+    return blocs
+
+
+if __name__ == '__main__':
+    import sys
+
+    build_widths_table(sys.argv[1])
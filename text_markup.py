@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+import re
+
+# '**bold**', '*italic*' and '✮bold✮' (the stars are kept and bolded too)
+MARKER_PATTERN = re.compile(r'\*+|✮')
+STAR = '✮'
+# Longer '**' spans are most likely a missing closing marker, they are not bolded
+BOLD_MAX_CHARS = 90
+
+STYLE_OF = {'bold': 'bold', 'star': 'bold', 'italic': 'italic'}
+
+
+def utf16_len(text):
+    # Slides API indexes count UTF-16 code units, characters outside the BMP count twice
+    return len(text) + sum(1 for char in text if ord(char) > 0xFFFF)
+
+
+def find_markers(text):
+    markers = []
+    for match in MARKER_PATTERN.finditer(text):
+        run = match.group()
+        if run == STAR:
+            kind = 'star'
+        elif len(run) == 2:
+            kind = 'bold'
+        elif len(run) == 1:
+            kind = 'italic'
+        else:
+            kind = 'drop'  # '***' and longer runs are removed
+        markers.append([kind, match.start(), match.end(), None])
+    return markers
+
+
+def pair_markers(text, markers):
+    # Sets the role of each marker: 'open', 'close', or None when it has no pair
+    pending = {}
+    for marker in markers:
+        kind, start, end, role = marker
+        if kind == 'drop':
+            continue
+        opener = pending.get(kind)
+        if kind == 'italic':
+            # '*' only counts when it hugs a word, like markdown
+            if opener is None:
+                if end < len(text) and not text[end].isspace():
+                    pending[kind] = marker
+                continue
+            if start == 0 or text[start - 1].isspace():
+                continue
+        if opener is None:
+            pending[kind] = marker
+        else:
+            opener[3] = 'open'
+            marker[3] = 'close'
+            pending[kind] = None
+            if kind == 'bold' and start - opener[2] >= BOLD_MAX_CHARS:
+                opener[3] = marker[3] = 'drop'
+
+
+def parse_markup(text):
+    # Linear pass over the text, returns the text without markup and the merged
+    # style ranges as (start, end, styles) in UTF-16 indexes
+    markers = find_markers(text)
+    pair_markers(text, markers)
+
+    parts = []
+    ranges = []
+    position = 0
+    cursor = 0
+    depth = {'bold': 0, 'italic': 0}
+
+    def emit(segment):
+        nonlocal position
+        if not segment:
+            return
+        length = utf16_len(segment)
+        styles = frozenset(name for name, level in depth.items() if level)
+        if styles:
+            # Adjacent spans with the same style become one range
+            if ranges and ranges[-1][1] == position and ranges[-1][2] == styles:
+                ranges[-1][1] += length
+            else:
+                ranges.append([position, position + length, styles])
+        parts.append(segment)
+        position += length
+
+    for kind, start, end, role in markers:
+        emit(text[cursor:start])
+        cursor = end
+        if kind == 'drop' or role == 'drop':
+            continue
+        if role is None:
+            # Unpaired: '**' is removed like before, '*' and '✮' stay as text
+            if kind != 'bold':
+                emit(text[start:end])
+            continue
+        style = STYLE_OF[kind]
+        if role == 'open':
+            depth[style] += 1
+            if kind == 'star':
+                emit(text[start:end])
+        else:
+            if kind == 'star':
+                emit(text[start:end])
+            depth[style] -= 1
+    emit(text[cursor:])
+
+    return ''.join(parts), [(start, end, styles) for start, end, styles in ranges]
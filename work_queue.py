@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+# Durable work queue of clients in a SQLite file, shared by any number of worker processes.
+# A worker leases a few clients at a time, renews the leases while it builds their decks
+# and writes back the outcome. The clients of a worker that died are leased again once
+# their lease expires. Workers sharing one journal file resume each other's decks.
+# By default the file is in WAL mode, for workers of one host with the file on a local disk:
+# WAL needs shared memory and does not work over a network filesystem. With --shared the
+# file uses a rollback journal and workers on several hosts can share it on a filesystem
+# with working POSIX locks (e.g. NFSv4), with the clocks of the hosts in sync (NTP), the
+# leases are compared to the local time. Every command on one queue uses the same mode.
+#   python work_queue.py enqueue slides_queue.db output.jsonl [--shared]
+#   python work_queue.py work slides_queue.db --config slides.ini [--worker-id node1] [--shared]
+#   python work_queue.py status slides_queue.db
+#   python work_queue.py retry-failed slides_queue.db
+import argparse
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import journal
+import slides
+from convertTxtToJson import iter_clients
+from settings import FileConfig
+
+LEASE_SECONDS = 300
+MAX_ATTEMPTS = 3
+POLL_SECONDS = 5
+REPORT_SECONDS = 30
+STATES = ('pending', 'leased', 'done', 'failed')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    key TEXT PRIMARY KEY,
+    row_id TEXT,
+    client TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    owner TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    outcome TEXT,
+    presentation_id TEXT,
+    updated REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, lease_expires);
+'''
+
+
+def job_key(client):
+    return str(client['row_id']) + ':' + client['UID']
+
+
+class WorkQueue:
+    def __init__(self, path, lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS, shared=False):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.lock = threading.Lock()
+        # Transactions are explicit, BEGIN IMMEDIATE takes the write lock before the claim reads
+        self.db = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        # WAL: readers do not block the writer, only for processes of one host (see above)
+        self.db.execute('PRAGMA journal_mode=' + ('DELETE' if shared else 'WAL'))
+        self.db.executescript(SCHEMA)
+
+    def transaction(self, function, *args):
+        with self.lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                result = function(*args)
+            except BaseException:
+                self.db.execute('ROLLBACK')
+                raise
+            self.db.execute('COMMIT')
+            return result
+
+    def enqueue(self, clients, chunk_size=1000):
+        # Clients already in the queue are left as they are, enqueueing the same export twice is harmless
+        added = 0
+        chunk = []
+        for client in clients:
+            chunk.append((job_key(client), str(client['row_id']), json.dumps(client, ensure_ascii=False),
+                          time.time()))
+            if len(chunk) >= chunk_size:
+                added += self.transaction(self.insert, chunk)
+                chunk = []
+        if chunk:
+            added += self.transaction(self.insert, chunk)
+        return added
+
+    def insert(self, rows):
+        before = self.db.total_changes
+        self.db.executemany('INSERT OR IGNORE INTO jobs (key, row_id, client, updated) VALUES (?, ?, ?, ?)', rows)
+        return self.db.total_changes - before
+
+    def claim(self, owner, count):
+        # [(key, client)] newly leased to owner, oldest first
+        return self.transaction(self._claim, owner, count)
+
+    def _claim(self, owner, count):
+        now = time.time()
+        # Clients whose worker died on every attempt are not leased again
+        self.db.execute("UPDATE jobs SET state = 'failed', owner = NULL, outcome = 'lease expired', updated = ? "
+                        "WHERE state = 'leased' AND lease_expires < ? AND attempts >= ?",
+                        (now, now, self.max_attempts))
+        rows = self.db.execute("SELECT key, client FROM jobs WHERE state = 'pending' "
+                               "OR (state = 'leased' AND lease_expires < ?) ORDER BY rowid LIMIT ?",
+                               (now, count)).fetchall()
+        self.db.executemany("UPDATE jobs SET state = 'leased', owner = ?, lease_expires = ?, "
+                            "attempts = attempts + 1, updated = ? WHERE key = ?",
+                            [(owner, now + self.lease_seconds, now, key) for key, client in rows])
+        return [(key, json.loads(client)) for key, client in rows]
+
+    def heartbeat(self, owner):
+        # Renews every lease of owner, returns how many it holds
+        now = time.time()
+        with self.lock:
+            return self.db.execute("UPDATE jobs SET lease_expires = ? WHERE owner = ? AND state = 'leased'",
+                                   (now + self.lease_seconds, owner)).rowcount
+
+    def complete(self, key, owner, outcome):
+        # outcome is the dict returned by make_client_slides. A failed client goes back to
+        # pending until max_attempts. False if the lease was lost to another worker.
+        return self.transaction(self._complete, key, owner, outcome)
+
+    def _complete(self, key, owner, outcome):
+        row = self.db.execute('SELECT owner, attempts FROM jobs WHERE key = ?', (key,)).fetchone()
+        if row is None or row[0] != owner:
+            return False
+        if outcome['status'] == 'error':
+            state = 'failed' if row[1] >= self.max_attempts else 'pending'
+        else:
+            state = 'done'
+        self.db.execute('UPDATE jobs SET state = ?, owner = NULL, lease_expires = NULL, outcome = ?, '
+                        'presentation_id = COALESCE(?, presentation_id), updated = ? WHERE key = ?',
+                        (state, outcome.get('error') or outcome['status'], outcome.get('presentation_id'),
+                         time.time(), key))
+        return True
+
+    def counts(self):
+        with self.lock:
+            counts = dict.fromkeys(STATES, 0)
+            counts.update(self.db.execute('SELECT state, COUNT(*) FROM jobs GROUP BY state').fetchall())
+            return counts
+
+    def retry_failed(self):
+        with self.lock:
+            return self.db.execute("UPDATE jobs SET state = 'pending', attempts = 0, updated = ? "
+                                   "WHERE state = 'failed'", (time.time(),)).rowcount
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+def format_counts(counts):
+    return ', '.join(str(counts[state]) + ' ' + state for state in STATES)
+
+
+class Heartbeat:
+    # Renews the leases of a worker every third of the lease duration
+    def __init__(self, queue, owner):
+        self.queue = queue
+        self.owner = owner
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='queue-heartbeat', daemon=True)
+
+    def run(self):
+        while not self.stopped.wait(self.queue.lease_seconds / 3):
+            try:
+                self.queue.heartbeat(self.owner)
+            except sqlite3.Error as e:
+                print('[WARNING]⚠️ Queue heartbeat failed: ' + repr(e))
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+
+
+def run_worker(queue_path, config, worker_id=None, lease_seconds=LEASE_SECONDS, poll_seconds=POLL_SECONDS,
+               report_seconds=REPORT_SECONDS, shared=False):
+    # Builds the decks of the queue until no client is pending or leased, settings.workers at a time
+    settings = slides.configure_run(config)
+    queue = WorkQueue(queue_path, lease_seconds, shared=shared)
+    owner = worker_id or socket.gethostname() + ':' + str(os.getpid())
+    print('[INFO]🖼️▶️ Queue worker ' + owner + ' on ' + queue_path + ': ' + format_counts(queue.counts()))
+
+    start = time.monotonic()
+    last_report = start
+    finished = 0
+    outcomes = {}
+    try:
+        with slides.open_run(settings), Heartbeat(queue, owner), \
+                ThreadPoolExecutor(max_workers=settings.workers) as executor:
+            running = {}
+            while True:
+                free = settings.workers - len(running)
+                claimed = queue.claim(owner, free) if free > 0 else []
+                if claimed and journal.get_journal():
+                    # Another worker may have started some of these decks before its lease expired
+                    journal.get_journal().refresh()
+                for key, client in claimed:
+                    jobs = list(slides.iter_client_jobs([client], settings, settings.version))
+                    if jobs:
+                        running[executor.submit(slides.make_client_slides, *jobs[0])] = key
+                    else:
+                        queue.complete(key, owner, {'status': 'skipped'})
+
+                if running:
+                    done, pending = wait(running, timeout=poll_seconds, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        key = running.pop(future)
+                        try:
+                            outcome = future.result() or {'status': 'error', 'error': 'no outcome'}
+                        except Exception as e:
+                            outcome = {'status': 'error', 'error': repr(e)}
+                        if not queue.complete(key, owner, outcome):
+                            print('[WARNING]⚠️ Lease of ' + key + ' was lost, outcome not recorded')
+                        outcomes[outcome['status']] = outcomes.get(outcome['status'], 0) + 1
+                        finished += 1
+                elif not claimed:
+                    counts = queue.counts()
+                    if counts['pending'] == 0 and counts['leased'] == 0:
+                        break
+                    # Clients leased by other workers, taken over if their lease expires
+                    time.sleep(poll_seconds)
+
+                if time.monotonic() - last_report >= report_seconds:
+                    last_report = time.monotonic()
+                    report_progress(owner, finished, last_report - start, outcomes, queue.counts())
+    finally:
+        report_progress(owner, finished, time.monotonic() - start, outcomes, queue.counts())
+        queue.close()
+    return outcomes
+
+
+def report_progress(owner, finished, seconds, outcomes, counts):
+    rate = finished / seconds * 60 if seconds > 0 else 0.0
+    print('[INFO]🖼️📊 Worker ' + owner + ': ' + str(finished) + ' client(s) in ' + str(round(seconds))
+          + ' s (' + str(round(rate, 1)) + '/min) ' + json.dumps(outcomes) + ' | queue: ' + format_counts(counts))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SQLite work queue of the slides decks')
+    parser.add_argument('command', choices=('enqueue', 'work', 'status', 'retry-failed'))
+    parser.add_argument('queue', help='SQLite file of the queue')
+    parser.add_argument('clients', nargs='?', help='export to enqueue (.txt, .json or .jsonl)')
+    parser.add_argument('--config', help='INI file of the settings, for work')
+    parser.add_argument('--worker-id', help='name of this worker, host:pid by default')
+    parser.add_argument('--lease-seconds', type=int, default=LEASE_SECONDS)
+    parser.add_argument('--shared', action='store_true', help='queue file shared by workers on several hosts')
+    args = parser.parse_args()
+
+    if args.command == 'work':
+        if not args.config:
+            parser.error('work needs --config')
+        config = FileConfig()
+        if not config.read(args.config, encoding='utf-8'):
+            parser.error('cannot read ' + args.config)
+        run_worker(args.queue, config, args.worker_id, args.lease_seconds, shared=args.shared)
+        return
+
+    queue = WorkQueue(args.queue, args.lease_seconds, shared=args.shared)
+    try:
+        if args.command == 'enqueue':
+            if not args.clients:
+                parser.error('enqueue needs the clients export')
+            print(str(queue.enqueue(iter_clients(args.clients))) + ' client(s) added')
+        elif args.command == 'retry-failed':
+            print(str(queue.retry_failed()) + ' failed client(s) back to pending')
+        print('queue: ' + format_counts(queue.counts()))
+    finally:
+        queue.close()
+
+
+if __name__ == '__main__':
+    main()